@@ -0,0 +1,199 @@
+import argparse
+import time
+import torch
+from scipy.optimize import linear_sum_assignment
+import Constants
+from BoxMatching import auction_match, greedy_match, hungarian_match, matchers
+from CombinedLoss import CombinedLoss, match_boxes
+from DetectionDecoder import DetectionDecoder
+from DetectorBuilder import build_text_detector
+from OCRPipeline import load_anchor_boxes
+
+
+def random_targets(batch_size, num_boxes, anchor_boxes, image_size=Constants.desired_size, generator=None):
+    """
+    Random text-like boxes per image, split into the three scale lists by the nearest anchor like
+    CustomImageDataset and zero padded per scale like custom_collate_fn.
+    """
+    anchor_sizes = anchor_boxes.cpu().view(3, 3, 2) * image_size  # [scale, anchor, (w, h)]
+    per_scale = [[], [], []]
+    for _ in range(batch_size):
+        sizes = torch.rand(num_boxes, 2, generator=generator) * torch.tensor([120.0, 30.0]) + torch.tensor([10.0, 8.0])
+        corners = torch.rand(num_boxes, 2, generator=generator) * (image_size - sizes)
+        boxes = torch.cat([corners, corners + sizes], dim=1)
+        distances = torch.norm(anchor_sizes.unsqueeze(0) - sizes.view(-1, 1, 1, 2), dim=3).amin(dim=2)  # [boxes, scale]
+        scales = distances.argmin(dim=1)
+        for scale in range(3):
+            per_scale[scale].append(boxes[scales == scale])
+
+    targets = []
+    for scale_boxes in per_scale:
+        most = max(len(boxes) for boxes in scale_boxes)
+        targets.append(torch.stack([torch.cat([boxes, torch.zeros(most - len(boxes), 4)]) for boxes in scale_boxes]))
+    return targets
+
+
+def assignment_total(score, matched_gt):
+    """
+    Summed score [M, N] of a matched_gt [N] assignment of one image.
+    """
+    preds = torch.nonzero(matched_gt >= 0).squeeze(1)
+    return float(score[matched_gt[preds], preds].sum())
+
+
+def check_matchers(trials=50, max_gts=8, max_preds=60, auction_eps=0.002, seed=0):
+    """
+    Compare the one-to-one matchers with linear_sum_assignment on small random DIoU-like score matrices
+    (fewer ground truths than predictions, as in the loss). hungarian must reach the optimum and auction must stay
+    within num_gts * auction_eps of it on every matrix; greedy has no bound and is only reported.
+
+    Returns:
+    - report: Dict of matcher name to (largest shortfall of its summed score from the optimum, whether every
+      trial was within its bound, or None for greedy).
+    """
+    generator = torch.Generator().manual_seed(seed)
+    one_to_one = {
+        "hungarian": hungarian_match,
+        "auction": lambda score, candidates, valid, num_preds: auction_match(score, candidates, valid, num_preds, eps=auction_eps),
+        "greedy": greedy_match,
+    }
+    gaps = {name: 0.0 for name in one_to_one}
+    within = {"hungarian": True, "auction": True}
+    for _ in range(trials):
+        num_gts = int(torch.randint(1, max_gts + 1, (1,), generator=generator))
+        num_preds = int(torch.randint(num_gts, max_preds + 1, (1,), generator=generator))
+        score = torch.rand(num_gts, num_preds, generator=generator) * 2 - 1
+        rows, cols = linear_sum_assignment(score.numpy(), maximize=True)
+        optimum = float(score[rows, cols].sum())
+        valid = torch.ones(1, num_gts, dtype=torch.bool)
+        # 1e-4 of slack for the float32 sums
+        bounds = {"hungarian": 1e-4, "auction": num_gts * auction_eps + 1e-4}
+        for name, matcher in one_to_one.items():
+            matched_gt = matcher(score.unsqueeze(0), None, valid, num_preds)[0]
+            gap = optimum - assignment_total(score, matched_gt)
+            gaps[name] = max(gaps[name], gap)
+            if name in bounds:
+                within[name] = within[name] and gap <= bounds[name]
+    return {name: (gaps[name], within.get(name)) for name in one_to_one}
+
+
+@torch.no_grad()
+def check_candidates(cnn_model, batches, anchor_boxes, device, candidate_window=5, candidate_radius=2.5):
+    """
+    How many of the (prediction, ground truth) pairs the dense hungarian matching finds are still found when each
+    box is only matched against its grid candidates, on the detector's predictions for the given batches.
+
+    Returns:
+    - agreement: Float, the share of dense pairs also in the windowed matching (1.0 means the same assignments).
+    """
+    decoder = DetectionDecoder(anchor_boxes)
+    same = 0
+    total = 0
+    for images, targets in batches:
+        outputs = cnn_model(images.to(device))
+        decoded = decoder.decode(outputs).split(decoder.scale_sizes(outputs), dim=1)
+        for scale, (output, pred_boxes, target_boxes) in enumerate(zip(outputs, decoded, targets)):
+            if target_boxes.shape[1] == 0:
+                continue
+            target_boxes = target_boxes.to(device)
+            dense = match_boxes(pred_boxes, target_boxes)
+            windowed = match_boxes(pred_boxes, target_boxes, grid_shape=output.shape[1:4],
+                                   candidate_window=candidate_window, candidate_radius=candidate_radius)
+            dense_pairs = {tuple(row) for row in torch.cat(dense[:2], dim=1).tolist()}
+            windowed_pairs = {tuple(row) for row in torch.cat(windowed[:2], dim=1).tolist()}
+            same += len(dense_pairs & windowed_pairs)
+            total += len(dense_pairs)
+    return same / total if total else 1.0
+
+
+def synchronize(device):
+    if device.type == "cuda":
+        torch.cuda.synchronize(device)
+
+
+def run_matcher(name, batches, anchor_boxes, device, checkpoint=None, candidate_window=None, learning_rate=0.00022, seed=0):
+    """
+    Train a detector from the same starting weights with the loss using one matcher.
+
+    Returns:
+    - report: Dict with step_ms (forward, loss, backward and update), loss_ms and the loss of every step.
+    """
+    torch.manual_seed(seed)
+    cnn_model = build_text_detector(anchor_boxes)
+    if checkpoint:
+        cnn_model.load_state_dict(torch.load(checkpoint, map_location="cpu")["model_state_dict"])
+    cnn_model = cnn_model.to(device).train()
+    criterion = CombinedLoss(anchor_boxes=anchor_boxes, matcher=name, candidate_window=candidate_window).to(device)
+    optimizer = torch.optim.Adam(cnn_model.parameters(), lr=learning_rate, weight_decay=1e-4)
+
+    losses = []
+    step_time = 0.0
+    loss_time = 0.0
+    for images, targets in batches:
+        # The loss replaces the entries of the target list, so every step gets its own list
+        targets = [boxes.to(device) for boxes in targets]
+        synchronize(device)
+        began = time.perf_counter()
+        outputs = cnn_model(images.to(device))
+        synchronize(device)
+        loss_began = time.perf_counter()
+        loss = criterion(outputs, targets)
+        synchronize(device)
+        loss_time += time.perf_counter() - loss_began
+
+        optimizer.zero_grad()
+        loss.backward()
+        optimizer.step()
+        synchronize(device)
+        step_time += time.perf_counter() - began
+        losses.append(loss.item())
+
+    return {
+        "step_ms": step_time / len(batches) * 1000,
+        "loss_ms": loss_time / len(batches) * 1000,
+        "losses": losses,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Train the detector for a few steps with each box matcher of the loss and compare step time and loss.")
+    parser.add_argument("--matchers", nargs="+", default=list(matchers), choices=list(matchers))
+    parser.add_argument("--steps", type=int, default=20)
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--boxes", type=int, default=60, help="Ground-truth boxes per image, over all scales.")
+    parser.add_argument("--checkpoint", default=None, help="Start from trained weights instead of a fresh detector.")
+    parser.add_argument("--device", default="cuda" if torch.cuda.is_available() else "cpu")
+    parser.add_argument("--candidate-window", type=int, default=0, help="Cell window of the matching candidates, 0 to match against every prediction.")
+    parser.add_argument("--final-steps", type=int, default=5, help="The final loss is the mean over this many last steps.")
+    parser.add_argument("--check-trials", type=int, default=50, help="Random matrices the matchers are checked against linear_sum_assignment on.")
+    parser.add_argument("--check-gts", type=int, default=8, help="Most ground truths of the random matrices of the check.")
+    parser.add_argument("--auction-eps", type=float, default=0.002, help="eps of auction_match in the check; its bound is num_gts * eps.")
+    args = parser.parse_args()
+
+    print(f"{'matcher':<10} {'worst gap to linear_sum_assignment':>35} {'ok':>5}")
+    for name, (gap, ok) in check_matchers(args.check_trials, args.check_gts, auction_eps=args.auction_eps).items():
+        print(f"{name:<10} {gap:35.4f} {'-' if ok is None else str(ok):>5}")
+    print()
+
+    device = torch.device(args.device)
+    anchor_boxes = load_anchor_boxes(device=device)
+
+    # The same images and boxes, in the same order, for every matcher
+    generator = torch.Generator().manual_seed(0)
+    batches = [(torch.randn(args.batch_size, 3, Constants.desired_size, Constants.desired_size, generator=generator),
+                random_targets(args.batch_size, args.boxes, anchor_boxes, generator=generator))
+               for _ in range(args.steps)]
+
+    if args.candidate_window:
+        cnn_model = build_text_detector(anchor_boxes)
+        if args.checkpoint:
+            cnn_model.load_state_dict(torch.load(args.checkpoint, map_location="cpu")["model_state_dict"])
+        agreement = check_candidates(cnn_model.to(device).eval(), batches[:2], anchor_boxes, device, args.candidate_window)
+        print(f"{agreement * 100:.2f}% of the dense hungarian pairs are kept with a {args.candidate_window}x{args.candidate_window} candidate window")
+        print()
+
+    print(f"{'matcher':<10} {'ms/step':>9} {'loss ms':>9} {'first loss':>11} {'final loss':>11}")
+    for name in args.matchers:
+        report = run_matcher(name, batches, anchor_boxes, device, args.checkpoint, args.candidate_window or None)
+        final = report["losses"][-args.final_steps:]
+        print(f"{name:<10} {report['step_ms']:9.1f} {report['loss_ms']:9.1f} {report['losses'][0]:11.4f} {sum(final) / len(final):11.4f}")
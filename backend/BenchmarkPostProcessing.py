@@ -0,0 +1,83 @@
+import argparse
+import time
+import torch
+import Constants
+from PostProcessing import remove_contained_boxes, remove_contained_boxes_loop, weighted_box_fusion, weighted_box_fusion_loop, \
+    combine_boxes, cluster_boxes
+
+
+def random_boxes(num_boxes, image_size=Constants.desired_size, seed=0):
+    """
+    Random boxes shaped like dense document text: many small wide boxes, with jittered near-duplicates
+    (the kind WBF fuses) and boxes nested inside others (the kind remove_contained_boxes drops).
+    """
+    generator = torch.Generator().manual_seed(seed)
+    centers = torch.rand(num_boxes, 2, generator=generator) * image_size
+    sizes = torch.rand(num_boxes, 2, generator=generator) * torch.tensor([60.0, 16.0]) + torch.tensor([8.0, 6.0])
+
+    # A quarter of the boxes are small shifts of an earlier box
+    duplicates = torch.arange(num_boxes) % 4 == 3
+    centers[duplicates] = centers[torch.nonzero(duplicates).squeeze(1) - 1] + torch.rand(int(duplicates.sum()), 2, generator=generator)
+    # Another quarter sit inside an earlier box
+    nested = torch.arange(num_boxes) % 4 == 2
+    sizes[nested] = sizes[torch.nonzero(nested).squeeze(1) - 1] * 0.5
+    centers[nested] = centers[torch.nonzero(nested).squeeze(1) - 1]
+
+    boxes = torch.cat([centers - sizes / 2, centers + sizes / 2], dim=1)
+    confidences = 0.9 + 0.1 * torch.rand(num_boxes, 1, generator=generator)
+    return boxes, confidences
+
+
+def time_function(function, *args, repeats=1):
+    start = time.perf_counter()
+    for _ in range(repeats):
+        result = function(*args)
+    return (time.perf_counter() - start) / repeats * 1000, result
+
+
+def same_result(result1, result2):
+    return all(torch.equal(a, b) for a, b in zip(result1, result2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time the box post-processing steps on 100 to 20k boxes against their original loop versions.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 500, 1000, 2000, 5000, 10000, 20000])
+    parser.add_argument("--max-reference", type=int, default=2000, help="Largest N the O(N^2) Python loop versions are run on.")
+    parser.add_argument("--iou-threshold", type=float, default=0.9)
+    parser.add_argument("--overlap-threshold", type=float, default=0.35)
+    args = parser.parse_args()
+
+    print(f"{'N':>6} | {'contained loop':>14} {'tensor':>9} {'same':>5} | {'WBF loop':>9} {'tensor':>9} {'same':>5}")
+    for num_boxes in args.sizes:
+        boxes, confidences = random_boxes(num_boxes)
+
+        contained_ms, contained_result = time_function(remove_contained_boxes, boxes, confidences)
+        wbf_ms, wbf_result = time_function(weighted_box_fusion, boxes, confidences, args.iou_threshold)
+
+        if num_boxes <= args.max_reference:
+            contained_loop_ms, contained_loop_result = time_function(remove_contained_boxes_loop, boxes, confidences)
+            wbf_loop_ms, wbf_loop_result = time_function(weighted_box_fusion_loop, boxes, confidences, args.iou_threshold)
+            contained_columns = f"{contained_loop_ms:12.1f}ms {contained_ms:7.1f}ms {str(same_result(contained_result, contained_loop_result)):>5}"
+            wbf_columns = f"{wbf_loop_ms:7.1f}ms {wbf_ms:7.1f}ms {str(same_result(wbf_result, wbf_loop_result)):>5}"
+        else:
+            contained_columns = f"{'-':>14} {contained_ms:7.1f}ms {'-':>5}"
+            wbf_columns = f"{'-':>9} {wbf_ms:7.1f}ms {'-':>5}"
+
+        print(f"{num_boxes:>6} | {contained_columns} | {wbf_columns}")
+
+    # cluster_boxes merges connected components, so its output is expected to differ from the chained greedy calls
+    print()
+    print(f"{'N':>6} | {'combine 0.7+0.35':>16} {'boxes':>6} | {'cluster_boxes':>13} {'boxes':>6}")
+    for num_boxes in args.sizes:
+        boxes, confidences = random_boxes(num_boxes)
+
+        cluster_ms, (cluster_result, _) = time_function(cluster_boxes, boxes, confidences, args.overlap_threshold)
+        if num_boxes <= args.max_reference:
+            start = time.perf_counter()
+            combined = combine_boxes(*combine_boxes(boxes, confidences, 0.7), args.overlap_threshold)
+            combine_ms = (time.perf_counter() - start) * 1000
+            combine_columns = f"{combine_ms:14.1f}ms {combined[0].size(0):>6}"
+        else:
+            combine_columns = f"{'-':>16} {'-':>6}"
+
+        print(f"{num_boxes:>6} | {combine_columns} | {cluster_ms:11.1f}ms {cluster_result.size(0):>6}")
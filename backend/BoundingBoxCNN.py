@@ -19,6 +19,8 @@ from datetime import datetime
 from torch.nn.utils.rnn import pad_sequence
 import torch.profiler
 from CombinedLoss import *
+from DetectorBuilder import build_text_detector
+from TargetEncoding import TargetEncoder, collate_encoded_targets
 import Constants
 import math
 from torch.optim.lr_scheduler import SequentialLR, LinearLR, ReduceLROnPlateau
@@ -344,7 +346,7 @@ def extract_top_bboxes2(pred_tensor, max_boxes=35):
 
 
 def get_nth_image(data_loader, n):
-    for i, (images, bboxes, paths) in enumerate(data_loader):
+    for i, (images, bboxes, paths, *_) in enumerate(data_loader):
         bboxes = torch.cat(bboxes, dim=1)[n]
         mask = (bboxes != 0).any(dim=1) 
         return images[n], bboxes[mask], paths[n]  # Return the nth image and label
@@ -449,7 +451,7 @@ def train(model, loader, criterion, optimizer, optionalLoader=None):
 
     #for images, bboxes in loader:
     start_time = time.time()
-    for batch_idx, (images, bboxes, _) in enumerate(loader):
+    for batch_idx, (images, bboxes, _, *encoded_targets) in enumerate(loader):
         data_time = time.time() - start_time
         # Forward pass: compute model outputs (bounding box coordinates)
         i+=1
@@ -516,6 +518,8 @@ def train(model, loader, criterion, optimizer, optionalLoader=None):
         images = images.to(device)
         for i in range(len(bboxes)):
             bboxes[i] = bboxes[i].to(device)
+        # Targets assigned by the dataset's TargetEncoder, when encode_targets is on
+        encoded_targets = [tuple(part.to(device) for part in scale) for scale in encoded_targets[0]] if encoded_targets else None
         outputs = model(images)
         #outputs[1] = outputs[1][..., :5]
 
@@ -523,7 +527,7 @@ def train(model, loader, criterion, optimizer, optionalLoader=None):
         if False:
             print("")
         # Compute the loss between predicted and true bounding box coordinates
-        loss = criterion(outputs, bboxes, writer, epoch * len(train_loader) + batch_idx)
+        loss = criterion(outputs, bboxes, writer, epoch * len(train_loader) + batch_idx, encoded_targets)
 
         # Log training loss for this batch to TensorBoard
         current_lr = optimizer.param_groups[0]['lr']
@@ -730,7 +734,9 @@ def compute_max_boxes(dataloader):
     return max_boxes
 
 def custom_collate_fn(batch):
-    images, bboxes, paths = zip(*batch)
+    images, bboxes, paths = zip(*[item[:3] for item in batch])
+    # Items of a dataset with a TargetEncoder carry their encoded targets last
+    encoded_targets = collate_encoded_targets([item[3] for item in batch]) if len(batch[0]) > 3 else None
     
     # Stack images directly (assuming they are all the same size)
     images = torch.stack(images, dim=0)
@@ -767,6 +773,8 @@ def custom_collate_fn(batch):
     # Combine scales into a single tensor of shape (batch_size, 3, max_boxes, 4)
     bboxes = [small_scale_boxes, medium_scale_boxes, large_scale_boxes]
     
+    if encoded_targets is not None:
+        return images, bboxes, paths, encoded_targets
     return images, bboxes, paths
 
 
@@ -799,6 +807,10 @@ weight_decay = 1e-4
 learning_rate = 0.00022#0.0005#3e-6
 alpha=.5
 batch_size = 32
+matcher = "hungarian"  # ground truth to prediction assignment in the loss, see BoxMatching.matchers
+candidate_window = None  # match boxes only against the anchors of this many cells around them (None: every prediction)
+candidate_radius = 2.5  # how many cells beyond a box its candidate cells may lie
+encode_targets = False  # assign boxes to cells and anchors in the DataLoader workers instead of matching in the loss
 desired_size=Constants.desired_size
 writer = ""
 loaded_anchor_boxes = None
@@ -843,7 +855,8 @@ if __name__ == "__main__":
                 loaded_anchor_boxes = torch.tensor(loaded_anchor_boxes, dtype=torch.float32)
 
             torch.autograd.set_detect_anomaly(True)
-            train_dataset=CustomImageDataset(img_dir='./backend/training_data/', transform=transform, train=True, anchor_boxes=loaded_anchor_boxes)
+            target_encoder = TargetEncoder(loaded_anchor_boxes) if encode_targets else None
+            train_dataset=CustomImageDataset(img_dir='./backend/training_data/', transform=transform, train=True, anchor_boxes=loaded_anchor_boxes, target_encoder=target_encoder)
             test_dataset=CustomImageDataset(img_dir='./backend/training_data/', transform=transform, train=False, anchor_boxes=loaded_anchor_boxes)
 
 
@@ -870,27 +883,8 @@ if __name__ == "__main__":
 
 
             #cnn_model = YOLOv3(num_classes=1).to(device)# BoundingBoxCnn(max_boxes, loaded_anchor_boxes).to(device)
-            cnn_model = torch.hub.load('ultralytics/yolov5', 'yolov5s', pretrained=False).to(device)
-
-
-
-
-
-            # Access the Detect layer
-            detect_layer = cnn_model.model[-1]
-
-            # Ensure it's configured with the correct number of anchors and outputs
-            detect_layer.nc = 1  # 1 class (text)
-            detect_layer.na = Constants.num_anchor_boxes  # 5 anchors
-            detect_layer.no = 6  # 4 bbox + 1 confidence + 1 class = 6 outputs per anchor
-
-            # Apply the custom anchors to the Detect layer
-            detect_layer.anchors = loaded_anchor_boxes
-
-            # Update the Conv2d layers in the Detect module to output 30 channels
-            for i, layer in enumerate(detect_layer.m):
-                in_channels = layer.in_channels
-                detect_layer.m[i] = torch.nn.Conv2d(in_channels, Constants.num_anchor_boxes * 6, kernel_size=1)
+            # yolov5s with the Detect layer set up for 1 class and our anchors, built locally instead of through torch.hub
+            cnn_model = build_text_detector(loaded_anchor_boxes).to(device)
 
 
 
@@ -908,7 +902,8 @@ if __name__ == "__main__":
 
             max_norm = 5
             #criterion = nn.CrossEntropyLoss()
-            criterion = CombinedLoss(anchor_boxes=loaded_anchor_boxes).to(device)#nn.SmoothL1Loss().to(device)#CombinedLoss().to(device)
+            criterion = CombinedLoss(anchor_boxes=loaded_anchor_boxes, matcher=matcher, candidate_window=candidate_window,
+                                     candidate_radius=candidate_radius).to(device)#nn.SmoothL1Loss().to(device)#CombinedLoss().to(device)
             optimizer = optim.Adam(cnn_model.parameters(), lr=learning_rate, weight_decay=weight_decay) #, weight_decay=5e-4
             # Warm-up scheduler for the first 10 epochs
             #warmup_scheduler = LinearLR(optimizer, start_factor=0.01, total_iters=10)
@@ -995,6 +990,9 @@ if __name__ == "__main__":
             print(f"max_norm={max_norm}")
             print(f"desired_size={desired_size}")
             print(f"alpha={alpha}")
+            print(f"matcher={matcher}")
+            print(f"candidate_window={candidate_window}")
+            print(f"encode_targets={encode_targets}")
             #print("Loss Function: (alpha*diou_loss_value+(1-alpha)*(smooth_l1_loss_value/desired_size))*(desired_size/2)")
             print(f"Using device: {device}")
             print(f"Is CUDA available: {torch.cuda.is_available()}")
@@ -0,0 +1,283 @@
+import numpy as np
+import torch
+from scipy.optimize import linear_sum_assignment
+
+
+# Matchers assign ground-truth boxes to predictions for a whole batch of images at once.
+#
+# Every matcher takes:
+# - score: Tensor [B, M, K], the DIoU of ground truth m with its k-th candidate prediction (higher is better).
+# - candidates: Long tensor [B, M, K] of the prediction index behind each candidate slot, or None when every
+#   ground truth is scored against every prediction (K = N and slot k is prediction k).
+# - valid: Bool tensor [B, M], False for padding ground truths.
+# - num_preds: Int, N.
+# and returns matched_gt: Long tensor [B, N], the ground-truth index matched to each prediction or -1.
+
+default_matcher = "hungarian"
+
+
+def masked_score(score, valid):
+    """
+    float32 copy of score with padding ground truths and NaNs (degenerate boxes) set to -inf, i.e. never matched.
+    """
+    score = torch.nan_to_num(score.float(), nan=float("-inf"))
+    return score.masked_fill(~valid.unsqueeze(2), float("-inf"))
+
+
+def gather_preds(values, candidates):
+    """
+    Per candidate slot view [B, M, K] of a per-prediction tensor [B, N]. Without candidates this is a broadcast.
+    """
+    if candidates is None:
+        return values.unsqueeze(1)
+    return values.gather(1, candidates.flatten(1)).view(candidates.shape)
+
+
+def slot_to_pred(slots, candidates):
+    """
+    Prediction index [B, M] of one candidate slot per ground truth.
+    """
+    if candidates is None:
+        return slots
+    return candidates.gather(2, slots.unsqueeze(2)).squeeze(2)
+
+
+def scatter_to_preds(values, candidates, num_preds, reduce, fill):
+    """
+    Reduce per slot values [B, M, K] onto the predictions they belong to, giving [B, N]. Predictions no slot
+    points to get fill.
+    """
+    if candidates is None:
+        return values.amax(dim=1) if reduce == "amax" else values.amin(dim=1)
+    out = torch.full((values.shape[0], num_preds), fill, dtype=values.dtype, device=values.device)
+    return out.scatter_reduce(1, candidates.flatten(1), values.flatten(1), reduce)
+
+
+def resolve_conflicts(preds, values, wins, num_preds):
+    """
+    Among the ground truths in wins [B, M] (or [B, M, K]) bidding for the same prediction, keep the one with the
+    highest value and, on a tie, the lowest index.
+
+    Returns:
+    - winner: Long tensor [B, N], the winning ground-truth index of each prediction or M.
+    - wins: Bool tensor shaped like preds, True for the kept ground truths.
+    """
+    batch_size, num_gts = preds.shape[:2]
+    gt_index = torch.arange(num_gts, device=preds.device).view(1, -1, *([1] * (preds.dim() - 2))).expand_as(preds)
+    values = values.masked_fill(~wins, float("-inf"))
+
+    best = torch.full((batch_size, num_preds), float("-inf"), device=preds.device)
+    best = best.scatter_reduce(1, preds.flatten(1), values.flatten(1), "amax")
+    wins = wins & (values >= best.gather(1, preds.flatten(1)).view_as(preds))
+
+    winner = torch.full((batch_size, num_preds), num_gts, dtype=torch.long, device=preds.device)
+    winner = winner.scatter_reduce(1, preds.flatten(1), gt_index.masked_fill(~wins, num_gts).flatten(1), "amin")
+    wins = wins & (winner.gather(1, preds.flatten(1)).view_as(preds) == gt_index)
+    return winner, wins
+
+
+@torch.no_grad()
+def grid_candidates(boxes, grid_shape, image_size, window=5, radius=2.5):
+    """
+    The predictions each ground truth is matched against, instead of all of them: every anchor of the window x
+    window grid cells nearest its center (the cell holding the center in the middle) whose cell center also lies
+    inside the box grown by radius cells. A prediction's center always lies in its own cell, so the cells far
+    from a box can only produce poor matches. Costs O(M * K) with K = num_anchors * window^2, whatever the grid size.
+
+    Parameters:
+    - boxes: Tensor [B, M, 4] of ground-truth corner boxes in input pixels.
+    - grid_shape: (num_anchors, grid_h, grid_w) of the scale. Predictions are flattened in (anchor, row, column) order.
+    - image_size: (height, width) of the detector input.
+    - window: Int, the side of the cell window, odd.
+    - radius: Float, how many cells beyond the box edges a candidate cell may lie.
+
+    Returns:
+    - candidates: Long tensor [B, M, K] of prediction indices.
+    - usable: Bool tensor [B, M, K], False for slots outside the grid or too far from the box.
+    """
+    num_anchors, grid_h, grid_w = grid_shape
+    stride_y = image_size[0] / grid_h
+    stride_x = image_size[1] / grid_w
+    device = boxes.device
+
+    center_x = ((boxes[..., 0] + boxes[..., 2]) / 2 / stride_x).floor().long().clamp(0, grid_w - 1)  # [B, M]
+    center_y = ((boxes[..., 1] + boxes[..., 3]) / 2 / stride_y).floor().long().clamp(0, grid_h - 1)
+    offsets = torch.arange(window, device=device) - window // 2
+    offset_y, offset_x = torch.meshgrid(offsets, offsets, indexing="ij")
+    cells_x = center_x.unsqueeze(2) + offset_x.reshape(1, 1, -1)  # [B, M, window^2]
+    cells_y = center_y.unsqueeze(2) + offset_y.reshape(1, 1, -1)
+
+    inside_grid = (cells_x >= 0) & (cells_x < grid_w) & (cells_y >= 0) & (cells_y < grid_h)
+    cell_center_x = (cells_x.float() + 0.5) * stride_x
+    cell_center_y = (cells_y.float() + 0.5) * stride_y
+    near = (cell_center_x >= boxes[..., 0:1] - radius * stride_x) & (cell_center_x <= boxes[..., 2:3] + radius * stride_x) & \
+           (cell_center_y >= boxes[..., 1:2] - radius * stride_y) & (cell_center_y <= boxes[..., 3:4] + radius * stride_y)
+
+    cells = cells_y.clamp(0, grid_h - 1) * grid_w + cells_x.clamp(0, grid_w - 1)
+    anchor_offsets = torch.arange(num_anchors, device=device).view(1, 1, -1, 1) * (grid_h * grid_w)
+    candidates = (anchor_offsets + cells.unsqueeze(2)).flatten(2)  # [B, M, num_anchors * window^2]
+    usable = (inside_grid & near).unsqueeze(2).expand(-1, -1, num_anchors, -1).flatten(2)
+    return candidates, usable
+
+
+@torch.no_grad()
+def hungarian_match(score, candidates, valid, num_preds):
+    """
+    Optimal one-to-one assignment with scipy's linear_sum_assignment, one image at a time on the CPU.
+    The reference the on-device matchers are compared against; it copies the scores to the host every call.
+    """
+    batch_size = score.shape[0]
+    penalty = -1e6  # stands in for "not a candidate", far below any DIoU
+    score_host = torch.nan_to_num(score.float(), nan=penalty, neginf=penalty).cpu().numpy()
+    valid_host = valid.cpu().numpy()
+    candidates_host = candidates.cpu().numpy() if candidates is not None else None
+
+    image_indices = []
+    pred_indices = []
+    gt_indices = []
+    for b in range(batch_size):
+        rows = np.nonzero(valid_host[b])[0]
+        if len(rows) == 0:
+            continue
+        if candidates_host is None:
+            preds = None
+            matrix = score_host[b, rows]
+        else:
+            # Dense cost over the union of the candidates of this image's ground truths
+            preds, columns = np.unique(candidates_host[b, rows], return_inverse=True)
+            matrix = np.full((len(rows), len(preds)), penalty, dtype=np.float32)
+            np.maximum.at(matrix, (np.repeat(np.arange(len(rows)), candidates_host.shape[2]), columns.ravel()),
+                          score_host[b, rows].ravel())
+        row_ind, col_ind = linear_sum_assignment(matrix, maximize=True)
+        keep = matrix[row_ind, col_ind] > penalty
+        image_indices.append(np.full(int(keep.sum()), b))
+        gt_indices.append(rows[row_ind[keep]])
+        pred_indices.append(col_ind[keep] if preds is None else preds[col_ind[keep]])
+
+    matched_gt = torch.full((batch_size, num_preds), -1, dtype=torch.long)
+    if image_indices:
+        image_indices = torch.from_numpy(np.concatenate(image_indices)).long()
+        pred_indices = torch.from_numpy(np.concatenate(pred_indices)).long()
+        matched_gt[image_indices, pred_indices] = torch.from_numpy(np.concatenate(gt_indices)).long()
+    return matched_gt.to(score.device)
+
+
+@torch.no_grad()
+def auction_match(score, candidates, valid, num_preds, eps=0.002, max_rounds=1000):
+    """
+    Near-optimal one-to-one assignment with Bertsekas' auction algorithm, batched over images on the score's device.
+
+    Ground truths bid for predictions: each unassigned ground truth bids for the prediction with the best
+    score - price, raising its price by the gap to its second best plus eps; the highest bid takes the
+    prediction and its previous owner bids again. All ground truths of all images bid in parallel each round.
+    All prices start at zero, so predictions nobody bid for stay at the lowest price, which is what keeps this
+    forward-only auction within M * eps of the optimum when there are fewer ground truths than predictions
+    (eps scaling would carry raised prices over and lose that bound). The auction stops after max_rounds;
+    ground truths still unassigned then stay unmatched.
+    """
+    score = masked_score(score, valid)
+    batch_size, num_gts, num_slots = score.shape
+    device = score.device
+    # Ground truths without a single candidate never bid
+    active = valid & torch.isfinite(score).any(dim=2)
+
+    prices = torch.zeros(batch_size, num_preds, device=device)
+    owner = torch.full((batch_size, num_preds), -1, dtype=torch.long, device=device)
+    assigned = torch.full((batch_size, num_gts + 1), -1, dtype=torch.long, device=device)  # last column is scratch
+    for _ in range(max_rounds):
+        bidding = active & (assigned[:, :num_gts] < 0)
+        if not bidding.any():
+            break
+
+        values = score - gather_preds(prices, candidates)  # [B, M, K]
+        if num_slots > 1:
+            top_values, top_slots = values.topk(2, dim=2)
+            best, second = top_values[..., 0], top_values[..., 1]
+        else:
+            top_slots = torch.zeros_like(values, dtype=torch.long)
+            best, second = values[..., 0], torch.full_like(values[..., 0], float("-inf"))
+        best_pred = slot_to_pred(top_slots[..., 0], candidates)  # [B, M]
+        # A lone candidate (second = -inf) raises the price by the whole DIoU range
+        bids = prices.gather(1, best_pred) + (best - second).clamp(max=2.0) + eps
+
+        winner, wins = resolve_conflicts(best_pred, bids, bidding, num_preds)
+        won = winner < num_gts  # [B, N]
+
+        # The previous owners of the predictions won this round bid again
+        evicted = won & (owner >= 0)
+        assigned.scatter_(1, torch.where(evicted, owner, num_gts), -1)
+        assigned[:, :num_gts] = torch.where(wins, best_pred, assigned[:, :num_gts])
+        owner = torch.where(won, winner, owner)
+        prices = torch.where(won, prices.scatter_reduce(1, best_pred, bids.masked_fill(~wins, float("-inf")),
+                                                        "amax", include_self=False), prices)
+    return owner
+
+
+@torch.no_grad()
+def greedy_match(score, candidates, valid, num_preds):
+    """
+    Greedy one-to-one assignment by DIoU, batched over images on the score's device.
+
+    Sequential greedy matching takes the best remaining (ground truth, prediction) pair again and again. Every
+    pair that is the best of both its ground truth and its prediction is taken by it before anything else
+    touching either, so all such mutual best pairs are accepted together each round: same result, and the
+    number of rounds is the length of the longest chain of conflicts instead of M.
+    """
+    score = masked_score(score, valid)
+    batch_size, num_gts, _ = score.shape
+    owner = torch.full((batch_size, num_preds), -1, dtype=torch.long, device=score.device)
+
+    while True:
+        best, best_slot = score.max(dim=2)  # [B, M]
+        open_gts = torch.isfinite(best)
+        if not open_gts.any():
+            break
+        best_pred = slot_to_pred(best_slot, candidates)
+        pred_best = scatter_to_preds(score, candidates, num_preds, "amax", float("-inf"))  # [B, N]
+        mutual = open_gts & (best >= pred_best.gather(1, best_pred))
+
+        winner, wins = resolve_conflicts(best_pred, best, mutual, num_preds)
+        owner = torch.where(winner < num_gts, winner, owner)
+
+        # Retire the matched ground truths and predictions
+        score.masked_fill_(wins.unsqueeze(2), float("-inf"))
+        score.masked_fill_(gather_preds(owner >= 0, candidates), float("-inf"))
+    return owner
+
+
+@torch.no_grad()
+def dynamic_k_match(score, candidates, valid, num_preds, top_q=10):
+    """
+    Dynamic-k matching (as in SimOTA), batched over images on the score's device.
+
+    Each ground truth takes its k best predictions, k being the sum of its top_q positive DIoUs (at least 1), so
+    a well covered box trains several predictions and a poorly covered one only its best. A prediction chosen by
+    several ground truths goes to the one it overlaps best. Many-to-one: a ground truth can appear in several pairs.
+    """
+    score = masked_score(score, valid)
+    batch_size, num_gts, num_slots = score.shape
+    q = min(top_q, num_slots)
+    if q == 0:
+        return torch.full((batch_size, num_preds), -1, dtype=torch.long, device=score.device)
+
+    top_values, top_slots = score.topk(q, dim=2)  # [B, M, q]
+    k = top_values.clamp(min=0).sum(dim=2).int().clamp(min=1)  # [B, M]
+    selected = (torch.arange(q, device=score.device) < k.unsqueeze(2)) & torch.isfinite(top_values)
+
+    preds = top_slots if candidates is None else candidates.gather(2, top_slots)
+    winner, _ = resolve_conflicts(preds, top_values, selected, num_preds)
+    return torch.where(winner < num_gts, winner, -1)
+
+
+matchers = {
+    "hungarian": hungarian_match,
+    "auction": auction_match,
+    "greedy": greedy_match,
+    "dynamic_k": dynamic_k_match,
+}
+
+
+def get_matcher(name):
+    if name not in matchers:
+        raise ValueError(f"Unknown matcher {name!r}, expected one of {', '.join(matchers)}")
+    return matchers[name]
@@ -0,0 +1,109 @@
+import bisect
+import random
+from torch.utils.data import Sampler
+
+
+# Crop widths (after resizing to height 32) that start a new bucket. Crops only share a batch with crops of their
+# own bucket, so a long line is never padded against a short word.
+default_bucket_edges = (32, 48, 64, 96, 128, 192, 256, 384, 512, 768, 1024)
+
+# Padded pixels (batch size * widest crop * 32) allowed in one CRNN batch
+default_max_pixels = 32 * 4096 * 16
+
+
+class PaddingStats:
+    """
+    Counts the real and padded crop columns the CRNN ran over. padding_ratio is the fraction of columns that were padding.
+    """
+    def __init__(self):
+        self.real = 0
+        self.padded = 0
+
+    def add(self, widths):
+        self.real += sum(widths)
+        self.padded += max(widths) * len(widths)
+
+    def padding_ratio(self):
+        return 1 - self.real / self.padded if self.padded else 0.0
+
+    def reset(self):
+        self.real = 0
+        self.padded = 0
+
+
+def bucket_batches(widths, bucket_edges=default_bucket_edges, max_pixels=default_max_pixels, height=32,
+                   max_batch_size=None, shuffle=False):
+    """
+    Split crop indices into batches of similar width.
+
+    Parameters:
+    - widths: List of crop widths.
+    - bucket_edges: Sorted widths that start a new bucket.
+    - max_pixels: Int, the most padded pixels (batch size * widest crop * height) in one batch.
+    - height: Int, the crop height.
+    - max_batch_size: Optional int, the most crops in one batch.
+    - shuffle: Shuffle within the buckets and the batch order (training) instead of sorting by width (inference).
+
+    Returns:
+    - List of index lists, one per batch.
+    """
+    buckets = {}
+    for index, width in enumerate(widths):
+        buckets.setdefault(bisect.bisect_right(bucket_edges, width), []).append(index)
+
+    batches = []
+    for bucket in buckets.values():
+        if shuffle:
+            random.shuffle(bucket)
+        else:
+            bucket.sort(key=lambda index: widths[index])
+
+        batch = []
+        batch_width = 0
+        for index in bucket:
+            new_width = max(batch_width, widths[index])
+            too_big = (len(batch) + 1) * new_width * height > max_pixels
+            too_many = max_batch_size is not None and len(batch) >= max_batch_size
+            if batch and (too_big or too_many):
+                batches.append(batch)
+                batch = []
+                new_width = widths[index]
+            batch.append(index)
+            batch_width = new_width
+        if batch:
+            batches.append(batch)
+
+    if shuffle:
+        random.shuffle(batches)
+    return batches
+
+
+class WidthBucketBatchSampler(Sampler):
+    """
+    Batch sampler for the CRNN DataLoader that draws every batch from a single width bucket.
+    Reshuffles each epoch and keeps the padding statistics of the batches it produced.
+    """
+    def __init__(self, widths, batch_size, bucket_edges=default_bucket_edges, max_pixels=default_max_pixels, height=32):
+        self.widths = widths
+        self.batch_size = batch_size
+        self.bucket_edges = bucket_edges
+        self.max_pixels = max_pixels
+        self.height = height
+        self.stats = PaddingStats()
+        self.num_batches = None
+
+    def __iter__(self):
+        self.stats.reset()
+        for batch in bucket_batches(self.widths, self.bucket_edges, self.max_pixels, self.height, self.batch_size, shuffle=True):
+            self.stats.add([self.widths[index] for index in batch])
+            yield batch
+
+    def __len__(self):
+        # Estimate from the sorted split (the shuffled batches only differ in how each bucket is cut), computed once
+        if self.num_batches is None:
+            self.num_batches = len(bucket_batches(self.widths, self.bucket_edges, self.max_pixels, self.height, self.batch_size))
+        return self.num_batches
+
+    def padding_ratio(self):
+        return self.stats.padding_ratio()
+
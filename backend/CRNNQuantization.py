@@ -0,0 +1,189 @@
+import argparse
+import copy
+import random
+import time
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+import torchvision.transforms as transforms
+from torch.ao.quantization import QuantStub, DeQuantStub, fuse_modules, get_default_qconfig, prepare, convert, quantize_dynamic
+import Constants
+from TextCRNN import CRNN, LabelEncoder, custom_collate_fn
+
+
+crnn_variants = ("fp32", "int8-dynamic", "int8-static")
+crnn_static_path = "../crnn_int8_static.pt"
+
+means = [0.3490, 0.3219, 0.2957]
+stds = [0.2993, 0.2850, 0.2735]
+
+
+class QuantizedCNN(nn.Module):
+    """
+    Wraps the CRNN conv stack between quantize and dequantize stubs so it can run as static INT8.
+    """
+    def __init__(self, cnn):
+        super().__init__()
+        self.quant = QuantStub()
+        self.cnn = cnn
+        self.dequant = DeQuantStub()
+
+    def forward(self, x):
+        return self.dequant(self.cnn(self.quant(x)))
+
+
+def fuse_cnn(cnn):
+    """
+    Fuse every Conv2d + BatchNorm2d + ReLU (or Conv2d + ReLU) of the CRNN conv stack in place.
+    """
+    layers = list(cnn)
+    groups = []
+    for i, layer in enumerate(layers):
+        if not isinstance(layer, nn.Conv2d):
+            continue
+        if i + 2 < len(layers) and isinstance(layers[i + 1], nn.BatchNorm2d) and isinstance(layers[i + 2], nn.ReLU):
+            groups.append([str(i), str(i + 1), str(i + 2)])
+        elif i + 1 < len(layers) and isinstance(layers[i + 1], nn.ReLU):
+            groups.append([str(i), str(i + 1)])
+    return fuse_modules(cnn, groups, inplace=True)
+
+
+def quantize_crnn_dynamic(model):
+    """
+    Dynamic INT8 for the LSTMs and Linear embeddings: weights are stored as int8 and activations are quantized on the fly.
+    """
+    return quantize_dynamic(copy.deepcopy(model).eval(), {nn.LSTM, nn.Linear}, dtype=torch.qint8)
+
+
+def prepare_crnn_static(model, backend="fbgemm"):
+    """
+    Fused conv stack with observers inserted, ready for calibration. The recurrent head is quantized dynamically.
+    """
+    torch.backends.quantized.engine = backend
+    model = quantize_crnn_dynamic(model)
+    model.cnn = QuantizedCNN(fuse_cnn(model.cnn))
+    model.cnn.qconfig = get_default_qconfig(backend)
+    prepare(model.cnn, inplace=True)
+    return model
+
+
+def convert_crnn_static(model):
+    convert(model.cnn, inplace=True)
+    return model
+
+
+@torch.no_grad()
+def calibrate(model, samples, batch_size=32):
+    """
+    Run (crop, text) samples through the prepared model so the observers record activation ranges.
+    """
+    for start in range(0, len(samples), batch_size):
+        images, _, widths = custom_collate_fn(samples[start:start + batch_size])
+        model(images, widths)
+
+
+def quantize_crnn_static(model, samples, backend="fbgemm"):
+    """
+    Static INT8 conv stack (calibrated on (crop, text) samples) plus dynamic INT8 LSTMs and Linear layers.
+    """
+    model = prepare_crnn_static(model, backend)
+    calibrate(model, samples)
+    return convert_crnn_static(model)
+
+
+def load_quantized_crnn(path=crnn_static_path, backend="fbgemm"):
+    """
+    Rebuild the static INT8 structure and load the quantized weights saved by this script. CPU only.
+    """
+    checkpoint = torch.load(path, map_location="cpu")
+    num_classes = len(Constants.char_set) + 1  # +1 for CTC blank label
+    model = convert_crnn_static(prepare_crnn_static(CRNN(num_classes=num_classes, nc=3).eval(), backend))
+    model.load_state_dict(checkpoint['model_state_dict'])
+    return model.eval()
+
+
+def sample_crops(dataset, num_samples, seed=0):
+    """
+    Draw num_samples valid (crop, text) pairs from a CustomImageDataset3.
+    """
+    indices = list(range(len(dataset)))
+    random.Random(seed).shuffle(indices)
+    samples = []
+    for index in indices:
+        sample = dataset[index]
+        if sample is not None:
+            samples.append(sample)
+        if len(samples) == num_samples:
+            break
+    return samples
+
+
+@torch.no_grad()
+def evaluate_variant(model, samples, label_encoder, batch_size=32):
+    """
+    Character accuracy (same measure as TextCRNN.evaluate), exact word accuracy and latency per crop of a CRNN.
+    """
+    correct_chars = 0
+    total_chars = 0
+    correct_words = 0
+    elapsed = 0.0
+    for start in range(0, len(samples), batch_size):
+        images, texts, widths = custom_collate_fn(samples[start:start + batch_size])
+        began = time.perf_counter()
+        outputs = F.log_softmax(model(images, widths), dim=2)
+        _, preds = outputs.max(2)
+        preds = preds.transpose(1, 0).contiguous()
+        pred_texts = label_encoder.decode(preds, lengths=CRNN.output_lengths(widths).clamp(max=preds.size(1)))
+        elapsed += time.perf_counter() - began
+
+        for pred_text, target_text in zip(pred_texts, texts):
+            total_chars += len(target_text)
+            correct_chars += sum(1 for p, t in zip(pred_text, target_text) if p == t)
+            correct_words += pred_text == target_text
+
+    return {
+        "char_accuracy": correct_chars / total_chars * 100 if total_chars else 0.0,
+        "word_accuracy": correct_words / len(samples) * 100 if samples else 0.0,
+        "ms_per_crop": elapsed / len(samples) * 1000 if samples else 0.0,
+    }
+
+
+if __name__ == "__main__":
+    from customDataSet3 import CustomImageDataset3
+    from OCRPipeline import load_crnn
+
+    parser = argparse.ArgumentParser(description="Quantize the CRNN to INT8 and compare it with the fp32 checkpoint on CPU.")
+    # Run from the repository root, like TextCRNN.py, since CustomImageDataset3 reads ./backend/training_data/
+    parser.add_argument("--checkpoint", default="CRNNmodel_checkpoint_62.pth")
+    parser.add_argument("--img-dir", default="./backend/training_data/", help="TextOCR folder holding cropped_images/.")
+    parser.add_argument("--calibration-samples", type=int, default=256)
+    parser.add_argument("--eval-samples", type=int, default=1000)
+    parser.add_argument("--output", default="crnn_int8_static.pt", help="Where the static INT8 model is saved.")
+    parser.add_argument("--threads", type=int, default=None)
+    args = parser.parse_args()
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+
+    transform = transforms.Compose([transforms.ToTensor(), transforms.Normalize(mean=means, std=stds)])
+    dataset = CustomImageDataset3(img_dir=args.img_dir, transform=transform, train=False)
+    calibration = sample_crops(dataset, args.calibration_samples, seed=0)
+    evaluation = sample_crops(dataset, args.eval_samples, seed=1)
+    label_encoder = LabelEncoder(Constants.char_set)
+
+    fp32_model = load_crnn(args.checkpoint, "cpu", weights_path=None)
+    models = {
+        "fp32": fp32_model,
+        "int8-dynamic": quantize_crnn_dynamic(fp32_model),
+        "int8-static": quantize_crnn_static(fp32_model, calibration),
+    }
+    torch.save({'model_state_dict': models["int8-static"].state_dict()}, args.output)
+    print(f"Static INT8 CRNN written to {args.output}")
+
+    print(f"{'variant':<14} {'char acc':>9} {'word acc':>9} {'ms/crop':>8} {'speedup':>8}")
+    baseline = None
+    for name, model in models.items():
+        report = evaluate_variant(model, evaluation, label_encoder)
+        baseline = baseline or report["ms_per_crop"]
+        print(f"{name:<14} {report['char_accuracy']:8.2f}% {report['word_accuracy']:8.2f}% "
+              f"{report['ms_per_crop']:8.3f} {baseline / report['ms_per_crop']:7.2f}x")
@@ -0,0 +1,72 @@
+import argparse
+import os
+import torch
+
+
+# Storage dtypes accepted by --dtype. Only floating point tensors are converted (BatchNorm's num_batches_tracked stays int64).
+storage_dtypes = {"fp32": torch.float32, "fp16": torch.float16, "bf16": torch.bfloat16}
+
+detector_weights_path = "../detector_weights.pt"
+crnn_weights_path = "../crnn_weights.pt"
+
+
+def export_inference_weights(checkpoint_path, output_path, dtype="fp32"):
+    """
+    Strip a training checkpoint down to its model weights for inference.
+
+    The training checkpoints also hold the Adam optimizer_state_dict (two moment buffers per parameter),
+    so the weights are only about a third of the file. The result is written with torch.save's zip format,
+    which torch.load can memory-map instead of reading it all into memory.
+
+    Parameters:
+    - checkpoint_path: Path of a training checkpoint containing 'model_state_dict'.
+    - output_path: Where the weights-only file is written.
+    - dtype: 'fp32', 'fp16' or 'bf16', the dtype the floating point weights are stored in.
+
+    Returns:
+    - (input size, output size) in bytes.
+    """
+    checkpoint = torch.load(checkpoint_path, map_location="cpu")
+    state_dict = {}
+    for key, value in checkpoint['model_state_dict'].items():
+        if value.is_floating_point():
+            value = value.to(storage_dtypes[dtype])
+        state_dict[key] = value.contiguous()
+
+    torch.save({'model_state_dict': state_dict, 'dtype': dtype, 'source': os.path.basename(checkpoint_path)}, output_path)
+    return os.path.getsize(checkpoint_path), os.path.getsize(output_path)
+
+
+def load_inference_weights(path):
+    """
+    Memory-map a file written by export_inference_weights and return its state dict.
+
+    Tensors stay backed by the file until they are copied into a model, so only the pages that are
+    actually used get read, and processes loading the same file share them through the page cache.
+    load_state_dict casts fp16/bf16 weights back to the model's dtype while copying.
+    """
+    weights = torch.load(path, map_location="cpu", mmap=True, weights_only=True)
+    return weights['model_state_dict']
+
+
+def load_state_dict(checkpoint_path, weights_path=None):
+    """
+    Return the model state dict from the weights-only file when it exists, otherwise from the full training checkpoint.
+    """
+    if weights_path and os.path.exists(weights_path):
+        return load_inference_weights(weights_path)
+    return torch.load(checkpoint_path, map_location="cpu")['model_state_dict']
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export inference-only, memory-mappable weights from the training checkpoints.")
+    parser.add_argument("--detector", default="../model_checkpoint213.pth")
+    parser.add_argument("--crnn", default="../CRNNmodel_checkpoint_62.pth")
+    parser.add_argument("--detector-output", default=detector_weights_path)
+    parser.add_argument("--crnn-output", default=crnn_weights_path)
+    parser.add_argument("--dtype", choices=list(storage_dtypes), default="fp32", help="Storage dtype of the floating point weights.")
+    args = parser.parse_args()
+
+    for checkpoint_path, output_path in ((args.detector, args.detector_output), (args.crnn, args.crnn_output)):
+        input_size, output_size = export_inference_weights(checkpoint_path, output_path, args.dtype)
+        print(f"{checkpoint_path} ({input_size / 1e6:.1f} MB) -> {output_path} ({output_size / 1e6:.1f} MB)")
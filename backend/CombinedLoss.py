@@ -6,11 +6,13 @@ import torchvision
 import torchvision.ops as ops
 import Constants
 from GIoULoss import GIoULoss
+from DetectionDecoder import DetectionDecoder
 import torch
 import torch.nn.functional as F
 from torchvision.ops import box_iou
 import numpy as np
 from scipy.optimize import linear_sum_assignment
+from BoxMatching import default_matcher, get_matcher, grid_candidates, hungarian_match
 
 
 def calculate_single_iou(box1, box2):
@@ -201,6 +203,111 @@ def calculate_target_conf(pred_boxes, gt_boxes, iou_threshold=0.5):
     return target_conf
 
 
+# Upper bound on the elements of one batched [images, predictions, ground truths] IoU or DIoU block in the loss
+max_loss_elements = 2 ** 22
+
+
+def compact_targets(target_boxes):
+    """
+    Move the valid (non-zero) ground-truth boxes of every image to the front, keeping their order, and drop the
+    padding columns that no image needs.
+
+    Parameters:
+    - target_boxes: Tensor [B, M, 4] of zero padded ground-truth boxes.
+
+    Returns:
+    - boxes: Tensor [B, M', 4], M' the most valid boxes of any image in the batch.
+    - valid: Bool tensor [B, M'], False for padding.
+    """
+    valid = target_boxes.sum(dim=-1) > 0
+    counts = valid.sum(dim=1)
+    max_count = int(counts.max()) if counts.numel() else 0
+    # A stable sort on "is padding" puts the valid boxes first in their original order
+    order = torch.sort((~valid).to(torch.uint8), dim=1, stable=True).indices[:, :max_count]
+    boxes = torch.gather(target_boxes, 1, order.unsqueeze(-1).expand(-1, -1, 4))
+    valid = torch.arange(max_count, device=target_boxes.device).unsqueeze(0) < counts.unsqueeze(1)
+    return boxes, valid
+
+
+def image_chunks(batch_size, per_image, max_elements=max_loss_elements):
+    """
+    (start, end) image ranges whose [images, N, M] blocks stay under max_elements (at least one image each).
+    """
+    step = max(1, max_elements // max(per_image, 1))
+    return [(start, min(start + step, batch_size)) for start in range(0, batch_size, step)]
+
+
+def batched_box_iou(boxes1, boxes2):
+    """
+    torchvision's box_iou over a batch: [B, N, 4] x [B, M, 4] corner boxes gives [B, N, M]. Like box_iou, half
+    precision boxes are computed in float32 and float64 boxes stay float64.
+    """
+    boxes1 = boxes1 if boxes1.dtype in (torch.float32, torch.float64) else boxes1.float()
+    boxes2 = boxes2 if boxes2.dtype in (torch.float32, torch.float64) else boxes2.float()
+    area1 = (boxes1[..., 2] - boxes1[..., 0]) * (boxes1[..., 3] - boxes1[..., 1])
+    area2 = (boxes2[..., 2] - boxes2[..., 0]) * (boxes2[..., 3] - boxes2[..., 1])
+    lt = torch.max(boxes1[..., :, None, :2], boxes2[..., None, :, :2])
+    rb = torch.min(boxes1[..., :, None, 2:], boxes2[..., None, :, 2:])
+    wh = (rb - lt).clamp(min=0)
+    inter = wh[..., 0] * wh[..., 1]
+    return inter / (area1[..., :, None] + area2[..., None, :] - inter)
+
+
+@torch.no_grad()
+def max_box_iou(pred_boxes, gt_boxes, valid=None, max_elements=max_loss_elements):
+    """
+    Highest IoU of every prediction with the valid ground truths of its image, without allocating the [B, N, M]
+    IoU matrix: predictions are processed in chunks of at most max_elements IoUs and only the running maximum
+    and its ground-truth index are kept. Padding ground truths count as IoU 0. No gradient: every caller uses
+    the result as a target.
+
+    Parameters:
+    - pred_boxes: Tensor [B, N, 4] of predicted corner boxes.
+    - gt_boxes: Tensor [B, M, 4] of ground-truth corner boxes.
+    - valid: Optional bool tensor [B, M], False for padding. By default every non-zero box is valid.
+    - max_elements: Int, the most IoUs computed at once.
+
+    Returns:
+    - values: Tensor [B, N] in the dtype of pred_boxes, the highest IoU of each prediction.
+    - indices: Long tensor [B, N], the ground truth it was reached with.
+    """
+    if valid is None:
+        valid = gt_boxes.sum(dim=-1) > 0
+    batch_size, num_preds = pred_boxes.shape[:2]
+    values = torch.zeros(batch_size, num_preds, dtype=pred_boxes.dtype, device=pred_boxes.device)
+    indices = torch.zeros(batch_size, num_preds, dtype=torch.long, device=pred_boxes.device)
+    if gt_boxes.shape[1] == 0:
+        return values, indices
+
+    chunk = max(1, max_elements // (batch_size * gt_boxes.shape[1]))
+    padding = ~valid.unsqueeze(1)
+    for start in range(0, num_preds, chunk):
+        ious = batched_box_iou(pred_boxes[:, start:start + chunk], gt_boxes)  # [B, chunk, M]
+        chunk_values, indices[:, start:start + chunk] = ious.masked_fill(padding, 0).max(dim=2)
+        values[:, start:start + chunk] = chunk_values.to(values.dtype)
+    return values, indices
+
+
+@torch.no_grad()
+def calculate_target_conf_batched(pred_boxes, gt_boxes, iou_threshold=0.5, max_elements=max_loss_elements):
+    """
+    calculate_target_conf for the whole batch at once, without a Python loop over the images and without the
+    [N, M] IoU matrix: padding boxes are kept out through a validity mask instead of being stripped per image, and
+    max_box_iou reduces the IoUs chunk by chunk, so peak memory stays under max_elements floats.
+
+    Parameters:
+    - pred_boxes: Tensor [B, N, 4] of predicted corner boxes.
+    - gt_boxes: Tensor [B, M, 4] of zero padded ground-truth boxes.
+    - iou_threshold: Float, the IoU at which a prediction is a positive.
+
+    Returns:
+    - target_conf: Float tensor [B, N] of 0 or 1.
+    """
+    boxes, valid = compact_targets(gt_boxes)
+    max_ious, _ = max_box_iou(pred_boxes, boxes, valid, max_elements)
+    return (max_ious >= iou_threshold).float()
+
+
 def apply_nms(pred_boxes, confidences, iou_threshold=0.5):
     """
     Apply Non-Maximum Suppression to reduce overlapping boxes and ensure the confidence tensor's shape is maintained as [N, 1].
@@ -482,6 +589,80 @@ def filter_and_trim_boxes(pred_boxes, target_boxes, max_boxes=Constants.max_boxe
 
 
 
+def match_boxes(pred_boxes, target_boxes, matcher=hungarian_match, grid_shape=None, candidate_window=None,
+                candidate_radius=2.5, max_elements=max_loss_elements):
+    """
+    filter_and_trim_boxes for the whole batch: the DIoU of every valid ground truth against the predictions of its
+    image is computed in batched blocks (validity masks instead of per-image padding removal), a BoxMatching
+    matcher assigns them, and the matched pairs of every image are gathered with a single index operation.
+
+    With grid_shape and candidate_window, each ground truth is only scored against the predictions of the grid
+    cells around it (BoxMatching.grid_candidates), so the cost and the matching grow with the number of ground
+    truths instead of grid area x ground truths. Otherwise every prediction is scored.
+
+    Parameters:
+    - pred_boxes: Tensor [B, N, 5] of decoded corner boxes and confidences.
+    - target_boxes: Tensor [B, M, 4] of zero padded ground-truth boxes.
+    - matcher: A matcher from BoxMatching.matchers.
+    - grid_shape: Optional (num_anchors, grid_h, grid_w) of the scale the predictions come from.
+    - candidate_window: Optional int, the side of the cell window of grid_candidates.
+    - candidate_radius: Float, how many cells beyond a box its candidate cells may lie.
+
+    Returns:
+    - Same as filter_and_trim_boxes: matched target boxes [K, 4], predicted boxes [K, 4] and confidences [K, 1],
+      image by image, in prediction order within each image.
+    """
+    pred_coords = torch.clamp(pred_boxes[..., :4], -10000, 10000)  # [B, N, 4]
+    pred_confidences = pred_boxes[..., 4]  # [B, N]
+    batch_size, num_preds = pred_coords.shape[:2]
+
+    boxes, valid = compact_targets(target_boxes)
+    matched_gt = torch.full((batch_size, num_preds), -1, dtype=torch.long, device=pred_coords.device)
+    sparse = grid_shape is not None and candidate_window is not None
+    if boxes.shape[1] > 0:
+        per_image = boxes.shape[1] * (grid_shape[0] * candidate_window ** 2 if sparse else num_preds)
+        for start, end in image_chunks(batch_size, per_image, max_elements):
+            with torch.no_grad():
+                if sparse:
+                    candidates, usable = grid_candidates(boxes[start:end], grid_shape, (Constants.desired_size, Constants.desired_size),
+                                                         candidate_window, candidate_radius)
+                    candidate_coords = pred_coords[start:end].gather(1, candidates.flatten(1).unsqueeze(2).expand(-1, -1, 4))
+                    candidate_coords = candidate_coords.view(*candidates.shape, 4)  # [b, M, K, 4]
+                    score = diou(boxes[start:end].unsqueeze(2), candidate_coords).squeeze(2)  # [b, M, K]
+                    score = score.masked_fill(~usable, float("-inf"))
+                else:
+                    candidates = None
+                    score = diou(boxes[start:end], pred_coords[start:end])  # [b, M, N]
+            matched_gt[start:end] = matcher(score, candidates, valid[start:end], num_preds)
+
+    image_indices, pred_indices = (matched_gt >= 0).nonzero(as_tuple=True)
+    gt_indices = matched_gt[image_indices, pred_indices]
+
+    return (boxes[image_indices, gt_indices],
+            pred_coords[image_indices, pred_indices],
+            pred_confidences[image_indices, pred_indices].unsqueeze(-1))
+
+
+def encoded_pairs(pred_boxes, box_targets, mask):
+    """
+    The matched pairs of targets assigned ahead of time by a TargetEncoder: no assignment to solve, the mask
+    names the responsible prediction of every box.
+
+    Parameters:
+    - pred_boxes: Tensor [B, N, 5] of decoded corner boxes and confidences.
+    - box_targets: Tensor [B, num_anchors, grid_h, grid_w, 4] of assigned corner boxes.
+    - mask: Bool tensor [B, num_anchors, grid_h, grid_w], True where a box is assigned.
+
+    Returns:
+    - Same as match_boxes.
+    """
+    pred_coords = torch.clamp(pred_boxes[..., :4], -10000, 10000)
+    image_indices, pred_indices = mask.flatten(1).nonzero(as_tuple=True)
+    return (box_targets.flatten(1, 3)[image_indices, pred_indices],
+            pred_coords[image_indices, pred_indices],
+            pred_boxes[image_indices, pred_indices, 4].unsqueeze(-1))
+
+
 def filter_and_trim_boxes4(pred_boxes, target_boxes, max_boxes=Constants.max_boxes, iou_threshold=0.5):
     batch_size, num_anchors, grid_h, grid_w, num_outputs = pred_boxes.shape
 
@@ -698,8 +879,9 @@ def diou(boxes1, boxes2):
     #boxes2 = boxes2.unsqueeze(0)  # [1, num_valid, 4]
 
         # Expand dimensions to enable pairwise operations
-    boxes1_exp = boxes1.unsqueeze(1)  # [num_valid1, 1, 4]
-    boxes2_exp = boxes2.unsqueeze(0)  # [1, num_valid2, 4]
+    # Leading batch dimensions broadcast too: [B, N, 4] x [B, M, 4] gives [B, N, M]
+    boxes1_exp = boxes1.unsqueeze(-2)  # [num_valid1, 1, 4]
+    boxes2_exp = boxes2.unsqueeze(-3)  # [1, num_valid2, 4]
 
     # Calculate Intersection Coordinates
     inter_x1 = torch.max(boxes1_exp[..., 0], boxes2_exp[..., 0])
@@ -1183,7 +1365,7 @@ class ConfidencePenalty(nn.Module):
 
 
 class CombinedLoss(nn.Module):
-    def __init__(self, anchor_boxes):
+    def __init__(self, anchor_boxes, matcher=default_matcher, candidate_window=None, candidate_radius=2.5):
         super(CombinedLoss, self).__init__()
         self.iou_loss = IoULoss()
         self.smooth_l1_loss = nn.SmoothL1Loss(reduction='none')
@@ -1191,6 +1373,13 @@ class CombinedLoss(nn.Module):
         self.bce_loss = nn.BCEWithLogitsLoss(reduction='none')
         self.confidencePenalty = ConfidencePenalty()
         self.anchor_boxes = anchor_boxes
+        self.decoder = DetectionDecoder(anchor_boxes)
+        # How ground truths are assigned to predictions, one of BoxMatching.matchers
+        self.matcher = get_matcher(matcher)
+        # With candidate_window, ground truths are only matched against the anchors of the candidate_window x
+        # candidate_window cells around them. None (the default) scores every prediction, like the checkpoints were trained
+        self.candidate_window = candidate_window
+        self.candidate_radius = candidate_radius
 
         #Weight of All Penalties vs All Loss functions
         #1 for penalties, 0 for Loss Functions
@@ -1230,26 +1419,33 @@ class CombinedLoss(nn.Module):
         return self.alpha
     
 
-    def forward(self, pred_boxes, target_boxes, writer=None, step=-1):
+    def forward(self, pred_boxes, target_boxes, writer=None, step=-1, encoded_targets=None):
+        """
+        encoded_targets: Optional per scale (objectness, box_targets, mask) from a TargetEncoder. When given, the
+        objectness map is the confidence target and the assignment they hold replaces the matcher.
+        """
 
         batch_size, num_anchors, grid_h, grid_w, num_outputs = pred_boxes[0].shape
         CombinedLoss = None
         confidences_flat = []
 
-
+        # Decode every scale at once into [B, N, 5] corner boxes, then work on each scale's slice of it
+        decoded = self.decoder.decode(pred_boxes)
+        decoded_scales = decoded.split(self.decoder.scale_sizes(pred_boxes), dim=1)
 
 
         for i in range(len(pred_boxes)):
             if (target_boxes[i].shape[1]) == 0:
                 continue
-            pred_boxes[i] = pred_boxes[i][..., :5]
-            # Use slicing to select the 3 anchor boxes for the current scale
-            pred_boxes[i] = postprocess_yolo_output(pred_boxes[i], self.anchor_boxes[(i * 3):((i + 1) * 3)])
-            pred_boxes[i] = pred_boxes[i].view(batch_size, -1, 5)  # N = num_anchors * grid_h * grid_w
+            grid_shape = pred_boxes[i].shape[1:4]  # (num_anchors, grid_h, grid_w)
+            pred_boxes[i] = decoded_scales[i]
 
-            pred_boxes[i][..., :4] = yolo_to_corners_batches(pred_boxes[i][..., :4])
-
-            temp = (calculate_target_conf(pred_boxes[i][..., :4], target_boxes[i]))
+            if encoded_targets is not None:
+                # The responsible predictions the encoder marked are the positives
+                temp = encoded_targets[i][0].flatten(1).to(pred_boxes[i].dtype)
+            else:
+                # One batched IoU over every image of the scale; padding boxes are masked instead of stripped per image
+                temp = calculate_target_conf_batched(pred_boxes[i][..., :4], target_boxes[i])
 
             bce_loss_value = (self.bce_loss(pred_boxes[i][..., 4], temp))
 
@@ -1263,7 +1459,14 @@ class CombinedLoss(nn.Module):
             tp = (((lower_bound_penalty + upper_bound_penalty).mean()) * self.outOfBoundsPenaltyScale)* self.weight_tp[i]
 
             #Trim the padding bboxes, and remove the least confident bboxes for the corresponding batch Item
-            target_boxes[i], pred_boxes[i], temp = filter_and_trim_boxes(pred_boxes[i], target_boxes[i])
+            if encoded_targets is not None:
+                _, box_targets, assigned = encoded_targets[i]
+                target_boxes[i], pred_boxes[i], temp = encoded_pairs(pred_boxes[i], box_targets, assigned)
+            else:
+                target_boxes[i], pred_boxes[i], temp = match_boxes(pred_boxes[i], target_boxes[i], self.matcher, grid_shape,
+                                                                   self.candidate_window, self.candidate_radius)
+            if target_boxes[i].shape[0] == 0:
+                continue  # no image of the batch has a box at this scale
 
             while (i> len(confidences_flat)):
                 confidences_flat.append([])
@@ -1278,7 +1481,7 @@ class CombinedLoss(nn.Module):
 
             target_boxes[i] = clipBoxes(target_boxes[i])
 
-            temp2 = (calculate_target_conf(pred_boxes[i][..., :4].unsqueeze(0), target_boxes[i].unsqueeze(0)))
+            temp2 = calculate_target_conf_batched(pred_boxes[i][..., :4].unsqueeze(0), target_boxes[i].unsqueeze(0))
             bce_loss_value2 = (self.bce_loss(confidences_flat[i], temp2.squeeze(0).unsqueeze(1)))
 
             mask = torch.ones(target_boxes[i].shape[0], dtype=torch.bool, device=target_boxes[i].device)
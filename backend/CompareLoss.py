@@ -0,0 +1,139 @@
+import argparse
+import os
+import subprocess
+import types
+import torch
+from torchvision.ops import box_iou
+import Constants
+from BenchmarkMatching import random_targets
+from CombinedLoss import CombinedLoss, calculate_target_conf_batched, match_boxes, max_box_iou
+from OCRPipeline import load_anchor_boxes
+
+
+# The last commit whose loss matched per image with filter_and_trim_boxes and calculate_target_conf
+baseline_revision = "865a779"
+
+
+def load_baseline(revision=baseline_revision):
+    """
+    CombinedLoss.py as it was at the given commit, as a module, so its per-image functions can run next to the
+    batched ones.
+    """
+    repository = os.path.dirname(os.path.abspath(__file__))
+    source = subprocess.run(["git", "show", f"{revision}:backend/CombinedLoss.py"], cwd=repository,
+                            capture_output=True, text=True, check=True).stdout
+    module = types.ModuleType("BaselineCombinedLoss")
+    exec(compile(source, f"{revision}:backend/CombinedLoss.py", "exec"), module.__dict__)
+    return module
+
+
+def random_batch(batch_size, max_boxes, num_preds, image_size=Constants.desired_size, generator=None):
+    """
+    Zero padded ground truths with a different number of boxes per image (the first image has none, and the
+    padding is spread between the boxes rather than only at the end), and decoded-like predictions [B, N, 5]:
+    half of them jittered copies of the ground truths so both sides of the IoU threshold are covered.
+    """
+    target_boxes = torch.zeros(batch_size, max_boxes, 4)
+    pred_boxes = torch.zeros(batch_size, num_preds, 5)
+    for image in range(batch_size):
+        count = 0 if image == 0 else int(torch.randint(1, max_boxes + 1, (1,), generator=generator))
+        sizes = torch.rand(count, 2, generator=generator) * torch.tensor([120.0, 30.0]) + torch.tensor([10.0, 8.0])
+        corners = torch.rand(count, 2, generator=generator) * (image_size - sizes)
+        slots = torch.randperm(max_boxes, generator=generator)[:count].sort().values
+        target_boxes[image, slots] = torch.cat([corners, corners + sizes], dim=1)
+
+        sizes = torch.rand(num_preds, 2, generator=generator) * torch.tensor([120.0, 30.0]) + torch.tensor([10.0, 8.0])
+        corners = torch.rand(num_preds, 2, generator=generator) * (image_size - sizes)
+        pred_boxes[image, :, :4] = torch.cat([corners, corners + sizes], dim=1)
+        if count:
+            near = torch.randperm(num_preds, generator=generator)[:num_preds // 2]
+            sources = target_boxes[image, slots[torch.randint(0, count, (len(near),), generator=generator)]]
+            pred_boxes[image, near, :4] = sources + torch.randn(len(near), 4, generator=generator) * 4
+        pred_boxes[image, :, 4] = torch.rand(num_preds, generator=generator)
+    return pred_boxes, target_boxes
+
+
+def check_targets(baseline, trials, batch_size, max_boxes, num_preds, generator):
+    """
+    calculate_target_conf against calculate_target_conf_batched, filter_and_trim_boxes against the dense
+    hungarian match_boxes, and max_box_iou against box_iou(...).max in float64.
+
+    Returns:
+    - report: Dict of check name to the number of trials it passed.
+    """
+    passed = {"target conf": 0, "matched pairs": 0, "max iou (float64)": 0}
+    for _ in range(trials):
+        pred_boxes, target_boxes = random_batch(batch_size, max_boxes, num_preds, generator=generator)
+
+        torch.testing.assert_close(calculate_target_conf_batched(pred_boxes[..., :4], target_boxes),
+                                   baseline.calculate_target_conf(pred_boxes[..., :4], target_boxes))
+        passed["target conf"] += 1
+
+        # Pairs are compared in order: image by image, by prediction index within each image
+        for old, new in zip(baseline.filter_and_trim_boxes(pred_boxes, target_boxes), match_boxes(pred_boxes, target_boxes)):
+            torch.testing.assert_close(new, old)
+        passed["matched pairs"] += 1
+
+        pred_double, target_double = pred_boxes[..., :4].double(), target_boxes.double()
+        values, _ = max_box_iou(pred_double, target_double, max_elements=num_preds * max_boxes)  # several chunks
+        for image in range(1, batch_size):
+            gt_boxes = target_double[image][target_double[image].sum(dim=1) > 0]
+            torch.testing.assert_close(values[image], box_iou(pred_double[image], gt_boxes).max(dim=1).values)
+        passed["max iou (float64)"] += 1
+    return passed
+
+
+def check_loss(baseline, anchor_boxes, trials, batch_size, boxes, generator):
+    """
+    The total loss and its gradient on random detector outputs, for the baseline CombinedLoss and the current one
+    with the default hungarian matcher and no candidate window.
+
+    Returns:
+    - worst: The largest absolute difference of the loss and of the gradient over the trials.
+    """
+    old_loss = baseline.CombinedLoss(anchor_boxes)
+    new_loss = CombinedLoss(anchor_boxes, candidate_window=None)
+    worst_loss = 0.0
+    worst_grad = 0.0
+    for _ in range(trials):
+        outputs = [torch.randn(batch_size, 3, Constants.desired_size // stride, Constants.desired_size // stride, 6,
+                               generator=generator) for stride in (8, 16, 32)]
+        targets = random_targets(batch_size, boxes, anchor_boxes, generator=generator)
+
+        results = []
+        for criterion in (old_loss, new_loss):
+            # The loss replaces the entries of both lists, so every run gets its own
+            leaves = [output.clone().requires_grad_() for output in outputs]
+            loss = criterion(list(leaves), [scale.clone() for scale in targets])
+            loss.backward()
+            results.append((loss.detach(), [leaf.grad for leaf in leaves]))
+
+        (old_value, old_grads), (new_value, new_grads) = results
+        torch.testing.assert_close(new_value, old_value, rtol=1e-5, atol=1e-6)
+        worst_loss = max(worst_loss, float((new_value - old_value).abs()))
+        for old_grad, new_grad in zip(old_grads, new_grads):
+            torch.testing.assert_close(new_grad, old_grad, rtol=1e-4, atol=1e-7)
+            worst_grad = max(worst_grad, float((new_grad - old_grad).abs().max()))
+    return worst_loss, worst_grad
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check the batched confidence targets, matching and loss against the per-image versions they replaced.")
+    parser.add_argument("--revision", default=baseline_revision, help="Commit to load the per-image CombinedLoss.py from.")
+    parser.add_argument("--trials", type=int, default=20)
+    parser.add_argument("--loss-trials", type=int, default=3)
+    parser.add_argument("--batch-size", type=int, default=4)
+    parser.add_argument("--max-boxes", type=int, default=30, help="Padded ground-truth slots per image in the target checks.")
+    parser.add_argument("--preds", type=int, default=400, help="Predictions per image in the target checks.")
+    parser.add_argument("--boxes", type=int, default=40, help="Ground-truth boxes per image, over all scales, in the loss check.")
+    args = parser.parse_args()
+
+    baseline = load_baseline(args.revision)
+    generator = torch.Generator().manual_seed(0)
+
+    for name, count in check_targets(baseline, args.trials, args.batch_size, args.max_boxes, args.preds, generator).items():
+        print(f"{name:<18} same in {count}/{args.trials} batches")
+
+    worst_loss, worst_grad = check_loss(baseline, load_anchor_boxes(), args.loss_trials, args.batch_size, args.boxes, generator)
+    print(f"{'total loss':<18} same in {args.loss_trials}/{args.loss_trials} batches "
+          f"(largest difference {worst_loss:.2e}, gradient {worst_grad:.2e})")
@@ -0,0 +1,128 @@
+import math
+import torch
+from torchvision.transforms.functional import pil_to_tensor
+
+
+# Upper bound on the sampled pixels held at once, so large groups are cut out in chunks
+max_sample_elements = 2 ** 22
+
+
+def crop_geometry(boxes, fixed_height=32):
+    """
+    Integer crop rectangles and output widths for [N, 4] corner boxes, with the same rounding as the old per-box loop.
+
+    Returns:
+    - kept: Indices of the boxes with a non-empty crop.
+    - rects: Tensor [K, 4] of (x_min, y_min, width, height) for the kept boxes.
+    - out_widths: Tensor [K] of crop widths after resizing to fixed_height, keeping the aspect ratio.
+    """
+    boxes = boxes.float().cpu()
+    x_min = boxes[:, 0].round().clamp(min=0).long()
+    y_min = boxes[:, 1].round().clamp(min=0).long()
+    x_max = boxes[:, 2].round().long()
+    y_max = boxes[:, 3].round().long()
+    widths = x_max - x_min
+    heights = y_max - y_min
+
+    # Skip invalid crops
+    kept = torch.nonzero((widths > 0) & (heights > 0), as_tuple=True)[0]
+    rects = torch.stack([x_min, y_min, widths, heights], dim=1)[kept]
+    out_widths = (rects[:, 2].double() * (fixed_height / rects[:, 3].double())).long().clamp(min=1)
+    return kept, rects, out_widths
+
+
+def sample_positions(starts, lengths, out_size, samples):
+    """
+    Source pixel coordinates [G, out_size * samples] for resizing each span (start, length) to out_size pixels,
+    with `samples` evenly spaced sub-samples per output pixel (pixel centers, like align_corners=False).
+    """
+    steps = (torch.arange(out_size * samples, dtype=torch.float32) + 0.5) / (out_size * samples)
+    return starts[:, None].float() + steps[None, :] * lengths[:, None].float() - 0.5
+
+
+def bilinear_gather(image, ys, xs):
+    """
+    Bilinearly sample a uint8 image [C, H, W] at the grid ys [G, Y] x xs [G, X] of every crop, returning float [C, G, Y, X].
+    Only the four neighbours of each sample are read and converted, never the whole image.
+    """
+    height, width = image.shape[1], image.shape[2]
+    y0 = ys.floor()
+    x0 = xs.floor()
+    wy = (ys - y0)[None, :, :, None]
+    wx = (xs - x0)[None, :, None, :]
+    y0 = y0.long()
+    x0 = x0.long()
+    y1 = (y0 + 1).clamp(0, height - 1)
+    x1 = (x0 + 1).clamp(0, width - 1)
+    y0 = y0.clamp(0, height - 1)
+    x0 = x0.clamp(0, width - 1)
+
+    def gather(y, x):
+        return image[:, y[:, :, None], x[:, None, :]].float()
+
+    top = gather(y0, x0) * (1 - wx) + gather(y0, x1) * wx
+    bottom = gather(y1, x0) * (1 - wx) + gather(y1, x1) * wx
+    return top * (1 - wy) + bottom * wy
+
+
+def extract_text_crops(image, boxes, means, stds, fixed_height=32, max_samples=4, max_elements=max_sample_elements):
+    """
+    Cut every box out of an image and resize it to fixed_height, keeping the aspect ratio, in batched tensor ops.
+
+    Crops with the same output width are sampled together (an roi_align grouped by width): each output pixel averages
+    up to max_samples x max_samples bilinear samples, which stands in for the antialiasing of a per-crop resize.
+    Sampling reads straight from the uint8 image, so the full resolution image is never converted to float;
+    only the crops themselves are. Parts of a box outside the image come out as 0 after normalization, like the
+    zero padding of torchvision's crop.
+
+    Parameters:
+    - image: PIL image or uint8 tensor [3, H, W].
+    - boxes: Tensor [N, 4] of (x1, y1, x2, y2) boxes in image coordinates.
+    - means, stds: Per channel normalization, as in CRNNtransform.
+    - fixed_height: Int, the crop height the CRNN expects.
+    - max_samples: Int, the most sub-samples per output pixel along each axis.
+    - max_elements: Int, the most sampled values computed at once.
+
+    Returns:
+    - crops: List of normalized tensors [3, fixed_height, W], in box order.
+    - kept: Indices of the boxes that produced a valid crop.
+    """
+    if not isinstance(image, torch.Tensor):
+        image = pil_to_tensor(image)
+    height, width = image.shape[1], image.shape[2]
+    means = torch.tensor(means, dtype=torch.float32).view(-1, 1, 1, 1) * 255
+    stds = torch.tensor(stds, dtype=torch.float32).view(-1, 1, 1, 1) * 255
+
+    kept, rects, out_widths = crop_geometry(boxes, fixed_height)
+    crops = [None] * kept.numel()
+
+    for out_width in torch.unique(out_widths).tolist():
+        members = torch.nonzero(out_widths == out_width, as_tuple=True)[0]
+        group = rects[members]
+
+        # One sampling density for the whole group, enough for its most downscaled crop
+        samples_y = min(max_samples, max(1, math.ceil(int(group[:, 3].max()) / fixed_height)))
+        samples_x = min(max_samples, max(1, math.ceil(int((group[:, 2].double() / out_width).max()))))
+        per_crop = fixed_height * samples_y * out_width * samples_x
+        chunk = max(1, max_elements // per_crop)
+
+        for start in range(0, members.numel(), chunk):
+            rect = group[start:start + chunk]
+            ys = sample_positions(rect[:, 1], rect[:, 3], fixed_height, samples_y)
+            xs = sample_positions(rect[:, 0], rect[:, 2], out_width, samples_x)
+
+            values = bilinear_gather(image, ys, xs)
+            values = (values - means) / stds
+
+            # Samples that fall outside the image read as zero, like torchvision's crop padding
+            inside = ((ys >= -0.5) & (ys <= height - 0.5))[:, :, None] & ((xs >= -0.5) & (xs <= width - 0.5))[:, None, :]
+            values = values * inside[None].float()
+
+            # Average the sub-samples of every output pixel
+            values = values.view(-1, rect.size(0), fixed_height, samples_y, out_width, samples_x).mean(dim=(3, 5))
+            values = values.permute(1, 0, 2, 3)
+
+            for offset, index in enumerate(members[start:start + chunk].tolist()):
+                crops[index] = values[offset]
+
+    return crops, kept.tolist()
@@ -0,0 +1,155 @@
+import math
+import torch
+import Constants
+
+
+def confidence_logit(conf_threshold):
+    """
+    Inverse sigmoid of a confidence threshold: sigmoid(x) >= conf_threshold when x >= confidence_logit(conf_threshold)
+    (boxes within float rounding of the threshold can land on either side).
+    """
+    if conf_threshold <= 0:
+        return float("-inf")
+    if conf_threshold >= 1:
+        return float("inf")
+    return math.log(conf_threshold / (1 - conf_threshold))
+
+
+class DetectionDecoder:
+    """
+    Decodes the raw detector maps of every scale into one flat [B, N, 5] tensor of (x1, y1, x2, y2, confidence),
+    where N is the sum of num_anchors * grid_h * grid_w over the scales, in the same order as
+    postprocess_yolo_output + view(B, -1, 5) + yolo_to_corners_batches + torch.cat over the scales.
+
+    The grid offsets and anchor sizes only depend on the scale, its grid size, the input size, the device and the
+    dtype, so they are built once per key and cached instead of being regenerated and expanded to the batch on every
+    forward pass. Grids do not have to be square: the stride is worked out separately for x and y from the input size,
+    which is image_size x image_size unless given. Anchor sizes stay relative to image_size, the training scale.
+    Used by the inference pipeline and by CombinedLoss.forward.
+    """
+    def __init__(self, anchor_boxes, num_anchors=Constants.num_anchor_boxes, image_size=Constants.desired_size):
+        self.anchor_boxes = anchor_boxes
+        self.num_anchors = num_anchors
+        self.image_size = image_size
+        self.cache = {}
+
+    def scale_constants(self, scale, grid_h, grid_w, device, dtype, input_size=None):
+        """
+        Returns the cached (grid [1, A*H*W, 2], anchor sizes [1, A*H*W, 2], stride [2] as (x, y)) of one scale.
+        input_size is the (height, width) of the detector input, image_size x image_size when None.
+        """
+        input_h, input_w = input_size if input_size is not None else (self.image_size, self.image_size)
+        key = (scale, grid_h, grid_w, int(input_h), int(input_w), device, dtype)
+        if key not in self.cache:
+            anchors = self.anchor_boxes[(scale * self.num_anchors):((scale + 1) * self.num_anchors)]
+            if len(anchors) != self.num_anchors:
+                raise ValueError("Anchor boxes not configured correctly.")
+
+            grid_y, grid_x = torch.meshgrid(torch.arange(grid_h, device=device, dtype=dtype),
+                                            torch.arange(grid_w, device=device, dtype=dtype), indexing='ij')
+            grid = torch.stack((grid_x, grid_y), dim=-1)
+            grid = grid.view(1, 1, grid_h, grid_w, 2).expand(1, self.num_anchors, grid_h, grid_w, 2).reshape(1, -1, 2)
+
+            anchor_sizes = anchors.to(device=device, dtype=dtype).view(1, self.num_anchors, 1, 1, 2)
+            anchor_sizes = anchor_sizes.expand(1, self.num_anchors, grid_h, grid_w, 2).reshape(1, -1, 2)
+
+            stride = torch.tensor([input_w / grid_w, input_h / grid_h], device=device, dtype=dtype)
+            self.cache[key] = (grid, anchor_sizes, stride)
+        return self.cache[key]
+
+    @staticmethod
+    def scale_sizes(outputs):
+        """
+        Number of boxes each scale contributes to the flat tensor, for decoded.split(sizes, dim=1).
+        """
+        return [output.shape[1] * output.shape[2] * output.shape[3] for output in outputs]
+
+    def decode(self, outputs, input_size=None):
+        """
+        Parameters:
+        - outputs: List of raw detector maps [B, num_anchors, grid_h, grid_w, >=5], one per scale. Not modified.
+        - input_size: Optional (height, width) of the detector input, for rectangular inputs.
+
+        Returns:
+        - decoded: Tensor [B, N, 5] of corner boxes in pixels and sigmoid confidences.
+        """
+        batch_size = outputs[0].shape[0]
+        sizes = self.scale_sizes(outputs)
+        decoded = outputs[0].new_empty(batch_size, sum(sizes), 5)
+
+        start = 0
+        for scale, (output, size) in enumerate(zip(outputs, sizes)):
+            grid, anchor_sizes, stride = self.scale_constants(scale, output.shape[2], output.shape[3], output.device, output.dtype, input_size)
+            output = output[..., :5].reshape(batch_size, size, 5)
+
+            # Same arithmetic as postprocess_yolo_output: centers from the cell offsets, sizes from the anchors
+            centers = (torch.sigmoid(output[..., 0:2]) + grid) * stride
+            half_sizes = (torch.exp(output[..., 2:4]) * anchor_sizes * self.image_size) / 2
+
+            decoded[:, start:start + size, 0:2] = centers - half_sizes
+            decoded[:, start:start + size, 2:4] = centers + half_sizes
+            decoded[:, start:start + size, 4] = torch.sigmoid(output[..., 4])
+            start += size
+
+        return decoded
+
+    def decode_confident(self, outputs, conf_threshold=0.90, top_k=None, input_size=None):
+        """
+        Decode only the boxes whose confidence reaches conf_threshold, per image.
+
+        The gate is applied to the raw objectness logits (against the inverse sigmoid of the threshold), so the
+        exp, grid offset and corner conversion only run for the survivors and the cost follows the number of
+        detected text regions instead of the grid size.
+
+        Parameters:
+        - outputs: List of raw detector maps [B, num_anchors, grid_h, grid_w, >=5], one per scale. Not modified.
+        - conf_threshold: Float, the minimum confidence score to keep a box.
+        - top_k: Optional int, the most boxes kept per image (the most confident ones).
+        - input_size: Optional (height, width) of the detector input, for rectangular inputs.
+
+        Returns:
+        - List of (boxes [M, 4], confidences [M, 1]) tuples, one per image, in the same order decode() uses.
+        """
+        batch_size = outputs[0].shape[0]
+        logit_threshold = confidence_logit(conf_threshold)
+
+        image_indices = []
+        raw = []
+        grids = []
+        anchors = []
+        strides = []
+        for scale, output in enumerate(outputs):
+            grid, anchor_sizes, stride = self.scale_constants(scale, output.shape[2], output.shape[3], output.device, output.dtype, input_size)
+            output = output[..., :5].reshape(batch_size, -1, 5)
+
+            b, n = torch.nonzero(output[..., 4] >= logit_threshold, as_tuple=True)
+            image_indices.append(b)
+            raw.append(output[b, n])
+            grids.append(grid[0, n])
+            anchors.append(anchor_sizes[0, n])
+            strides.append(stride.expand(n.numel(), 2))
+
+        image_indices = torch.cat(image_indices)
+        raw = torch.cat(raw)
+        logits = raw[:, 4]
+
+        if top_k is not None:
+            # Keep the top_k highest logits of every image, in their original order
+            keep = torch.zeros_like(image_indices, dtype=torch.bool)
+            for b in range(batch_size):
+                candidates = torch.nonzero(image_indices == b, as_tuple=True)[0]
+                if candidates.numel() > top_k:
+                    candidates = candidates[torch.topk(logits[candidates], top_k).indices]
+                keep[candidates] = True
+            image_indices, raw, logits = image_indices[keep], raw[keep], logits[keep]
+            grids, anchors, strides = torch.cat(grids)[keep], torch.cat(anchors)[keep], torch.cat(strides)[keep]
+        else:
+            grids, anchors, strides = torch.cat(grids), torch.cat(anchors), torch.cat(strides)
+
+        # Box geometry for the survivors only, same arithmetic as decode()
+        centers = (torch.sigmoid(raw[:, 0:2]) + grids) * strides
+        half_sizes = (torch.exp(raw[:, 2:4]) * anchors * self.image_size) / 2
+        boxes = torch.cat([centers - half_sizes, centers + half_sizes], dim=1)
+        confidences = torch.sigmoid(logits).unsqueeze(1)
+
+        return [(boxes[image_indices == b], confidences[image_indices == b]) for b in range(batch_size)]
@@ -0,0 +1,238 @@
+import argparse
+import math
+import torch
+import torch.nn as nn
+from torch.nn.utils.fusion import fuse_conv_bn_eval
+import Constants
+
+
+# Layout of ultralytics/yolov5 models/yolov5s.yaml (v6/v7) as [from, number, module, args].
+# Parameter names follow the hub model exactly so model_checkpoint213.pth loads without any key remapping.
+yolov5s_text_config = {
+    "depth_multiple": 0.33,
+    "width_multiple": 0.50,
+    "backbone": [
+        [-1, 1, "Conv", [64, 6, 2, 2]],  # 0-P1/2
+        [-1, 1, "Conv", [128, 3, 2]],  # 1-P2/4
+        [-1, 3, "C3", [128]],
+        [-1, 1, "Conv", [256, 3, 2]],  # 3-P3/8
+        [-1, 6, "C3", [256]],
+        [-1, 1, "Conv", [512, 3, 2]],  # 5-P4/16
+        [-1, 9, "C3", [512]],
+        [-1, 1, "Conv", [1024, 3, 2]],  # 7-P5/32
+        [-1, 3, "C3", [1024]],
+        [-1, 1, "SPPF", [1024, 5]],  # 9
+    ],
+    "head": [
+        [-1, 1, "Conv", [512, 1, 1]],
+        [-1, 1, "Upsample", [None, 2, 'nearest']],
+        [[-1, 6], 1, "Concat", [1]],  # cat backbone P4
+        [-1, 3, "C3", [512, False]],  # 13
+
+        [-1, 1, "Conv", [256, 1, 1]],
+        [-1, 1, "Upsample", [None, 2, 'nearest']],
+        [[-1, 4], 1, "Concat", [1]],  # cat backbone P3
+        [-1, 3, "C3", [256, False]],  # 17 (P3/8-small)
+
+        [-1, 1, "Conv", [256, 3, 2]],
+        [[-1, 14], 1, "Concat", [1]],  # cat head P4
+        [-1, 3, "C3", [512, False]],  # 20 (P4/16-medium)
+
+        [-1, 1, "Conv", [512, 3, 2]],
+        [[-1, 10], 1, "Concat", [1]],  # cat head P5
+        [-1, 3, "C3", [1024, False]],  # 23 (P5/32-large)
+
+        [[17, 20, 23], 1, "Detect", []],  # Detect(P3, P4, P5)
+    ],
+}
+
+
+def make_divisible(x, divisor=8):
+    return math.ceil(x / divisor) * divisor
+
+
+class Conv(nn.Module):
+    # Conv2d + BatchNorm + SiLU, padded to keep 'same' size at stride 1
+    def __init__(self, c1, c2, k=1, s=1, p=None):
+        super().__init__()
+        self.conv = nn.Conv2d(c1, c2, k, s, k // 2 if p is None else p, bias=False)
+        self.bn = nn.BatchNorm2d(c2, eps=1e-3, momentum=0.03)  # yolov5 initialize_weights() values
+        self.act = nn.SiLU(inplace=True)
+
+    def forward(self, x):
+        return self.act(self.bn(self.conv(x)))
+
+
+class Bottleneck(nn.Module):
+    def __init__(self, c1, c2, shortcut=True, e=0.5):
+        super().__init__()
+        c_ = int(c2 * e)
+        self.cv1 = Conv(c1, c_, 1, 1)
+        self.cv2 = Conv(c_, c2, 3, 1)
+        self.add = shortcut and c1 == c2
+
+    def forward(self, x):
+        return x + self.cv2(self.cv1(x)) if self.add else self.cv2(self.cv1(x))
+
+
+class C3(nn.Module):
+    # CSP Bottleneck with 3 convolutions
+    def __init__(self, c1, c2, n=1, shortcut=True, e=0.5):
+        super().__init__()
+        c_ = int(c2 * e)
+        self.cv1 = Conv(c1, c_, 1, 1)
+        self.cv2 = Conv(c1, c_, 1, 1)
+        self.cv3 = Conv(2 * c_, c2, 1)
+        self.m = nn.Sequential(*(Bottleneck(c_, c_, shortcut, e=1.0) for _ in range(n)))
+
+    def forward(self, x):
+        return self.cv3(torch.cat((self.m(self.cv1(x)), self.cv2(x)), 1))
+
+
+class SPPF(nn.Module):
+    # Spatial Pyramid Pooling - Fast
+    def __init__(self, c1, c2, k=5):
+        super().__init__()
+        c_ = c1 // 2
+        self.cv1 = Conv(c1, c_, 1, 1)
+        self.cv2 = Conv(c_ * 4, c2, 1, 1)
+        self.m = nn.MaxPool2d(kernel_size=k, stride=1, padding=k // 2)
+
+    def forward(self, x):
+        x = self.cv1(x)
+        y1 = self.m(x)
+        y2 = self.m(y1)
+        return self.cv2(torch.cat((x, y1, y2, self.m(y2)), 1))
+
+
+class Concat(nn.Module):
+    def __init__(self, dimension=1):
+        super().__init__()
+        self.d = dimension
+
+    def forward(self, x):
+        return torch.cat(x, self.d)
+
+
+class Detect(nn.Module):
+    """
+    The Detect layer after the surgery done on the hub model: 1 class, Constants.num_anchor_boxes anchors per scale
+    and 6 outputs per anchor. It always returns the raw per-scale maps [B, num_anchors, grid_h, grid_w, 6],
+    which is what postprocess_yolo_output decodes.
+    """
+    def __init__(self, ch, anchor_boxes=None):
+        super().__init__()
+        self.nc = 1  # 1 class (text)
+        self.na = Constants.num_anchor_boxes
+        self.no = 6  # 4 bbox + 1 confidence + 1 class
+        self.nl = len(ch)
+        if anchor_boxes is None:
+            anchor_boxes = torch.zeros(self.nl * self.na, 2)
+        self.register_buffer('anchors', anchor_boxes.detach().clone().float().cpu())
+        self.m = nn.ModuleList(nn.Conv2d(x, self.no * self.na, 1) for x in ch)
+
+    def forward(self, x):
+        outputs = []
+        for i in range(self.nl):
+            out = self.m[i](x[i])
+            # Sizes read through shape[i] (no tuple unpacking) so the model also traces under torch.fx for quantization
+            outputs.append(out.view(out.shape[0], self.na, self.no, out.shape[2], out.shape[3]).permute(0, 1, 3, 4, 2).contiguous())
+        return outputs
+
+
+modules = {"Conv": Conv, "C3": C3, "SPPF": SPPF, "Concat": Concat, "Detect": Detect, "Upsample": nn.Upsample}
+
+
+class TextDetector(nn.Module):
+    """
+    Self-contained replacement for torch.hub.load('ultralytics/yolov5', 'yolov5s') plus the Detect layer patching.
+    """
+    def __init__(self, anchor_boxes=None, config=yolov5s_text_config):
+        super().__init__()
+        gd, gw = config["depth_multiple"], config["width_multiple"]
+        layers, ch = [], [3]
+        self.sources = []
+        for i, (f, n, name, args) in enumerate(config["backbone"] + config["head"]):
+            n = max(round(n * gd), 1) if n > 1 else n  # depth gain
+            if name in ("Conv", "C3", "SPPF"):
+                c1, c2 = ch[f], make_divisible(args[0] * gw, 8)  # width gain
+                args = [c1, c2, *args[1:]]
+                if name == "C3":
+                    args.insert(2, n)  # number of repeats
+                    n = 1
+                module = nn.Sequential(*(modules[name](*args) for _ in range(n))) if n > 1 else modules[name](*args)
+            elif name == "Concat":
+                c2 = sum(ch[x] for x in f)
+                module = Concat(*args)
+            elif name == "Detect":
+                c2 = None
+                module = Detect([ch[x] for x in f], anchor_boxes)
+            else:
+                c2 = ch[f]
+                module = modules[name](*args)
+
+            if i == 0:
+                ch = []
+            ch.append(c2)
+            layers.append(module)
+            self.sources.append(f)
+
+        self.model = nn.Sequential(*layers)
+
+    def fuse(self):
+        """
+        Fold every BatchNorm into the convolution before it (inference only, puts the model in eval mode).
+        """
+        self.eval()
+        for m in self.modules():
+            if isinstance(m, Conv) and not isinstance(m.bn, nn.Identity):
+                m.conv = fuse_conv_bn_eval(m.conv, m.bn)
+                m.bn = nn.Identity()
+        return self
+
+    def forward(self, x):
+        y = []  # outputs of every layer, used by Concat and Detect
+        for f, m in zip(self.sources, self.model):
+            if f != -1:
+                x = y[f] if isinstance(f, int) else [x if j == -1 else y[j] for j in f]
+            x = m(x)
+            y.append(x)
+        return x
+
+
+def build_text_detector(anchor_boxes=None):
+    return TextDetector(anchor_boxes)
+
+
+def load_text_detector(checkpoint_path, anchor_boxes=None, device="cpu"):
+    """
+    Build the detector locally and load a training checkpoint ({'model_state_dict': ...}) into it. No network needed.
+    """
+    cnn_model = build_text_detector(anchor_boxes)
+    checkpoint = torch.load(checkpoint_path, map_location="cpu")
+    cnn_model.load_state_dict(checkpoint['model_state_dict'])
+    return cnn_model.to(device).eval()
+
+
+def export_torchscript(cnn_model, output_path, device="cpu"):
+    """
+    Trace the detector into a TorchScript artifact that torch.jit.load can run without any of this Python code.
+    """
+    cnn_model = cnn_model.to(device).eval()
+    example = torch.zeros(1, 3, Constants.desired_size, Constants.desired_size, device=device)
+    with torch.no_grad():
+        traced = torch.jit.trace(cnn_model, example)
+    traced = torch.jit.freeze(traced)
+    torch.jit.save(traced, output_path)
+    return traced
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the text detector from a checkpoint and export a TorchScript artifact.")
+    parser.add_argument("--checkpoint", default="../model_checkpoint213.pth")
+    parser.add_argument("--output", default="../detector_traced.pt")
+    args = parser.parse_args()
+
+    cnn_model = load_text_detector(args.checkpoint)
+    export_torchscript(cnn_model, args.output)
+    print(f"TorchScript detector written to {args.output}")
@@ -0,0 +1,171 @@
+import argparse
+import copy
+import random
+import time
+import torch
+from torch.ao.quantization import get_default_qconfig_mapping
+from torch.ao.quantization.quantize_fx import prepare_fx, convert_fx
+from torchvision.ops import box_iou
+import Constants
+from DetectorBuilder import load_text_detector, export_torchscript
+
+
+detector_variants = ("fp32", "int8")
+detector_int8_path = "../detector_int8.pt"
+
+
+def example_inputs(batch_size=1):
+    return (torch.zeros(batch_size, 3, Constants.desired_size, Constants.desired_size),)
+
+
+def fuse_detector(cnn_model):
+    """
+    Eval-mode copy of the detector with every BatchNorm folded into its convolution. Still fp32, runs anywhere.
+    SiLU has no fused conv kernel in PyTorch, so the activations stay separate modules.
+    """
+    return copy.deepcopy(cnn_model).cpu().fuse()
+
+
+def prepare_detector_static(cnn_model, backend="x86"):
+    """
+    Fused detector with observers inserted by FX graph mode quantization, ready for calibration.
+    FX handles the residual adds, the Concat layers and the upsampling that eager mode stubs cannot.
+    Ops without an INT8 kernel (SiLU) run in float between quantized convolutions.
+    """
+    torch.backends.quantized.engine = backend
+    fused = fuse_detector(cnn_model)
+    return prepare_fx(fused, get_default_qconfig_mapping(backend), example_inputs())
+
+
+@torch.no_grad()
+def calibrate(prepared, batches):
+    """
+    Run letterboxed [B, 3, desired_size, desired_size] batches through the prepared detector so the observers record
+    activation ranges.
+    """
+    for batch in batches:
+        prepared(batch.cpu())
+
+
+def quantize_detector_static(cnn_model, batches, backend="x86"):
+    """
+    Static INT8 detector calibrated on letterboxed image batches. CPU only.
+    """
+    prepared = prepare_detector_static(cnn_model, backend)
+    calibrate(prepared, batches)
+    return convert_fx(prepared).eval()
+
+
+def letterboxed_batches(paths, batch_size=8):
+    """
+    Load and letterbox image paths exactly like the inference pipeline, yielding [B, 3, desired_size, desired_size] batches.
+    """
+    from OCRPipeline import load_image, letterbox
+
+    batch = []
+    for path in paths:
+        # Only the detector input is needed, so JPEGs are decoded straight to its size
+        batch.append(letterbox(load_image(path, Constants.desired_size))[0])
+        if len(batch) == batch_size:
+            yield torch.stack(batch)
+            batch = []
+    if batch:
+        yield torch.stack(batch)
+
+
+def box_recall(reference, predicted, iou_threshold=0.5):
+    """
+    Number of reference boxes matched by at least one predicted box with IoU >= iou_threshold.
+    """
+    if reference.numel() == 0 or predicted.numel() == 0:
+        return 0
+    return int((box_iou(reference, predicted).max(dim=1).values >= iou_threshold).sum())
+
+
+@torch.no_grad()
+def evaluate_variant(pipeline, cnn_model, batches, reference=None, iou_threshold=0.5):
+    """
+    Run one detector variant through the pipeline's decode and post-processing on CPU.
+
+    Parameters:
+    - pipeline: OCRPipeline whose detector is swapped for cnn_model.
+    - cnn_model: The detector variant.
+    - batches: List of letterboxed batches.
+    - reference: Optional list of per-image boxes from the fp32 checkpoint to measure the recall against.
+    - iou_threshold: Float, the IoU at which a box counts as found.
+
+    Returns:
+    - boxes: List of per-image [N, 4] boxes.
+    - report: Dict with ms_per_image, boxes_per_image and recall (in %, 100 without a reference).
+    """
+    pipeline.detector = cnn_model
+    boxes = []
+    elapsed = 0.0
+    for batch in batches:
+        began = time.perf_counter()
+        detections = pipeline.detect(batch)
+        elapsed += time.perf_counter() - began
+        boxes.extend(pred_coords for pred_coords, _ in detections)
+
+    num_images = len(boxes)
+    if reference is None:
+        recall = 100.0
+    else:
+        found = sum(box_recall(ref, pred, iou_threshold) for ref, pred in zip(reference, boxes))
+        total = sum(len(ref) for ref in reference)
+        recall = found / total * 100 if total else 100.0
+
+    return boxes, {
+        "ms_per_image": elapsed / num_images * 1000 if num_images else 0.0,
+        "boxes_per_image": sum(len(b) for b in boxes) / num_images if num_images else 0.0,
+        "recall": recall,
+    }
+
+
+if __name__ == "__main__":
+    from OCRPipeline import OCRPipeline, image_sources
+
+    parser = argparse.ArgumentParser(description="Fuse and statically quantize the text detector, then compare it with the fp32 checkpoint on CPU.")
+    parser.add_argument("--checkpoint", default="../model_checkpoint213.pth")
+    parser.add_argument("--images", default="./training_data/train_images/", help="Directory, glob or manifest of TextOCR images.")
+    parser.add_argument("--calibration-images", type=int, default=256)
+    parser.add_argument("--eval-images", type=int, default=200)
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--output", default=detector_int8_path, help="Where the TorchScript INT8 detector is saved.")
+    parser.add_argument("--threads", type=int, default=None)
+    args = parser.parse_args()
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+
+    # Disjoint calibration and evaluation images, the same ones on every run
+    paths = list(image_sources(args.images))
+    random.Random(0).shuffle(paths)
+    calibration_paths = paths[:args.calibration_images]
+    eval_paths = paths[args.calibration_images:args.calibration_images + args.eval_images]
+
+    # Built once and shared by every variant
+    eval_batches = list(letterboxed_batches(eval_paths, args.batch_size))
+
+    # The pipeline only provides decoding and post-processing here; its detector is replaced by each variant
+    pipeline = OCRPipeline(detector_checkpoint=args.checkpoint, detector_artifact=None, device=torch.device("cpu"))
+    fp32_model = load_text_detector(args.checkpoint, pipeline.anchor_boxes.cpu())
+    int8_model = quantize_detector_static(fp32_model, letterboxed_batches(calibration_paths, args.batch_size))
+    traced = export_torchscript(int8_model, args.output)
+    print(f"Static INT8 detector written to {args.output} (calibrated on {len(calibration_paths)} images)")
+
+    models = {
+        "fp32": fp32_model,
+        "fp32-fused": fuse_detector(fp32_model),
+        "int8": int8_model,
+        "int8-traced": traced,
+    }
+    print(f"{'variant':<12} {'ms/image':>9} {'speedup':>8} {'boxes/img':>10} {'recall':>8}")
+    reference = None
+    baseline = None
+    for name, model in models.items():
+        boxes, report = evaluate_variant(pipeline, model, eval_batches, reference)
+        reference = reference or boxes
+        baseline = baseline or report["ms_per_image"]
+        print(f"{name:<12} {report['ms_per_image']:9.2f} {baseline / report['ms_per_image']:7.2f}x "
+              f"{report['boxes_per_image']:10.2f} {report['recall']:7.2f}%")
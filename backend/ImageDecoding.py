@@ -0,0 +1,76 @@
+import io
+from PIL import Image, ImageOps
+import Constants
+
+
+# EXIF orientations that turn the image by 90 degrees, so the stored width and height are swapped
+transposed_orientations = (5, 6, 7, 8)
+
+
+def open_image(source):
+    """
+    Open a path, raw encoded bytes or an already opened PIL image without decoding the pixels yet.
+    """
+    if isinstance(source, Image.Image):
+        return source
+    if isinstance(source, (bytes, bytearray)):
+        return Image.open(io.BytesIO(source))
+    return Image.open(source.strip('"'))  # remove quotes from sides of path if included
+
+
+def target_size(width, height, max_dim):
+    """
+    (width, height) ResizeToMaxDimension gives an image of this size: max_dim on the longest side, never upscaled.
+    """
+    if max(width, height) > max_dim:
+        scale = max_dim / max(width, height)
+        return int(width * scale), int(height * scale)
+    return width, height
+
+
+def decode_image(source, max_dim=None, exif_transpose=True):
+    """
+    Decode an image to RGB, optionally straight to max_dim on its longest side.
+
+    With max_dim, a JPEG is first decoded as a DCT-scaled draft (1/2, 1/4 or 1/8 of the size, the smallest
+    that is still at least the target), which skips most of the decoding work for large photos; the draft is
+    then resized precisely to the size ResizeToMaxDimension would have given the full image, so transforms
+    and box scales computed from the original size are unchanged. Other formats decode in full first.
+
+    Parameters:
+    - source: Path, encoded bytes or PIL image.
+    - max_dim: Optional int, the longest side of the decoded image. None decodes at full resolution.
+    - exif_transpose: Rotate/flip the image according to its EXIF orientation (all 8 orientations).
+
+    Returns:
+    - image: RGB PIL image.
+    - original_size: (width, height) of the full resolution image, after the EXIF orientation.
+    """
+    image = open_image(source)
+    orientation = image.getexif().get(0x0112, 1) if exif_transpose else 1  # 0x0112 is the Orientation tag
+    width, height = image.size
+    if orientation in transposed_orientations:
+        width, height = height, width
+    original_size = (width, height)
+
+    if max_dim is not None:
+        target = target_size(width, height, max_dim)
+        # The draft is requested in the stored orientation, before the transpose
+        draft_size = (target[1], target[0]) if orientation in transposed_orientations else target
+        if image.format == "JPEG":
+            image.draft("RGB", draft_size)
+
+    if exif_transpose:
+        image = ImageOps.exif_transpose(image)
+    image = image.convert("RGB")
+
+    if max_dim is not None and image.size != target:
+        image = image.resize(target, Image.BILINEAR)
+    return image, original_size
+
+
+def decode_for_detector(source, exif_transpose=True):
+    """
+    decode_image at the detector input size (Constants.desired_size).
+    """
+    return decode_image(source, Constants.desired_size, exif_transpose)
@@ -0,0 +1,232 @@
+import argparse
+import json
+import queue
+import sys
+import threading
+import time
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import torch
+from OCRPipeline import OCRPipeline, load_image
+from CRNNQuantization import crnn_variants
+from DetectorQuantization import detector_variants
+from OnnxBackend import backends
+from ResultCache import ResultCache, image_digest, pipeline_fingerprint, default_cache_dir, default_memory_entries
+
+
+class QueueFullError(Exception):
+    pass
+
+
+class MicroBatcher:
+    """
+    Collects single requests from many threads into micro-batches for one worker thread.
+
+    A batch is closed as soon as it holds max_batch_size items or max_wait seconds have passed since
+    its first item arrived. When max_queue requests are already waiting, submit raises QueueFullError
+    instead of letting the backlog (and everyone's latency) grow without bound.
+    """
+    def __init__(self, process_fn, max_batch_size=8, max_wait=0.01, max_queue=64):
+        self.process_fn = process_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.stats = {"requests": 0, "batches": 0, "rejected": 0, "errors": 0}
+        self.stats_lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+    def submit(self, item):
+        future = Future()
+        try:
+            self.queue.put_nowait((item, future, time.perf_counter()))
+        except queue.Full:
+            with self.stats_lock:
+                self.stats["rejected"] += 1
+            raise QueueFullError(f"{self.queue.maxsize} requests already queued")
+        return future
+
+    def get_stats(self):
+        with self.stats_lock:
+            stats = dict(self.stats)
+        stats["queue_depth"] = self.queue.qsize()
+        stats["mean_batch_size"] = stats["requests"] / stats["batches"] if stats["batches"] else 0.0
+        return stats
+
+    def _next_batch(self):
+        try:
+            batch = [self.queue.get(timeout=0.1)]
+        except queue.Empty:
+            return []
+
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while not self.stopped.is_set():
+            batch = self._next_batch()
+            if not batch:
+                continue
+
+            started = time.perf_counter()
+            try:
+                results = self.process_fn([item for item, _, _ in batch])
+            except Exception as e:
+                with self.stats_lock:
+                    self.stats["errors"] += len(batch)
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                continue
+            finished = time.perf_counter()
+
+            with self.stats_lock:
+                self.stats["requests"] += len(batch)
+                self.stats["batches"] += 1
+
+            for (_, future, enqueued), result in zip(batch, results):
+                timing = {
+                    "queue_ms": (started - enqueued) * 1000,
+                    "inference_ms": (finished - started) * 1000,
+                    "batch_size": len(batch),
+                }
+                future.set_result((result, timing))
+
+
+class OCRRequestHandler(BaseHTTPRequestHandler):
+    """
+    POST /ocr with the encoded image as the request body returns the boxes, confidences and texts as JSON.
+    Images the result cache (when the server has one) has seen before are answered without decoding or batching.
+    GET /health returns the batcher statistics, and the cache statistics under "cache".
+    """
+    request_timeout = 60
+
+    def _send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path != "/health":
+            self._send_json(404, {"error": "not found"})
+            return
+        stats = self.server.batcher.get_stats()
+        if self.server.cache is not None:
+            stats["cache"] = self.server.cache.get_stats()
+        self._send_json(200, stats)
+
+    def do_POST(self):
+        if self.path != "/ocr":
+            self._send_json(404, {"error": "not found"})
+            return
+
+        received = time.perf_counter()
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length)
+
+        key = None
+        if self.server.cache is not None:
+            key = image_digest(body)
+            result = self.server.cache.get(key)
+            if result is not None:
+                latency_ms = (time.perf_counter() - received) * 1000
+                self._send_json(200, {**result, "cached": True, "latency_ms": latency_ms}, {"X-Latency-Ms": f"{latency_ms:.2f}"})
+                return
+
+        # Decode on the connection thread so the model worker only ever sees ready images
+        try:
+            image = load_image(body, self.server.decode_max_dim)
+        except Exception as e:
+            self._send_json(400, {"error": f"could not decode image: {e}"})
+            return
+
+        try:
+            future = self.server.batcher.submit(image)
+        except QueueFullError as e:
+            self._send_json(503, {"error": str(e)}, {"Retry-After": "1"})
+            return
+
+        try:
+            result, timing = future.result(timeout=self.request_timeout)
+        except Exception as e:
+            self._send_json(500, {"error": str(e)})
+            return
+
+        if key is not None:
+            self.server.cache.put(key, result)
+        timing["latency_ms"] = (time.perf_counter() - received) * 1000
+        self._send_json(200, {**result, **timing}, {"X-Latency-Ms": f"{timing['latency_ms']:.2f}"})
+
+    def log_message(self, format, *args):
+        sys.stderr.write(f"{self.address_string()} - {format % args}\n")
+
+
+def create_server(process_fn, host="127.0.0.1", port=8080, max_batch_size=8, max_wait=0.01, max_queue=64, decode_max_dim=None,
+                  cache=None):
+    """
+    Build a threaded HTTP server whose requests are batched through process_fn (a list of PIL images -> list of results).
+    """
+    server = ThreadingHTTPServer((host, port), OCRRequestHandler)
+    server.daemon_threads = True
+    server.decode_max_dim = decode_max_dim
+    server.cache = cache
+    server.batcher = MicroBatcher(process_fn, max_batch_size, max_wait, max_queue).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve OCR requests over HTTP with the models loaded once.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--max-batch-size", type=int, default=8, help="Most images per detector forward pass.")
+    parser.add_argument("--max-wait-ms", type=float, default=10, help="How long a batch waits for more requests after its first one.")
+    parser.add_argument("--max-queue", type=int, default=64, help="Queued requests before new ones are rejected with 503.")
+    parser.add_argument("--device", default='cuda' if torch.cuda.is_available() else 'cpu')
+    parser.add_argument("--crnn", choices=crnn_variants, default="fp32", help="CRNN variant, the INT8 ones run on the CPU.")
+    parser.add_argument("--detector", choices=detector_variants, default="fp32", help="Detector variant, int8 runs on the CPU.")
+    parser.add_argument("--backend", choices=backends, default="torch", help="PyTorch, or ONNX Runtime on the CPU.")
+    parser.add_argument("--intra-op-threads", type=int, default=None)
+    parser.add_argument("--inter-op-threads", type=int, default=None)
+    parser.add_argument("--rect", action="store_true", help="Rectangular detector inputs padded to a multiple of 32.")
+    parser.add_argument("--decode-max-dim", type=int, default=None, help="Decode JPEGs straight to about this longest side (faster for large photos).")
+    parser.add_argument("--cache-dir", default=None, help=f"Keep results by image content in this directory (e.g. {default_cache_dir}).")
+    parser.add_argument("--cache-memory-entries", type=int, default=default_memory_entries)
+    parser.add_argument("--cache-max-mb", type=int, default=512, help="Disk budget of the result cache.")
+    args = parser.parse_args()
+
+    pipeline = OCRPipeline(device=torch.device(args.device), crnn_variant=args.crnn, detector_variant=args.detector,
+                           backend=args.backend, intra_op_threads=args.intra_op_threads, inter_op_threads=args.inter_op_threads,
+                           rectangular=args.rect, decode_max_dim=args.decode_max_dim)
+    cache = None
+    if args.cache_dir:
+        cache = ResultCache(pipeline_fingerprint(pipeline), args.cache_dir, args.cache_memory_entries, args.cache_max_mb * 1024 * 1024)
+    server = create_server(pipeline.process_images, args.host, args.port, args.max_batch_size, args.max_wait_ms / 1000, args.max_queue,
+                           args.decode_max_dim, cache)
+    print(f"Serving OCR on http://{args.host}:{args.port}/ocr")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        server.batcher.stop()
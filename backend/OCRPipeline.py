@@ -0,0 +1,608 @@
+import glob
+import json
+import math
+import os
+import random
+import sys
+import time
+import torch
+import torch.nn.functional as F
+import torchvision.transforms as transforms
+import Constants
+from DetectorBuilder import build_text_detector
+from ImageDecoding import decode_image, target_size
+from CheckpointExport import load_state_dict, detector_weights_path, crnn_weights_path
+from CombinedLoss import apply_nms
+from DetectionDecoder import DetectionDecoder
+from CropExtraction import extract_text_crops
+from DetectorQuantization import detector_variants, detector_int8_path
+from OnnxBackend import backends, onnx_detector_path, onnx_crnn_path, load_onnx_detector, load_onnx_crnn
+from CRNNQuantization import crnn_variants, crnn_static_path, quantize_crnn_dynamic, load_quantized_crnn
+from CRNNBatching import bucket_batches, PaddingStats, default_bucket_edges, default_max_pixels
+from ResultCache import image_digest
+from TiledInference import tile_batches, tiles_to_global, default_max_tile_pixels
+from PostProcessing import remove_contained_boxes, weighted_box_fusion, cluster_boxes
+from TextCRNN import CRNN, LabelEncoder
+from transforms import ResizeToMaxDimension
+
+
+means = [0.3490, 0.3219, 0.2957]
+stds = [0.2993, 0.2850, 0.2735]
+
+detector_checkpoint_path = "../model_checkpoint213.pth"
+crnn_checkpoint_path = "../CRNNmodel_checkpoint_62.pth"
+detector_artifact_path = "../detector_traced.pt"
+anchor_boxes_path = "../anchor_boxes.json"
+
+# Largest downsampling of the detector; rectangular inputs are padded to a multiple of it on each side
+detector_stride = 32
+
+image_extensions = ('.jpg', '.jpeg', '.png', '.bmp', '.tif', '.tiff', '.webp')
+
+BBtransform = transforms.Compose([
+    ResizeToMaxDimension(max_dim=Constants.desired_size),  # Resize based on max dimension while maintaining aspect ratio
+    transforms.ToTensor(),
+    transforms.Normalize(mean=means, std=stds)
+])
+
+
+def load_image(source, max_dim=None):
+    """
+    Load an RGB PIL image from a path, raw encoded bytes or an already opened PIL image, turned upright by its
+    EXIF orientation. With max_dim, large JPEGs are decoded straight to about that size (see ImageDecoding.decode_image)
+    and the full resolution (width, height) is kept in image.info['original_size'] for reporting boxes.
+    """
+    image, original_size = decode_image(source, max_dim)
+    if image.size != original_size:
+        image.info["original_size"] = original_size
+    return image
+
+
+def to_original_coordinates(boxes, image):
+    """
+    Scale [N, 4] boxes on a load_image(..., max_dim) image to its full resolution coordinates (a no-op otherwise).
+    """
+    width, height = image.info.get("original_size", image.size)
+    if (width, height) == image.size:
+        return boxes
+    scale = torch.tensor([width / image.width, height / image.height] * 2, dtype=boxes.dtype)
+    return boxes * scale
+
+
+def pad_to_target_size(image_tensor, target_width, target_height, random_offsets=True):
+    # Get the current tensor dimensions (assuming shape is [C, W, H])
+    _, height, width = image_tensor.shape
+
+    # Calculate padding needed for both width and height
+    pad_width = max(0, target_width - width)
+    pad_height = max(0, target_height - height)
+
+    # Padding is applied as (top, right, bottom, left)
+    # Inference centers the image instead, so the same image always maps its boxes back the same way
+    PadLeft = random.randint(0, pad_width) if random_offsets else pad_width // 2
+    PadRight = pad_width - PadLeft
+    PadTop = random.randint(0, pad_height) if random_offsets else pad_height // 2
+    PadBottom = pad_height - PadTop
+
+    padding = (PadLeft, PadRight, PadTop, PadBottom)
+
+    # Apply padding using F.pad (for tensors), padding must be in (left, right, top, bottom) order
+    padded_image_tensor = F.pad(image_tensor, padding, value=0)
+
+    return padded_image_tensor, padding
+
+
+def getScales(original_size, new_size):
+    old_width, old_height = original_size
+    new_width, new_height = new_size
+
+    # Scale factors for resizing
+    scale_x = new_width / old_width
+    scale_y = new_height / old_height
+
+    return scale_x, scale_y
+
+
+def custom_collate_fn(batch):
+    max_width = max([img.shape[2] for img in batch])
+    processed_images = []
+    for img in batch:
+        padding = (0, max_width - img.shape[2], 0, 0)
+        padded_img = F.pad(img, padding, value=0.5)
+        processed_images.append(padded_img)
+
+    # Stack images into a tensor of shape [batch_size, channels, height, width]
+    images = torch.stack(processed_images, dim=0)
+    return images
+
+
+def resized_size(width, height, max_dim=Constants.desired_size):
+    """
+    (height, width) ResizeToMaxDimension gives an image, without resizing it.
+    """
+    resized_width, resized_height = target_size(width, height, max_dim)
+    return resized_height, resized_width
+
+
+def rectangular_size(width, height, stride=detector_stride):
+    """
+    (height, width) of the rectangular detector input of an image: its resized size rounded up to a multiple of stride.
+    """
+    resized_h, resized_w = resized_size(width, height)
+    return math.ceil(resized_h / stride) * stride, math.ceil(resized_w / stride) * stride
+
+
+def letterbox(image, rectangular=False):
+    """
+    Resize a PIL image to Constants.desired_size on its longest side and pad it, centered, to the detector input:
+    a desired_size square, or with rectangular=True only up to the next multiple of the detector stride on each side.
+
+    Returns:
+    - image_tensor: Normalized tensor of shape [3, desired_size, desired_size] (or [3, H, W] with rectangular).
+    - meta: Dict with the scale factors and padding offsets needed to map boxes back onto the original image.
+    """
+    oldSize = (image.height, image.width)
+    image_tensor = BBtransform(image)
+    newSize = (image_tensor.shape[1], image_tensor.shape[2])
+    scale_y, scale_x = getScales(oldSize, newSize)
+    if rectangular:
+        target_height, target_width = rectangular_size(image.width, image.height)
+    else:
+        target_height, target_width = Constants.desired_size, Constants.desired_size
+    image_tensor, (adjustX1, adjustX2, adjustY1, adjustY2) = pad_to_target_size(image_tensor, target_width, target_height, random_offsets=False)
+
+    meta = {"scale_x": scale_x, "scale_y": scale_y, "pad_x": adjustX1, "pad_y": adjustY1, "width": image.width, "height": image.height}
+    return image_tensor, meta
+
+
+def boxes_to_original(boxes, meta):
+    """
+    Map [N, 4] corner boxes from letterboxed detector coordinates back onto the original image.
+    """
+    offset = torch.tensor([meta["pad_x"], meta["pad_y"], meta["pad_x"], meta["pad_y"]], dtype=torch.float32)
+    scale = torch.tensor([meta["scale_x"], meta["scale_y"], meta["scale_x"], meta["scale_y"]], dtype=torch.float32)
+    return (boxes.float().cpu() - offset) / scale
+
+
+def load_anchor_boxes(path=anchor_boxes_path, device="cpu"):
+    with open(path, 'r') as file:
+        loaded_anchor_boxes = json.load(file)
+    return torch.tensor(loaded_anchor_boxes, dtype=torch.float32).to(device)
+
+
+def load_detector(anchor_boxes, checkpoint_path=detector_checkpoint_path, device="cpu", artifact_path=detector_artifact_path,
+                  weights_path=detector_weights_path, variant="fp32"):
+    """
+    Load the text detector, preferring the TorchScript artifact written by DetectorBuilder.py when it exists,
+    then the weights-only file written by CheckpointExport.py, then the full training checkpoint.
+    None of these touch torch.hub or the network. A detector built from weights has its BatchNorms folded into the convs.
+    variant 'int8' loads the calibrated TorchScript model written by DetectorQuantization.py, which runs on the CPU only.
+    """
+    if variant not in detector_variants:
+        raise ValueError(f"Unknown detector variant {variant}, expected one of {detector_variants}")
+    if variant == "int8":
+        cnn_model = torch.jit.load(detector_int8_path, map_location="cpu")
+    elif artifact_path and os.path.exists(artifact_path):
+        cnn_model = torch.jit.load(artifact_path, map_location=device)
+    else:
+        cnn_model = build_text_detector(anchor_boxes.cpu())
+        cnn_model.load_state_dict(load_state_dict(checkpoint_path, weights_path))
+        cnn_model = cnn_model.fuse().to(device)
+
+    # BatchNorm has to use its running statistics, otherwise every image in a batch changes the result of the others
+    return cnn_model.eval()
+
+
+def load_crnn(checkpoint_path=crnn_checkpoint_path, device="cpu", weights_path=crnn_weights_path, variant="fp32"):
+    """
+    Load the CRNN. variant 'int8-dynamic' quantizes the LSTMs and Linear layers on load, 'int8-static' loads the
+    calibrated model written by CRNNQuantization.py. Both INT8 variants run on the CPU only.
+    """
+    if variant not in crnn_variants:
+        raise ValueError(f"Unknown CRNN variant {variant}, expected one of {crnn_variants}")
+    if variant == "int8-static":
+        return load_quantized_crnn(crnn_static_path)
+
+    num_classes = len(Constants.char_set) + 1  # +1 for CTC blank label
+    CRNNModel = CRNN(num_classes=num_classes, nc=3)
+    CRNNModel.load_state_dict(load_state_dict(checkpoint_path, weights_path))
+    CRNNModel = CRNNModel.to(device)
+    CRNNModel.eval()
+    if variant == "int8-dynamic":
+        CRNNModel = quantize_crnn_dynamic(CRNNModel.cpu())
+    return CRNNModel
+
+
+def decode_detections(outputs, decoder, conf_threshold=0.90, top_k=None, input_size=None):
+    """
+    Decode the raw per-scale detector maps into per-image corner boxes above a confidence threshold.
+    The confidence is checked on the raw logits first, so only the surviving boxes are decoded.
+
+    Parameters:
+    - outputs: List of tensors [B, num_anchors, grid_h, grid_w, 6], one per detection scale.
+    - decoder: DetectionDecoder holding the anchor boxes.
+    - conf_threshold: Float, the minimum confidence score to keep a box.
+    - top_k: Optional int, the most boxes kept per image.
+    - input_size: Optional (height, width) of the detector input, when it is not a desired_size square.
+
+    Returns:
+    - List of (boxes [N, 4], confidences [N, 1]) tuples, one per image.
+    """
+    return decoder.decode_confident(outputs, conf_threshold, top_k, input_size)
+
+
+def image_sources(source):
+    """
+    Expand a batch source into image paths.
+
+    The source may be a directory, a glob pattern, a newline-delimited manifest file,
+    or '-' to read the manifest from stdin. Paths are yielded lazily so huge manifests stream.
+    """
+    if source == '-':
+        lines = sys.stdin
+    elif os.path.isdir(source):
+        lines = sorted(os.path.join(source, f) for f in os.listdir(source) if f.lower().endswith(image_extensions))
+    elif os.path.isfile(source) and not source.lower().endswith(image_extensions):
+        lines = open(source, 'r')
+    else:
+        lines = sorted(glob.glob(source))
+
+    for line in lines:
+        line = line.strip()
+        if line:
+            yield line
+
+
+def chunked(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+class OCRPipeline:
+    """
+    Loads the detector and the CRNN once and runs detection, box post-processing and recognition on batches of images.
+    """
+    def __init__(self, detector_checkpoint=detector_checkpoint_path, crnn_checkpoint=crnn_checkpoint_path,
+                 anchor_path=anchor_boxes_path, detector_artifact=detector_artifact_path, device=None, conf_threshold=0.90, nms_threshold=0.5,
+                 wbf_threshold=0.9, combine_threshold=0.35, top_k=None, bucket_edges=default_bucket_edges,
+                 max_crop_pixels=default_max_pixels, char_confidences=False, crnn_variant="fp32", detector_variant="fp32",
+                 backend="torch", intra_op_threads=None, inter_op_threads=None, rectangular=False, tile_size=None,
+                 tile_overlap=128, max_tile_pixels=default_max_tile_pixels, tile_with_global=True, decode_max_dim=None):
+        if device is None:
+            device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+        self.device = device
+        self.conf_threshold = conf_threshold
+        self.nms_threshold = nms_threshold
+        self.wbf_threshold = wbf_threshold
+        self.combine_threshold = combine_threshold
+        self.top_k = top_k
+        self.bucket_edges = bucket_edges
+        self.max_crop_pixels = max_crop_pixels
+        self.padding_stats = PaddingStats()
+        self.char_confidences = char_confidences
+        self.rectangular = rectangular
+        # Tiled mode: images larger than tile_size are detected in full resolution tiles instead of downscaled
+        self.tile_size = tile_size
+        self.tile_overlap = tile_overlap
+        self.max_tile_pixels = max_tile_pixels
+        self.tile_with_global = tile_with_global
+        # Longest side inputs are decoded to by run_batch and the server (None keeps the full resolution for the crops)
+        self.decode_max_dim = decode_max_dim
+
+        self.anchor_boxes = load_anchor_boxes(anchor_path, device)
+        self.decoder = DetectionDecoder(self.anchor_boxes)
+        if backend not in backends:
+            raise ValueError(f"Unknown backend {backend}, expected one of {backends}")
+        if backend == "onnx" and (detector_variant != "fp32" or crnn_variant != "fp32"):
+            raise ValueError("The ONNX backend runs the fp32 models only")
+        self.backend = backend
+        self.intra_op_threads = intra_op_threads
+        self.inter_op_threads = inter_op_threads
+
+        self.detector_variant = detector_variant
+        # The INT8 kernels and ONNX Runtime's CPU execution provider only run on the CPU
+        on_cpu = backend == "onnx"
+        self.detector_device = self.device if detector_variant == "fp32" and not on_cpu else torch.device("cpu")
+        self.detector_checkpoint = detector_checkpoint
+        self.detector_artifact = detector_artifact
+        self._detector = None
+        self.crnn_checkpoint = crnn_checkpoint
+        self.crnn_variant = crnn_variant
+        self.crnn_device = self.device if crnn_variant == "fp32" and not on_cpu else torch.device("cpu")
+        self._crnn = None
+        self.label_encoder = LabelEncoder(Constants.char_set)
+
+    @property
+    def detector(self):
+        # Loaded on first use, so a process answering only from the result cache never loads a model
+        if self._detector is None and self.backend == "onnx":
+            self._detector = load_onnx_detector(onnx_detector_path, self.intra_op_threads, self.inter_op_threads)
+        elif self._detector is None:
+            self._detector = load_detector(self.anchor_boxes, self.detector_checkpoint, self.device, self.detector_artifact,
+                                           variant=self.detector_variant)
+        return self._detector
+
+    @detector.setter
+    def detector(self, model):
+        self._detector = model
+
+    def model_files(self):
+        """
+        Every file the models of this pipeline can be loaded from (whether or not it exists), for cache keys.
+        """
+        if self.backend == "onnx":
+            return [onnx_detector_path, onnx_crnn_path]
+        detector_files = [detector_int8_path] if self.detector_variant == "int8" else \
+            [self.detector_artifact, detector_weights_path, self.detector_checkpoint]
+        crnn_files = [crnn_static_path] if self.crnn_variant == "int8-static" else [crnn_weights_path, self.crnn_checkpoint]
+        return [path for path in detector_files + crnn_files if path]
+
+    @property
+    def crnn(self):
+        # Loaded on first use, so a process that never finds any text never pays for the CRNN
+        if self._crnn is None and self.backend == "onnx":
+            self._crnn = load_onnx_crnn(onnx_crnn_path, self.intra_op_threads, self.inter_op_threads)
+        elif self._crnn is None:
+            self._crnn = load_crnn(self.crnn_checkpoint, self.crnn_device, variant=self.crnn_variant)
+        return self._crnn
+
+    @crnn.setter
+    def crnn(self, model):
+        self._crnn = model
+
+    def input_size(self, image):
+        """
+        (height, width) of the detector input the pipeline builds for a PIL image.
+        """
+        if self.rectangular:
+            return rectangular_size(image.width, image.height)
+        return Constants.desired_size, Constants.desired_size
+
+    def prepare(self, images):
+        """
+        Letterbox a list of PIL images into one [B, 3, H, W] detector batch, desired_size square by default.
+        In rectangular mode, images of different shapes are padded on the right and bottom to the largest of the
+        batch, which leaves their offsets unchanged; group images by input_size() to avoid that padding.
+        """
+        tensors = []
+        metas = []
+        for image in images:
+            image_tensor, meta = letterbox(image, self.rectangular)
+            tensors.append(image_tensor)
+            metas.append(meta)
+        height = max(tensor.shape[1] for tensor in tensors)
+        width = max(tensor.shape[2] for tensor in tensors)
+        tensors = [F.pad(tensor, (0, width - tensor.shape[2], 0, height - tensor.shape[1])) for tensor in tensors]
+        return torch.stack(tensors, dim=0), metas
+
+    def postprocess(self, pred_coords, pred_confidences):
+        # The grouping steps below end in Python loops over the groups, which is much cheaper on the CPU than through device syncs
+        pred_coords, pred_confidences = pred_coords.cpu(), pred_confidences.cpu()
+        pred_coords, pred_confidences = remove_contained_boxes(pred_coords, pred_confidences)
+        pred_coords, pred_confidences = apply_nms(pred_coords, pred_confidences, self.nms_threshold)
+        pred_coords, pred_confidences = weighted_box_fusion(pred_coords, pred_confidences, self.wbf_threshold)
+        # One clustering pass replaces the old combine_boxes calls at 0.7 and then 0.35
+        pred_coords, pred_confidences = cluster_boxes(pred_coords, pred_confidences, self.combine_threshold)
+        return pred_coords, pred_confidences
+
+    @torch.no_grad()
+    def detect(self, batch):
+        """
+        Run the detector on a letterboxed batch.
+
+        Returns:
+        - List of (boxes [N, 4], confidences [N, 1]) in letterboxed coordinates, one per image.
+        """
+        outputs = self.detector(batch.to(self.detector_device))
+        detections = decode_detections(outputs, self.decoder, self.conf_threshold, self.top_k, batch.shape[-2:])
+        return [self.postprocess(pred_coords, pred_confidences) for pred_coords, pred_confidences in detections]
+
+    @torch.no_grad()
+    def detect_tiled(self, image):
+        """
+        Detect text on a large PIL image in overlapping full resolution tiles of tile_size, batched under max_tile_pixels.
+        The tile boxes are shifted to image coordinates and, with tile_with_global, joined by the boxes of the usual
+        downscaled pass (which still finds text larger than a tile). Duplicates across tile seams are then merged
+        by the regular post-processing (contained box removal, NMS, box fusion and clustering).
+
+        Returns:
+        - (boxes [N, 4], confidences [N, 1]) in original image coordinates.
+        """
+        boxes = []
+        confidences = []
+        for batch, origins in tile_batches(image, means, stds, self.tile_size, self.tile_overlap, self.max_tile_pixels):
+            outputs = self.detector(batch.to(self.detector_device))
+            detections = decode_detections(outputs, self.decoder, self.conf_threshold, self.top_k, batch.shape[-2:])
+            tile_boxes, tile_confidences = tiles_to_global([(b.cpu(), c.cpu()) for b, c in detections], origins)
+            boxes.append(tile_boxes)
+            confidences.append(tile_confidences)
+
+        if self.tile_with_global:
+            batch, metas = self.prepare([image])
+            outputs = self.detector(batch.to(self.detector_device))
+            global_boxes, global_confidences = decode_detections(outputs, self.decoder, self.conf_threshold, self.top_k, batch.shape[-2:])[0]
+            boxes.append(boxes_to_original(global_boxes, metas[0]))
+            confidences.append(global_confidences.cpu())
+
+        return self.postprocess(torch.cat(boxes).float(), torch.cat(confidences).float())
+
+    def detect_images(self, images):
+        """
+        Detect text on a list of PIL images. Images go through one letterboxed detector batch, except in tiled
+        mode, where the images larger than tile_size are detected tile by tile.
+
+        Returns:
+        - List of (boxes [N, 4], confidences [N, 1]) in original image coordinates, one per image.
+        """
+        detections = [None] * len(images)
+        whole = []
+        for i, image in enumerate(images):
+            if self.tile_size and max(image.width, image.height) > self.tile_size:
+                detections[i] = self.detect_tiled(image)
+            else:
+                whole.append(i)
+
+        if whole:
+            batch, metas = self.prepare([images[i] for i in whole])
+            for i, meta, (pred_coords, pred_confidences) in zip(whole, metas, self.detect(batch)):
+                detections[i] = (boxes_to_original(pred_coords, meta), pred_confidences)
+        return detections
+
+    def extract_crops(self, image, boxes):
+        """
+        Cut each box out of the original image and resize it to the CRNN input height of 32, all boxes at once.
+        Sampling reads from the uint8 image, so a normalized float copy of the full photo is never made.
+
+        Returns:
+        - crops: List of tensors [3, 32, W].
+        - kept: Indices of the boxes that produced a valid crop.
+        """
+        return extract_text_crops(image, boxes, means, stds, fixed_height=32)
+
+    @torch.no_grad()
+    def recognize_batch(self, images, with_confidences=False, widths=None):
+        """
+        Run the CRNN on a padded [N, 3, 32, W] batch of crops and greedily decode the predicted text.
+        With the real crop widths, the LSTMs and the decoder skip the padded columns.
+        With with_confidences, also returns the probability of every decoded character.
+        """
+        outputs = self.crnn(images.to(self.crnn_device), widths)  # [T, N, C]
+        outputs = F.log_softmax(outputs, dim=2)
+        log_probs, preds = outputs.max(2)
+        preds = preds.transpose(1, 0).contiguous()  # [N, T]
+        lengths = None if widths is None else CRNN.output_lengths(widths).clamp(max=preds.size(1))
+        if with_confidences:
+            return self.label_encoder.decode(preds, log_probs.transpose(1, 0).exp(), lengths)
+        return self.label_encoder.decode(preds, lengths=lengths)
+
+    def recognize(self, crops, with_confidences=False):
+        """
+        Read a list of [3, 32, W] crops, batching crops of similar width together so short words are not padded
+        to the longest line. Returns the texts in crop order (and their per-character confidences with with_confidences).
+        """
+        widths = [crop.shape[2] for crop in crops]
+        texts = [None] * len(crops)
+        char_confidences = [None] * len(crops)
+        for batch in bucket_batches(widths, self.bucket_edges, self.max_crop_pixels):
+            self.padding_stats.add([widths[i] for i in batch])
+            decoded = self.recognize_batch(custom_collate_fn([crops[i] for i in batch]), with_confidences,
+                                           [widths[i] for i in batch])
+            batch_texts, batch_confidences = decoded if with_confidences else (decoded, [None] * len(batch))
+            for i, text, confidences in zip(batch, batch_texts, batch_confidences):
+                texts[i] = text
+                char_confidences[i] = confidences
+        if with_confidences:
+            return texts, char_confidences
+        return texts
+
+    def process_images(self, images):
+        """
+        Detect and read text on a list of PIL images with one detector forward pass (plus the tile batches of large
+        images in tiled mode) and width-bucketed CRNN passes.
+
+        Returns:
+        - List of dicts with 'boxes' (original image coordinates), 'confidences' and 'texts', one per image,
+          plus 'char_confidences' when the pipeline was created with char_confidences=True.
+        """
+        results = []
+        all_crops = []
+        for image, (boxes, pred_confidences) in zip(images, self.detect_images(images)):
+            crops, kept = self.extract_crops(image, boxes)
+            width, height = image.info.get("original_size", image.size)
+            results.append({
+                "width": width,
+                "height": height,
+                "boxes": to_original_coordinates(boxes[kept], image).tolist(),
+                "confidences": pred_confidences[kept].squeeze(1).tolist(),
+            })
+            all_crops.extend(crops)
+
+        # Recognize the crops of the whole batch together, then hand the texts back to their images
+        if self.char_confidences:
+            texts, char_confidences = self.recognize(all_crops, with_confidences=True)
+        else:
+            texts = self.recognize(all_crops)
+        start = 0
+        for result in results:
+            end = start + len(result["boxes"])
+            result["texts"] = texts[start:end]
+            if self.char_confidences:
+                result["char_confidences"] = char_confidences[start:end]
+            start = end
+
+        return results
+
+
+def read_source(path):
+    with open(path.strip('"'), "rb") as file:  # remove quotes from sides of path if included
+        return file.read()
+
+
+def run_batch(pipeline, source, batch_size=8, output="-", max_pending_batches=4, cache=None):
+    """
+    OCR every image from a batch source and stream one JSON line per image to output ('-' for stdout).
+
+    Images are batched with others of the same detector input size, so in rectangular mode a batch shares one
+    rectangular shape (images of similar aspect ratio) instead of being padded to the widest and tallest of them.
+    A shape is flushed when it fills a batch, or, once more than max_pending_batches batches worth of images wait,
+    the shape with the most waiting images is flushed. Lines can therefore come out of source order; every line has its path.
+    With a ResultCache, images seen before are answered from it without being decoded, and new results are stored.
+    """
+    out = sys.stdout if output == "-" else open(output, "w")
+    processed = 0
+    start_time = time.time()
+    pending = {}  # detector input size -> list of (path, image, cache key)
+
+    def flush(size):
+        group = pending.pop(size)
+        for (path, _, key), result in zip(group, pipeline.process_images([image for _, image, _ in group])):
+            if cache is not None:
+                cache.put(key, result)
+            out.write(json.dumps({"path": path, **result}) + "\n")
+
+    try:
+        for paths in chunked(image_sources(source), batch_size):
+            for path in paths:
+                try:
+                    key = None
+                    if cache is not None:
+                        data = read_source(path)
+                        key = image_digest(data)
+                        result = cache.get(key)
+                        if result is not None:
+                            out.write(json.dumps({"path": path, **result}) + "\n")
+                            continue
+                    image = load_image(path if cache is None else data, pipeline.decode_max_dim)
+                except Exception as e:
+                    out.write(json.dumps({"path": path, "error": str(e)}) + "\n")
+                    continue
+                size = pipeline.input_size(image)
+                pending.setdefault(size, []).append((path, image, key))
+                if len(pending[size]) == batch_size:
+                    flush(size)
+
+            while sum(len(group) for group in pending.values()) > batch_size * max_pending_batches:
+                flush(max(pending, key=lambda size: len(pending[size])))
+            out.flush()
+
+            processed += len(paths)
+            elapsed = time.time() - start_time
+            print(f"{processed} images, {processed / elapsed:.2f} images/sec, "
+                  f"CRNN padding {pipeline.padding_stats.padding_ratio():.1%}", file=sys.stderr)
+
+        for size in list(pending):
+            flush(size)
+        out.flush()
+        if cache is not None:
+            print(f"Result cache: {json.dumps(cache.get_stats())}", file=sys.stderr)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+    return processed
@@ -0,0 +1,214 @@
+import argparse
+import time
+import numpy as np
+import torch
+import Constants
+
+
+backends = ("torch", "onnx")
+onnx_detector_path = "../detector.onnx"
+onnx_crnn_path = "../crnn.onnx"
+onnx_opset = 17
+
+
+def export_detector_onnx(cnn_model, output_path=onnx_detector_path, opset=onnx_opset):
+    """
+    Export the fused fp32 detector to ONNX with dynamic batch, height and width axes (rectangular inputs). The three raw maps
+    [B, num_anchors, grid_h, grid_w, 6] are the outputs, so DetectionDecoder works on them unchanged.
+    """
+    cnn_model = cnn_model.cpu().eval()
+    example = torch.zeros(1, 3, Constants.desired_size, Constants.desired_size)
+    outputs = ["scale0", "scale1", "scale2"]
+    dynamic_axes = {"images": {0: "batch", 2: "height", 3: "width"},
+                    **{name: {0: "batch", 2: f"{name}_h", 3: f"{name}_w"} for name in outputs}}
+    with torch.no_grad():
+        torch.onnx.export(cnn_model, (example,), output_path, input_names=["images"], output_names=outputs,
+                          dynamic_axes=dynamic_axes, opset_version=opset, do_constant_folding=True)
+    return output_path
+
+
+def export_crnn_onnx(crnn_model, output_path=onnx_crnn_path, opset=onnx_opset, packed=True):
+    """
+    Export the CRNN to ONNX with dynamic batch and width axes. With packed, the real crop widths are a second input,
+    so the LSTMs still skip the padded columns (they become the sequence_lens of the ONNX LSTMs). Without it the LSTMs
+    run over the padding too, like CRNN(images) without widths, and only the decoder skips the padded steps.
+    """
+    crnn_model = crnn_model.cpu().eval()
+    images = torch.zeros(2, 3, 32, 128)
+    widths = torch.tensor([128, 96], dtype=torch.long)
+    dynamic_axes = {"images": {0: "batch", 3: "width"}, "widths": {0: "batch"}, "logits": {0: "steps", 1: "batch"}}
+    inputs, input_names = ((images, widths), ["images", "widths"]) if packed else ((images,), ["images"])
+    if not packed:
+        del dynamic_axes["widths"]
+    with torch.no_grad():
+        torch.onnx.export(crnn_model, inputs, output_path, input_names=input_names,
+                          output_names=["logits"], dynamic_axes=dynamic_axes, opset_version=opset, do_constant_folding=True)
+    return output_path
+
+
+def check_crnn_onnx(crnn_model, onnx_crnn, widths=(200, 72, 128, 40, 256), rtol=1e-3, atol=1e-4):
+    """
+    Compare the exported CRNN with PyTorch on a batch of mixed-width crops padded to the widest, of a different
+    batch size and widths than the export example, so dynamic axes and sequence lengths are both exercised.
+    Raises an AssertionError when the logits differ.
+    """
+    generator = torch.Generator().manual_seed(0)
+    widths = torch.tensor(widths, dtype=torch.long)
+    images = torch.randn(len(widths), 3, 32, int(widths.max()), generator=generator)
+    for image, width in zip(images, widths):
+        image[:, :, width:] = 0
+    with torch.no_grad():
+        expected = crnn_model.cpu().eval()(images, widths if onnx_crnn.packed else None)
+    np.testing.assert_allclose(onnx_crnn(images, widths).numpy(), expected.numpy(), rtol=rtol, atol=atol)
+
+
+def export_checked_crnn_onnx(crnn_model, output_path=onnx_crnn_path, opset=onnx_opset, intra_op_threads=None,
+                             inter_op_threads=None):
+    """
+    Export the CRNN with packed sequences and check it against PyTorch. If ONNX Runtime does not reproduce the
+    packed LSTMs, export the unpacked CRNN instead; recognize_batch already skips the padded steps when decoding.
+
+    Returns:
+    - onnx_crnn: OnnxCRNN of the export that passed the check.
+    """
+    try:
+        export_crnn_onnx(crnn_model, output_path, opset)
+        onnx_crnn = load_onnx_crnn(output_path, intra_op_threads, inter_op_threads)
+        check_crnn_onnx(crnn_model, onnx_crnn)
+        return onnx_crnn
+    except (AssertionError, RuntimeError) as e:
+        print(f"Packed CRNN export does not match PyTorch, exporting without widths instead: {e}")
+    export_crnn_onnx(crnn_model, output_path, opset, packed=False)
+    onnx_crnn = load_onnx_crnn(output_path, intra_op_threads, inter_op_threads)
+    check_crnn_onnx(crnn_model, onnx_crnn)
+    return onnx_crnn
+
+
+def create_session(model_path, intra_op_threads=None, inter_op_threads=None):
+    """
+    ONNX Runtime session on the CPU execution provider with every graph optimization enabled.
+
+    Parameters:
+    - model_path: Path of the .onnx file.
+    - intra_op_threads: Optional int, threads used inside one operator (ONNX Runtime picks when None).
+    - inter_op_threads: Optional int, threads used to run independent operators in parallel.
+    """
+    try:
+        import onnxruntime as ort
+    except ImportError as e:
+        raise ImportError("The ONNX backend needs onnxruntime (pip install onnxruntime).") from e
+
+    options = ort.SessionOptions()
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    if intra_op_threads:
+        options.intra_op_num_threads = intra_op_threads
+    if inter_op_threads:
+        options.inter_op_num_threads = inter_op_threads
+        options.execution_mode = ort.ExecutionMode.ORT_PARALLEL
+    return ort.InferenceSession(model_path, sess_options=options, providers=["CPUExecutionProvider"])
+
+
+class OnnxDetector:
+    """
+    Runs the exported detector in ONNX Runtime and returns torch tensors, so it can stand in for pipeline.detector.
+    """
+    def __init__(self, session):
+        self.session = session
+
+    def __call__(self, images):
+        outputs = self.session.run(None, {"images": images.cpu().numpy().astype(np.float32)})
+        return [torch.from_numpy(output) for output in outputs]
+
+    def eval(self):
+        return self
+
+
+class OnnxCRNN:
+    """
+    Runs the exported CRNN in ONNX Runtime and returns the [T, N, C] logits as a torch tensor,
+    so it can stand in for pipeline.crnn.
+    """
+    def __init__(self, session):
+        self.session = session
+        # False for a CRNN exported without widths, which runs its LSTMs over the padding
+        self.packed = "widths" in [model_input.name for model_input in session.get_inputs()]
+
+    def __call__(self, images, widths=None):
+        feeds = {"images": images.cpu().numpy().astype(np.float32)}
+        if self.packed:
+            if widths is None:
+                widths = [images.shape[3]] * images.shape[0]
+            feeds["widths"] = np.asarray(widths, dtype=np.int64)
+        return torch.from_numpy(self.session.run(None, feeds)[0])
+
+    def eval(self):
+        return self
+
+
+def load_onnx_detector(path=onnx_detector_path, intra_op_threads=None, inter_op_threads=None):
+    return OnnxDetector(create_session(path, intra_op_threads, inter_op_threads))
+
+
+def load_onnx_crnn(path=onnx_crnn_path, intra_op_threads=None, inter_op_threads=None):
+    return OnnxCRNN(create_session(path, intra_op_threads, inter_op_threads))
+
+
+def time_model(model, inputs, repeats):
+    """
+    Milliseconds per call of model(*inputs), after one warm-up call.
+    """
+    with torch.no_grad():
+        model(*inputs)
+        began = time.perf_counter()
+        for _ in range(repeats):
+            outputs = model(*inputs)
+    return (time.perf_counter() - began) / repeats * 1000, outputs
+
+
+def max_difference(expected, actual):
+    if isinstance(expected, torch.Tensor):
+        expected, actual = [expected], [actual]
+    return max(float((e.float() - a.float()).abs().max()) for e, a in zip(expected, actual))
+
+
+if __name__ == "__main__":
+    from OCRPipeline import load_anchor_boxes, load_detector, load_crnn
+
+    parser = argparse.ArgumentParser(description="Export the detector and the CRNN to ONNX and compare ONNX Runtime with eager PyTorch on CPU.")
+    parser.add_argument("--detector-checkpoint", default="../model_checkpoint213.pth")
+    parser.add_argument("--crnn-checkpoint", default="../CRNNmodel_checkpoint_62.pth")
+    parser.add_argument("--detector-output", default=onnx_detector_path)
+    parser.add_argument("--crnn-output", default=onnx_crnn_path)
+    parser.add_argument("--batch-size", type=int, default=4)
+    parser.add_argument("--crop-width", type=int, default=256)
+    parser.add_argument("--repeats", type=int, default=10)
+    parser.add_argument("--intra-op-threads", type=int, default=None)
+    parser.add_argument("--inter-op-threads", type=int, default=None)
+    args = parser.parse_args()
+
+    if args.intra_op_threads:
+        torch.set_num_threads(args.intra_op_threads)
+
+    cnn_model = load_detector(load_anchor_boxes(device="cpu"), args.detector_checkpoint, "cpu", artifact_path=None)
+    crnn_model = load_crnn(args.crnn_checkpoint, "cpu")
+    export_detector_onnx(cnn_model, args.detector_output)
+    onnx_crnn = export_checked_crnn_onnx(crnn_model, args.crnn_output, intra_op_threads=args.intra_op_threads,
+                                         inter_op_threads=args.inter_op_threads)
+    print(f"ONNX models written to {args.detector_output} and {args.crnn_output} "
+          f"(CRNN {'with' if onnx_crnn.packed else 'without'} packed sequences, matches PyTorch on mixed widths)")
+
+    onnx_detector = load_onnx_detector(args.detector_output, args.intra_op_threads, args.inter_op_threads)
+
+    images = torch.randn(args.batch_size, 3, Constants.desired_size, Constants.desired_size)
+    crops = torch.randn(args.batch_size * 8, 3, 32, args.crop_width)
+    widths = torch.randint(args.crop_width // 2, args.crop_width + 1, (crops.shape[0],))
+    widths[0] = args.crop_width
+
+    print(f"{'model':<10} {'torch ms':>9} {'onnx ms':>9} {'speedup':>8} {'max diff':>9}")
+    for name, torch_model, onnx_model, inputs in [
+        ("detector", cnn_model, onnx_detector, (images,)),
+        ("crnn", crnn_model, onnx_crnn, (crops, widths) if onnx_crnn.packed else (crops,)),
+    ]:
+        torch_ms, expected = time_model(torch_model, inputs, args.repeats)
+        onnx_ms, actual = time_model(onnx_model, inputs, args.repeats)
+        print(f"{name:<10} {torch_ms:9.2f} {onnx_ms:9.2f} {torch_ms / onnx_ms:7.2f}x {max_difference(expected, actual):9.2e}")
@@ -0,0 +1,489 @@
+import torch
+
+
+def weighted_box_fusion_loop(pred_boxes, confidences, iou_threshold=0.5):
+    """
+    Apply Weighted Box Fusion (WBF) to combine overlapping boxes into a single box with higher precision.
+    Original box-by-box version, kept as the reference for weighted_box_fusion (see BenchmarkPostProcessing.py).
+
+    Parameters:
+    - pred_boxes: Tensor of predicted boxes [N, 4], where each box is (x1, y1, x2, y2).
+    - confidences: Tensor of confidence scores [N, 1].
+    - iou_threshold: Float, the IoU threshold for grouping boxes.
+
+    Returns:
+    - fused_boxes: Tensor of boxes after applying WBF.
+    - fused_confidences: Tensor of confidence scores for fused boxes, shape [K, 1] where K is the number of fused boxes.
+    """
+    if pred_boxes.size(0) == 0:
+        return pred_boxes, confidences
+
+    # Sort boxes by confidence scores in descending order
+    sorted_indices = torch.argsort(confidences.squeeze(1), descending=True)
+    pred_boxes = pred_boxes[sorted_indices]
+    confidences = confidences[sorted_indices]
+
+    fused_boxes = []
+    fused_confidences = []
+    used_indices = set()
+
+    # Helper function to calculate IoU
+    def calculate_iou(box1, box2):
+        inter_x1 = max(box1[0], box2[0])
+        inter_y1 = max(box1[1], box2[1])
+        inter_x2 = min(box1[2], box2[2])
+        inter_y2 = min(box1[3], box2[3])
+
+        inter_area = max(0, inter_x2 - inter_x1) * max(0, inter_y2 - inter_y1)
+        box1_area = (box1[2] - box1[0]) * (box1[3] - box1[1])
+        box2_area = (box2[2] - box2[0]) * (box2[3] - box2[1])
+
+        union_area = box1_area + box2_area - inter_area
+        return inter_area / union_area if union_area > 0 else 0
+
+    for i, box in enumerate(pred_boxes):
+        if i in used_indices:
+            continue
+
+        # Group overlapping boxes
+        group_boxes = [box]
+        group_confidences = [confidences[i]]
+        used_indices.add(i)
+
+        for j in range(i + 1, pred_boxes.size(0)):
+            if j in used_indices:
+                continue
+            if calculate_iou(box, pred_boxes[j]) > iou_threshold:
+                group_boxes.append(pred_boxes[j])
+                group_confidences.append(confidences[j])
+                used_indices.add(j)
+
+        # Compute weighted box
+        group_boxes = torch.stack(group_boxes)
+        group_confidences = torch.stack(group_confidences).squeeze(1)
+
+        weights = group_confidences / group_confidences.sum()
+        weighted_box = torch.sum(group_boxes * weights[:, None], dim=0)
+
+        # Add fused box and its confidence
+        fused_boxes.append(weighted_box)
+        fused_confidences.append(group_confidences.mean())
+
+    # Convert lists to tensors
+    fused_boxes = torch.stack(fused_boxes)
+    fused_confidences = torch.tensor(fused_confidences).unsqueeze(1)
+
+    return fused_boxes, fused_confidences
+
+
+def remove_contained_boxes_loop(pred_boxes, confidences):
+    """
+    Removes boxes that are fully contained within a more confident box.
+    Original box-by-box version, kept as the reference for remove_contained_boxes (see BenchmarkPostProcessing.py).
+
+    Parameters:
+    - pred_boxes: Tensor of predicted boxes [N, 4], where each box is (x1, y1, x2, y2).
+    - confidences: Tensor of confidence scores [N, 1].
+
+    Returns:
+    - filtered_boxes: Tensor of boxes after removing fully contained ones.
+    - filtered_confidences: Tensor of confidence scores for the remaining boxes, shape [M, 1].
+    """
+    if pred_boxes.size(0) == 0:
+        return pred_boxes, confidences
+
+    # Sort boxes by confidence scores in descending order
+    sorted_indices = torch.argsort(confidences.squeeze(1), descending=True)
+    pred_boxes = pred_boxes[sorted_indices]
+    confidences = confidences[sorted_indices]
+
+    keep_indices = []
+
+    # Helper function to check if box1 contains box2
+    def is_contained(box1, box2):
+        return (
+            box1[0] <= box2[0] and box1[1] <= box2[1] and
+            box1[2] >= box2[2] and box1[3] >= box2[3]
+        )
+
+    for i in range(pred_boxes.size(0)):
+        contained = False
+        for j in range(i):
+            if is_contained(pred_boxes[j], pred_boxes[i]):
+                contained = True
+                break
+        if not contained:
+            keep_indices.append(i)
+
+    # Index the results with keep_indices
+    filtered_boxes = pred_boxes[keep_indices]
+    filtered_confidences = confidences[keep_indices]
+
+    return filtered_boxes, filtered_confidences
+
+
+# Upper bound on the elements of one pairwise block, so the [rows, N] comparison matrices stay around 16MB each
+max_block_elements = 2 ** 22
+
+
+def block_rows(num_boxes, max_elements=max_block_elements):
+    return max(1, max_elements // max(num_boxes, 1))
+
+
+def pairwise_iou(boxes1, boxes2):
+    """
+    IoU between every box of boxes1 [M, 4] and every box of boxes2 [N, 4], returned as [M, N].
+    Uses the same arithmetic, in the same order, as the per-pair calculate_iou in weighted_box_fusion_loop,
+    so the results are bit-for-bit the same.
+    """
+    inter_x1 = torch.maximum(boxes1[:, None, 0], boxes2[None, :, 0])
+    inter_y1 = torch.maximum(boxes1[:, None, 1], boxes2[None, :, 1])
+    inter_x2 = torch.minimum(boxes1[:, None, 2], boxes2[None, :, 2])
+    inter_y2 = torch.minimum(boxes1[:, None, 3], boxes2[None, :, 3])
+
+    inter_area = (inter_x2 - inter_x1).clamp(min=0) * (inter_y2 - inter_y1).clamp(min=0)
+    box1_area = (boxes1[:, 2] - boxes1[:, 0]) * (boxes1[:, 3] - boxes1[:, 1])
+    box2_area = (boxes2[:, 2] - boxes2[:, 0]) * (boxes2[:, 3] - boxes2[:, 1])
+
+    union_area = box1_area[:, None] + box2_area[None, :] - inter_area
+    return torch.where(union_area > 0, inter_area / union_area, torch.zeros_like(union_area))
+
+
+def weighted_box_fusion(pred_boxes, confidences, iou_threshold=0.5, max_elements=max_block_elements):
+    """
+    Apply Weighted Box Fusion (WBF) to combine overlapping boxes into a single box with higher precision.
+    Tensor version of weighted_box_fusion_loop with identical outputs.
+
+    The IoU matrix is computed a block of rows at a time and only the pairs above iou_threshold are kept,
+    so memory stays bounded by max_elements plus the number of overlapping pairs. The greedy grouping then
+    only walks those pairs instead of comparing every box with every other box.
+
+    Parameters:
+    - pred_boxes: Tensor of predicted boxes [N, 4], where each box is (x1, y1, x2, y2).
+    - confidences: Tensor of confidence scores [N, 1].
+    - iou_threshold: Float, the IoU threshold for grouping boxes.
+    - max_elements: Int, the most IoU values computed at once.
+
+    Returns:
+    - fused_boxes: Tensor of boxes after applying WBF.
+    - fused_confidences: Tensor of confidence scores for fused boxes, shape [K, 1] where K is the number of fused boxes.
+    """
+    num_boxes = pred_boxes.size(0)
+    if num_boxes == 0:
+        return pred_boxes, confidences
+
+    # Sort boxes by confidence scores in descending order
+    sorted_indices = torch.argsort(confidences.squeeze(1), descending=True)
+    pred_boxes = pred_boxes[sorted_indices]
+    confidences = confidences[sorted_indices]
+
+    # Overlapping pairs (i, j) with i < j, in row-major order, computed one block of rows at a time
+    rows = block_rows(num_boxes, max_elements)
+    pair_rows = []
+    pair_cols = []
+    for start in range(0, num_boxes, rows):
+        end = min(start + rows, num_boxes)
+        # Only boxes after the block can be grouped under it
+        overlaps = pairwise_iou(pred_boxes[start:end], pred_boxes[start:]) > iou_threshold
+        overlaps = torch.triu(overlaps, diagonal=1)  # keep j > i
+        i, j = torch.nonzero(overlaps, as_tuple=True)
+        pair_rows.append(i + start)
+        pair_cols.append(j + start)
+    pair_rows = torch.cat(pair_rows).cpu()
+    pair_cols = torch.cat(pair_cols).cpu().tolist()
+    offsets = [0] + torch.cumsum(torch.bincount(pair_rows, minlength=num_boxes), 0).tolist()
+
+    # Greedy grouping, same order as the loop version: each unused box takes all of its unused overlapping successors
+    used = bytearray(num_boxes)
+    leaders = []
+    groups = []
+    for i in range(num_boxes):
+        if used[i]:
+            continue
+        used[i] = 1
+        group = [i]
+        for j in pair_cols[offsets[i]:offsets[i + 1]]:
+            if not used[j]:
+                used[j] = 1
+                group.append(j)
+        leaders.append(i)
+        groups.append(group)
+
+    # Single box groups fuse to themselves (weight c / c), which covers nearly every box, so do them all at once
+    leaders = torch.tensor(leaders, device=pred_boxes.device)
+    leader_confidences = confidences[leaders].squeeze(1)
+    fused_boxes = pred_boxes[leaders] * (leader_confidences / leader_confidences)[:, None]
+    fused_confidences = leader_confidences.clone()
+
+    for k, group in enumerate(groups):
+        if len(group) == 1:
+            continue
+        group_boxes = pred_boxes[group]
+        group_confidences = confidences[group].squeeze(1)
+
+        weights = group_confidences / group_confidences.sum()
+        fused_boxes[k] = torch.sum(group_boxes * weights[:, None], dim=0)
+        fused_confidences[k] = group_confidences.mean()
+
+    return fused_boxes, fused_confidences.unsqueeze(1)
+
+
+def remove_contained_boxes(pred_boxes, confidences, max_elements=max_block_elements):
+    """
+    Removes boxes that are fully contained within a more confident box.
+    Tensor version of remove_contained_boxes_loop with identical outputs, computed a block of rows at a time.
+
+    Parameters:
+    - pred_boxes: Tensor of predicted boxes [N, 4], where each box is (x1, y1, x2, y2).
+    - confidences: Tensor of confidence scores [N, 1].
+    - max_elements: Int, the most box pairs compared at once.
+
+    Returns:
+    - filtered_boxes: Tensor of boxes after removing fully contained ones.
+    - filtered_confidences: Tensor of confidence scores for the remaining boxes, shape [M, 1].
+    """
+    num_boxes = pred_boxes.size(0)
+    if num_boxes == 0:
+        return pred_boxes, confidences
+
+    # Sort boxes by confidence scores in descending order
+    sorted_indices = torch.argsort(confidences.squeeze(1), descending=True)
+    pred_boxes = pred_boxes[sorted_indices]
+    confidences = confidences[sorted_indices]
+
+    contained = torch.zeros(num_boxes, dtype=torch.bool, device=pred_boxes.device)
+    rows = block_rows(num_boxes, max_elements)
+    for start in range(0, num_boxes, rows):
+        end = min(start + rows, num_boxes)
+        boxes = pred_boxes[start:end]
+        # Only more confident boxes (earlier in the sorted order) can remove a box, dropped or not
+        earlier = pred_boxes[:end]
+
+        contains = (
+            (earlier[None, :, 0] <= boxes[:, None, 0]) & (earlier[None, :, 1] <= boxes[:, None, 1]) &
+            (earlier[None, :, 2] >= boxes[:, None, 2]) & (earlier[None, :, 3] >= boxes[:, None, 3])
+        )
+        contains = torch.tril(contains, diagonal=start - 1)  # keep j < i
+        contained[start:end] = contains.any(dim=1)
+
+    keep_indices = torch.nonzero(~contained, as_tuple=True)[0]
+    filtered_boxes = pred_boxes[keep_indices]
+    filtered_confidences = confidences[keep_indices]
+
+    return filtered_boxes, filtered_confidences
+
+
+def combine_boxes(pred_boxes, confidences, overlap_threshold=0.5):
+    """
+    Combine bounding boxes if a specified percentage of one box is within another box.
+    Combines them into the smallest box that contains both.
+
+    Parameters:
+    - pred_boxes: Tensor of predicted boxes [N, 4], where each box is (x1, y1, x2, y2).
+    - confidences: Tensor of confidence scores [N, 1].
+    - overlap_threshold: Float, the percentage threshold for considering boxes for merging.
+
+    Returns:
+    - combined_boxes: Tensor of boxes after merging.
+    - combined_confidences: Tensor of confidence scores for the combined boxes, shape [M, 1].
+    """
+    if pred_boxes.size(0) == 0:
+        return pred_boxes, confidences
+
+    # Sort boxes by confidence scores in descending order
+    sorted_indices = torch.argsort(confidences.squeeze(1), descending=True)
+    pred_boxes = pred_boxes[sorted_indices]
+    confidences = confidences[sorted_indices]
+
+    combined_boxes = []
+    combined_confidences = []
+    used_indices = set()
+
+    # Helper function to calculate overlap percentages
+    def calculate_overlap(box1, box2):
+        inter_x1 = max(box1[0], box2[0])
+        inter_y1 = max(box1[1], box2[1])
+        inter_x2 = min(box1[2], box2[2])
+        inter_y2 = min(box1[3], box2[3])
+
+        inter_area = max(0, inter_x2 - inter_x1) * max(0, inter_y2 - inter_y1)
+        box1_area = (box1[2] - box1[0]) * (box1[3] - box1[1])
+        box2_area = (box2[2] - box2[0]) * (box2[3] - box2[1])
+
+        # Calculate the fraction of each box that is overlapped
+        overlap1 = inter_area / box1_area if box1_area > 0 else 0
+        overlap2 = inter_area / box2_area if box2_area > 0 else 0
+
+        return overlap1, overlap2
+
+    for i, box1 in enumerate(pred_boxes):
+        if i in used_indices:
+            continue
+
+        group_boxes = [box1]
+        group_confidences = [confidences[i]]
+        used_indices.add(i)
+
+        for j in range(i + 1, pred_boxes.size(0)):
+            if j in used_indices:
+                continue
+            box2 = pred_boxes[j]
+            overlap1, overlap2 = calculate_overlap(box1, box2)
+            if overlap1 >= overlap_threshold or overlap2 >= overlap_threshold:
+                group_boxes.append(box2)
+                group_confidences.append(confidences[j])
+                used_indices.add(j)
+
+        # Combine boxes into the smallest box containing all group boxes
+        group_boxes = torch.stack(group_boxes)
+        x1_min, y1_min = torch.min(group_boxes[:, 0]), torch.min(group_boxes[:, 1])
+        x2_max, y2_max = torch.max(group_boxes[:, 2]), torch.max(group_boxes[:, 3])
+        combined_box = torch.tensor([x1_min, y1_min, x2_max, y2_max])
+
+        # Use the highest confidence score for the combined box
+        combined_confidence = max(group_confidences)
+
+        combined_boxes.append(combined_box)
+        combined_confidences.append(combined_confidence)
+
+    # Convert lists to tensors
+    combined_boxes = torch.stack(combined_boxes)
+    combined_confidences = torch.tensor(combined_confidences).unsqueeze(1)
+
+    return combined_boxes, combined_confidences
+
+
+def overlapping_pairs(pred_boxes, overlap_threshold=0.5, max_pairs=max_block_elements):
+    """
+    Find every pair of boxes where at least overlap_threshold of one box lies inside the other (the combine_boxes test).
+
+    Candidates come from a sweep along the axis the boxes are shortest in (y for lines of text): after sorting by
+    the start coordinate, the boxes that can touch box i are exactly the ones starting before box i ends, which is a
+    contiguous run found with searchsorted. Only those candidate pairs are tested, max_pairs at a time.
+
+    Returns:
+    - i, j: Index tensors of the overlapping pairs.
+    """
+    num_boxes = pred_boxes.size(0)
+    extents = torch.stack([pred_boxes[:, 2] - pred_boxes[:, 0], pred_boxes[:, 3] - pred_boxes[:, 1]])
+    axis = int(torch.argmin(extents.sum(dim=1)))
+
+    starts, order = torch.sort(pred_boxes[:, axis])
+    ends = pred_boxes[order, axis + 2]
+    # Candidates of sorted box k are the sorted boxes k+1 .. last - 1 that start before it ends
+    last = torch.searchsorted(starts, ends, right=True)
+    counts = (last - torch.arange(1, num_boxes + 1, device=pred_boxes.device)).clamp(min=0)
+
+    areas = (pred_boxes[:, 2] - pred_boxes[:, 0]) * (pred_boxes[:, 3] - pred_boxes[:, 1])
+    pairs_i = []
+    pairs_j = []
+    cumulative = torch.cumsum(counts, 0)
+    block_start = 0
+    while block_start < num_boxes:
+        # Grow the block of sorted boxes until it holds about max_pairs candidate pairs
+        offset = int(cumulative[block_start - 1]) if block_start > 0 else 0
+        block_end = int(torch.searchsorted(cumulative, offset + max_pairs, right=True))
+        block_end = min(max(block_end, block_start + 1), num_boxes)
+
+        block_counts = counts[block_start:block_end]
+        k = torch.repeat_interleave(torch.arange(block_start, block_end, device=pred_boxes.device), block_counts)
+        if k.numel() > 0:
+            # Position of each candidate within its run, then the candidate's sorted index
+            run_starts = torch.cumsum(block_counts, 0) - block_counts
+            step = torch.arange(k.numel(), device=pred_boxes.device) - torch.repeat_interleave(run_starts, block_counts)
+            i, j = order[k], order[k + 1 + step]
+
+            box1, box2 = pred_boxes[i], pred_boxes[j]
+            inter_w = (torch.minimum(box1[:, 2], box2[:, 2]) - torch.maximum(box1[:, 0], box2[:, 0])).clamp(min=0)
+            inter_h = (torch.minimum(box1[:, 3], box2[:, 3]) - torch.maximum(box1[:, 1], box2[:, 1])).clamp(min=0)
+            inter_area = inter_w * inter_h
+            area1, area2 = areas[i], areas[j]
+            overlap1 = torch.where(area1 > 0, inter_area / area1, torch.zeros_like(inter_area))
+            overlap2 = torch.where(area2 > 0, inter_area / area2, torch.zeros_like(inter_area))
+
+            keep = (overlap1 >= overlap_threshold) | (overlap2 >= overlap_threshold)
+            pairs_i.append(i[keep])
+            pairs_j.append(j[keep])
+        block_start = block_end
+
+    if not pairs_i:
+        empty = torch.zeros(0, dtype=torch.long, device=pred_boxes.device)
+        return empty, empty
+    return torch.cat(pairs_i), torch.cat(pairs_j)
+
+
+def connected_components(num_nodes, pairs_i, pairs_j):
+    """
+    Union-find over the given edges. Returns a list with the root of every node, where each root is the
+    smallest index in its component.
+    """
+    parent = list(range(num_nodes))
+
+    def find(x):
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]  # path halving
+            x = parent[x]
+        return x
+
+    for a, b in zip(pairs_i.tolist(), pairs_j.tolist()):
+        root_a, root_b = find(a), find(b)
+        if root_a != root_b:
+            # The smaller index (the more confident box) stays the root
+            if root_a < root_b:
+                parent[root_b] = root_a
+            else:
+                parent[root_a] = root_b
+
+    return [find(x) for x in range(num_nodes)]
+
+
+def cluster_boxes(pred_boxes, confidences, overlap_threshold=0.35, max_pairs=max_block_elements):
+    """
+    Merge every group of boxes linked by the combine_boxes overlap test into the smallest box containing the group.
+
+    Unlike combine_boxes, which greedily merges each box only with boxes overlapping the group's first box, this
+    merges whole connected components (a overlaps b and b overlaps c puts a, b and c together). Merged boxes can
+    reach boxes none of their parts did, so this repeats until nothing changes, which is the fixpoint that
+    chaining combine_boxes at 0.7 and then 0.35 only approximates.
+
+    Parameters:
+    - pred_boxes: Tensor of predicted boxes [N, 4], where each box is (x1, y1, x2, y2).
+    - confidences: Tensor of confidence scores [N, 1].
+    - overlap_threshold: Float, the fraction of a box that has to lie inside the other for them to merge.
+    - max_pairs: Int, the most candidate pairs tested at once.
+
+    Returns:
+    - combined_boxes: Tensor of boxes after merging, ordered by confidence like combine_boxes.
+    - combined_confidences: Tensor of the highest confidence score in each merged group, shape [M, 1].
+    """
+    if pred_boxes.size(0) == 0:
+        return pred_boxes, confidences
+
+    # Sort boxes by confidence scores in descending order
+    sorted_indices = torch.argsort(confidences.squeeze(1), descending=True)
+    pred_boxes = pred_boxes[sorted_indices]
+    confidences = confidences[sorted_indices]
+
+    while True:
+        num_boxes = pred_boxes.size(0)
+        pairs_i, pairs_j = overlapping_pairs(pred_boxes, overlap_threshold, max_pairs)
+        if pairs_i.numel() == 0:
+            break
+
+        roots = torch.tensor(connected_components(num_boxes, pairs_i, pairs_j), device=pred_boxes.device)
+        # Renumber the components by their most confident box, which keeps the output sorted by confidence
+        leaders, groups = torch.unique(roots, return_inverse=True)
+        num_groups = leaders.numel()
+
+        index = groups[:, None].expand(-1, 2)
+        mins = torch.full((num_groups, 2), float("inf"), dtype=pred_boxes.dtype, device=pred_boxes.device)
+        maxs = torch.full((num_groups, 2), float("-inf"), dtype=pred_boxes.dtype, device=pred_boxes.device)
+        mins = mins.scatter_reduce(0, index, pred_boxes[:, :2], reduce="amin")
+        maxs = maxs.scatter_reduce(0, index, pred_boxes[:, 2:], reduce="amax")
+
+        pred_boxes = torch.cat([mins, maxs], dim=1)
+        confidences = confidences[leaders]  # the root is the most confident box of its group
+        if num_groups == num_boxes:
+            break
+
+    return pred_boxes, confidences
@@ -4,6 +4,8 @@ import numpy as np
 from sklearn.cluster import KMeans
 from PIL import Image
 import os
+import Constants
+from ImageDecoding import decode_image
 
 from BoundingBoxCNN import *
 
@@ -35,11 +37,8 @@ def load_and_prepare_bboxes(annotations_file, img_dir, transform=None):
     bounding_boxes = []
     for image_id, img_data in data['imgs'].items():
         img_path = os.path.join(img_dir, img_data['file_name'])
-        image = Image.open(img_path)
-        if image.mode != 'RGB':
-            image = image.convert('RGB')
-
-        oldSize = image.size
+        # With a transform (which resizes to desired_size), JPEGs are decoded straight to that size
+        image, oldSize = decode_image(img_path, Constants.desired_size if transform else None, exif_transpose=False)
         scale_x, scale_y = 1, 1  # Default scale factors
         adjustX, adjustY = 0, 0  # Default adjustments
         
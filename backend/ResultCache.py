@@ -0,0 +1,174 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+
+default_cache_dir = "../ocr_cache"
+default_memory_entries = 1024
+default_max_disk_bytes = 512 * 1024 * 1024
+
+
+def image_digest(data):
+    """
+    Content address of encoded image bytes. blake2b is used because it is the fastest hash in hashlib.
+    """
+    return hashlib.blake2b(data, digest_size=20).hexdigest()
+
+
+def file_identity(path):
+    """
+    (absolute path, size, modification time) of a model file, or None when it does not exist.
+    Cheap enough to compute at startup, unlike hashing a 100 MB checkpoint.
+    """
+    if not path or not os.path.exists(path):
+        return None
+    stat = os.stat(path)
+    return [os.path.abspath(path), stat.st_size, stat.st_mtime_ns]
+
+
+def pipeline_fingerprint(pipeline):
+    """
+    Hash of everything besides the image that changes an OCRPipeline result: the model files it loads and its
+    variants, thresholds and pre-processing options.
+    """
+    settings = {
+        "models": {path: file_identity(path) for path in pipeline.model_files()},
+        "backend": pipeline.backend,
+        "detector_variant": pipeline.detector_variant,
+        "crnn_variant": pipeline.crnn_variant,
+        "conf_threshold": pipeline.conf_threshold,
+        "nms_threshold": pipeline.nms_threshold,
+        "wbf_threshold": pipeline.wbf_threshold,
+        "combine_threshold": pipeline.combine_threshold,
+        "top_k": pipeline.top_k,
+        "rectangular": pipeline.rectangular,
+        "tile_size": pipeline.tile_size,
+        "tile_overlap": pipeline.tile_overlap,
+        "tile_with_global": pipeline.tile_with_global,
+        "decode_max_dim": pipeline.decode_max_dim,
+        "char_confidences": pipeline.char_confidences,
+    }
+    return hashlib.blake2b(json.dumps(settings, sort_keys=True).encode("utf-8"), digest_size=8).hexdigest()
+
+
+class ResultCache:
+    """
+    Content-addressed store of OCR results (the dicts OCRPipeline.process_images returns).
+
+    The key is the hash of the encoded image bytes plus a fingerprint of the pipeline (model files and thresholds),
+    so a retrained checkpoint or a changed threshold never serves stale results. Results live as small JSON files
+    under cache_dir/<fingerprint>/, with an in-memory LRU of the most recent ones in front. The disk store is kept
+    under max_disk_bytes by removing the least recently used files. Safe to share between threads.
+
+    Parameters:
+    - fingerprint: String from pipeline_fingerprint.
+    - cache_dir: Optional directory of the disk store. None keeps the cache in memory only.
+    - memory_entries: Int, the most results held in memory.
+    - max_disk_bytes: Int, the most bytes of results kept on disk.
+    """
+    def __init__(self, fingerprint, cache_dir=default_cache_dir, memory_entries=default_memory_entries,
+                 max_disk_bytes=default_max_disk_bytes):
+        self.fingerprint = fingerprint
+        self.memory_entries = memory_entries
+        self.max_disk_bytes = max_disk_bytes
+        self.memory = OrderedDict()
+        self.lock = threading.Lock()
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+
+        self.directory = None
+        self.disk = OrderedDict()  # key -> file size, least recently used first
+        self.disk_bytes = 0
+        if cache_dir is not None:
+            self.directory = os.path.join(cache_dir, fingerprint)
+            os.makedirs(self.directory, exist_ok=True)
+            entries = []
+            for name in os.listdir(self.directory):
+                if name.endswith(".json"):
+                    stat = os.stat(os.path.join(self.directory, name))
+                    entries.append((stat.st_mtime_ns, name[:-len(".json")], stat.st_size))
+            for _, key, size in sorted(entries):
+                self.disk[key] = size
+                self.disk_bytes += size
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + ".json")
+
+    def _remember(self, key, result):
+        self.memory[key] = result
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.memory_entries:
+            self.memory.popitem(last=False)
+
+    def get(self, key):
+        """
+        The cached result of an image key, or None.
+        """
+        with self.lock:
+            if key in self.memory:
+                self.memory.move_to_end(key)
+                self.stats["memory_hits"] += 1
+                return self.memory[key]
+            if key not in self.disk:
+                self.stats["misses"] += 1
+                return None
+
+        try:
+            with open(self._path(key), "r") as file:
+                result = json.load(file)
+            os.utime(self._path(key))  # keeps the least recently used order across restarts
+        except (OSError, ValueError):
+            # Removed or half written by another process: treat as a miss
+            with self.lock:
+                self.stats["misses"] += 1
+            return None
+
+        with self.lock:
+            self.stats["disk_hits"] += 1
+            if key in self.disk:
+                self.disk.move_to_end(key)
+            self._remember(key, result)
+        return result
+
+    def put(self, key, result):
+        """
+        Store the result of an image key in memory and, with a disk store, on disk.
+        """
+        with self.lock:
+            self._remember(key, result)
+            self.stats["stores"] += 1
+        if self.directory is None:
+            return
+
+        body = json.dumps(result)
+        temporary = self._path(key) + f".{threading.get_ident()}.tmp"
+        with open(temporary, "w") as file:
+            file.write(body)
+        os.replace(temporary, self._path(key))  # readers never see a partial file
+
+        with self.lock:
+            self.disk_bytes += len(body) - self.disk.get(key, 0)
+            self.disk[key] = len(body)
+            self.disk.move_to_end(key)
+            evicted = []
+            while self.disk_bytes > self.max_disk_bytes and len(self.disk) > 1:
+                old_key, size = self.disk.popitem(last=False)
+                self.disk_bytes -= size
+                evicted.append(old_key)
+            self.stats["evictions"] += len(evicted)
+        for old_key in evicted:
+            try:
+                os.remove(self._path(old_key))
+            except OSError:
+                pass
+
+    def get_stats(self):
+        with self.lock:
+            stats = dict(self.stats)
+            stats["memory_entries"] = len(self.memory)
+            stats["disk_entries"] = len(self.disk)
+            stats["disk_bytes"] = self.disk_bytes
+        lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+        stats["hit_rate"] = (stats["memory_hits"] + stats["disk_hits"]) / lookups if lookups else 0.0
+        return stats
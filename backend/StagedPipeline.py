@@ -0,0 +1,269 @@
+import json
+import queue
+import sys
+import threading
+import time
+from OCRPipeline import image_sources, load_image, read_source, to_original_coordinates
+from ResultCache import image_digest
+
+
+# Marks the end of the stream in every queue
+end_of_stream = object()
+
+
+def finished(item):
+    return "error" in item or item.get("cached", False)
+
+
+class Stage:
+    """
+    One step of a StagedPipeline: `workers` threads take items from the bounded input queue, call fn on a list of
+    up to batch_size of them and put the results on the output queue.
+
+    A batch is closed when it holds batch_size items or max_wait seconds have passed since its first item arrived,
+    like InferenceServer.MicroBatcher. Finished items (carrying an "error", or "cached" results) skip fn and are
+    passed straight on.
+    Besides the item and batch counts, each stage records how long its workers waited for input (starved by the
+    stages before it) and waited to hand results on (stalled by the stages after it).
+    """
+    def __init__(self, name, fn, workers=1, batch_size=1, max_wait=0.01):
+        self.name = name
+        self.fn = fn
+        self.workers = workers
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+        self.input = None
+        self.output = None
+        self.threads = []
+        self.active = 0
+        self.stats = {"items": 0, "batches": 0, "busy_s": 0.0, "starved_s": 0.0, "stalled_s": 0.0, "errors": 0}
+        self.lock = threading.Lock()
+
+    def start(self, input_queue, output_queue):
+        self.input = input_queue
+        self.output = output_queue
+        self.active = self.workers
+        self.threads = [threading.Thread(target=self._run, name=f"{self.name}-{i}", daemon=True) for i in range(self.workers)]
+        for thread in self.threads:
+            thread.start()
+        return self
+
+    def get_stats(self):
+        with self.lock:
+            stats = dict(self.stats)
+        stats["workers"] = self.workers
+        stats["queue_depth"] = self.input.qsize() if self.input is not None else 0
+        return stats
+
+    def _put(self, item):
+        began = time.perf_counter()
+        self.output.put(item)
+        with self.lock:
+            self.stats["stalled_s"] += time.perf_counter() - began
+
+    def _next_batch(self):
+        """
+        Up to batch_size items, or None once the end of the stream is reached (and nothing is left to process).
+        """
+        began = time.perf_counter()
+        first = self.input.get()
+        with self.lock:
+            self.stats["starved_s"] += time.perf_counter() - began
+        if first is end_of_stream:
+            return None
+
+        batch = [first]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                item = self.input.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is end_of_stream:
+                # Leave the marker for this stage's other workers and finish the batch
+                self.input.put(end_of_stream)
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                break
+
+            valid = [item for item in batch if not finished(item)]
+            started = time.perf_counter()
+            try:
+                results = self.fn(valid) if valid else []
+            except Exception as e:
+                results = [{"path": item.get("path"), "error": f"{self.name}: {e}"} for item in valid]
+                with self.lock:
+                    self.stats["errors"] += len(valid)
+            with self.lock:
+                self.stats["busy_s"] += time.perf_counter() - started
+                self.stats["items"] += len(batch)
+                self.stats["batches"] += 1
+
+            for item in batch:
+                if finished(item):
+                    self._put(item)
+            for result in results:
+                self._put(result)
+
+        # The last worker of the stage passes the end of the stream on; the others wake their siblings
+        with self.lock:
+            self.active -= 1
+            last = self.active == 0
+        if last:
+            self.output.put(end_of_stream)
+        else:
+            self.input.put(end_of_stream)
+
+
+class StagedPipeline:
+    """
+    Chains stages with bounded queues so every stage works on a different part of the stream at the same time.
+    Steady-state throughput is set by the slowest stage instead of the sum of all of them, and the bounded queues
+    hold a fast stage back instead of letting its output pile up in memory.
+    """
+    def __init__(self, stages, queue_size=16):
+        self.stages = stages
+        self.queue_size = queue_size
+
+    def run(self, items):
+        """
+        Feed items (dicts) through every stage and yield what comes out of the last one, as it comes out.
+        """
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in range(len(self.stages) + 1)]
+        for stage, input_queue, output_queue in zip(self.stages, queues, queues[1:]):
+            stage.start(input_queue, output_queue)
+
+        def feed():
+            for item in items:
+                queues[0].put(item)
+            queues[0].put(end_of_stream)
+
+        feeder = threading.Thread(target=feed, name="feed", daemon=True)
+        feeder.start()
+        while True:
+            item = queues[-1].get()
+            if item is end_of_stream:
+                break
+            yield item
+        feeder.join()
+
+    def get_stats(self):
+        return {stage.name: stage.get_stats() for stage in self.stages}
+
+    def format_stats(self):
+        lines = [f"{'stage':<10} {'workers':>7} {'items':>7} {'batches':>7} {'busy s':>8} {'starved s':>9} {'stalled s':>9} {'queue':>5}"]
+        for name, stats in self.get_stats().items():
+            lines.append(f"{name:<10} {stats['workers']:>7} {stats['items']:>7} {stats['batches']:>7} {stats['busy_s']:8.2f} "
+                         f"{stats['starved_s']:9.2f} {stats['stalled_s']:9.2f} {stats['queue_depth']:>5}")
+        return "\n".join(lines)
+
+
+def ocr_stages(pipeline, batch_size=8, decode_workers=4, crop_workers=2, max_wait=0.01, cache=None):
+    """
+    decode -> detect -> crop -> recognize stages over an OCRPipeline. Decode and crop run on thread pools
+    (PIL decoding and the tensor ops release the GIL); the detector and the CRNN each get one dedicated worker,
+    which also keeps every model on a single thread. With a ResultCache, the decode stage answers images seen
+    before and the later stages pass them through.
+    """
+    def decode(items):
+        if cache is None:
+            return [{"path": item["path"], "image": load_image(item["path"], pipeline.decode_max_dim)} for item in items]
+        results = []
+        for item in items:
+            data = read_source(item["path"])
+            key = image_digest(data)
+            result = cache.get(key)
+            if result is not None:
+                results.append({"path": item["path"], **result, "cached": True})
+            else:
+                results.append({"path": item["path"], "image": load_image(data, pipeline.decode_max_dim), "key": key})
+        return results
+
+    def detect(items):
+        detections = pipeline.detect_images([item["image"] for item in items])
+        return [{**item, "boxes": boxes, "confidences": confidences} for item, (boxes, confidences) in zip(items, detections)]
+
+    def crop(items):
+        results = []
+        for item in items:
+            crops, kept = pipeline.extract_crops(item["image"], item["boxes"])
+            width, height = item["image"].info.get("original_size", item["image"].size)
+            results.append({
+                "path": item["path"],
+                "key": item.get("key"),
+                "width": width,
+                "height": height,
+                "boxes": to_original_coordinates(item["boxes"][kept], item["image"]).tolist(),
+                "confidences": item["confidences"][kept].squeeze(1).tolist(),
+                "crops": crops,
+            })
+        return results
+
+    def recognize(items):
+        # Crops of several images share the width-bucketed CRNN batches
+        crops = [crop for item in items for crop in item["crops"]]
+        if pipeline.char_confidences:
+            texts, char_confidences = pipeline.recognize(crops, with_confidences=True)
+        else:
+            texts, char_confidences = pipeline.recognize(crops), None
+        results = []
+        start = 0
+        for item in items:
+            end = start + len(item["crops"])
+            result = {key: value for key, value in item.items() if key != "crops"}
+            result["texts"] = texts[start:end]
+            if char_confidences is not None:
+                result["char_confidences"] = char_confidences[start:end]
+            results.append(result)
+            start = end
+        return results
+
+    return [
+        Stage("decode", decode, workers=decode_workers),
+        Stage("detect", detect, batch_size=batch_size, max_wait=max_wait),
+        Stage("crop", crop, workers=crop_workers),
+        Stage("recognize", recognize, batch_size=batch_size, max_wait=max_wait),
+    ]
+
+
+def run_staged(pipeline, source, batch_size=8, output="-", decode_workers=4, crop_workers=2, queue_size=16, cache=None):
+    """
+    Staged version of OCRPipeline.run_batch: OCR every image from a batch source and stream one JSON line per image
+    to output ('-' for stdout). Writing happens on the calling thread while the stages work on the next images.
+    Lines can come out of source order; every line has its path. The per-stage statistics go to stderr at the end.
+    New results are stored in the ResultCache, when one is given.
+    """
+    staged = StagedPipeline(ocr_stages(pipeline, batch_size, decode_workers, crop_workers, cache=cache), queue_size)
+    out = sys.stdout if output == "-" else open(output, "w")
+    processed = 0
+    start_time = time.time()
+    try:
+        for result in staged.run({"path": path} for path in image_sources(source)):
+            cached = result.pop("cached", False)
+            key = result.pop("key", None)
+            if cache is not None and not cached and key is not None and "error" not in result:
+                cache.put(key, {name: value for name, value in result.items() if name != "path"})
+            out.write(json.dumps(result) + "\n")
+            processed += 1
+            if processed % batch_size == 0:
+                out.flush()
+                elapsed = time.time() - start_time
+                print(f"{processed} images, {processed / elapsed:.2f} images/sec", file=sys.stderr)
+        out.flush()
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+    print(staged.format_stats(), file=sys.stderr)
+    if cache is not None:
+        print(f"Result cache: {json.dumps(cache.get_stats())}", file=sys.stderr)
+    return processed
@@ -0,0 +1,88 @@
+import torch
+import Constants
+
+
+# Downsampling of the three detector outputs (small, medium, large boxes)
+detector_strides = (8, 16, 32)
+
+
+class TargetEncoder:
+    """
+    Static target assignment, run on the CPU in the DataLoader workers instead of matching in the loss.
+
+    Every ground-truth box is given to one prediction at the scale CustomImageDataset put it in: the grid cell
+    holding its center and, in that cell, the anchor closest to its size (same distance as get_closest_scale).
+    When two boxes land on the same cell and anchor, the larger one keeps it. The result is dense per scale, so
+    the loss reads the matched pairs with a mask instead of solving an assignment every step.
+
+    Parameters:
+    - anchor_boxes: Tensor [9, 2] of anchor (width, height) as a fraction of image_size, 3 per scale.
+    - image_size: Int, the side of the square detector input.
+    - strides: Downsampling of each scale's output.
+    """
+    def __init__(self, anchor_boxes, image_size=Constants.desired_size, strides=detector_strides):
+        self.anchor_sizes = anchor_boxes.detach().cpu().float().view(len(strides), -1, 2) * image_size
+        self.image_size = image_size
+        self.strides = strides
+
+    def grid_shape(self, scale):
+        """
+        (num_anchors, grid_h, grid_w) of one scale.
+        """
+        return self.anchor_sizes.shape[1], self.image_size // self.strides[scale], self.image_size // self.strides[scale]
+
+    def encode_scale(self, boxes, scale):
+        """
+        Dense targets of one scale.
+
+        Parameters:
+        - boxes: Tensor [M, 4] of corner boxes in input pixels assigned to this scale.
+        - scale: Int, 0 for small, 1 for medium and 2 for large.
+
+        Returns:
+        - objectness: Float tensor [num_anchors, grid_h, grid_w], 1 where a box is assigned.
+        - box_targets: Tensor [num_anchors, grid_h, grid_w, 4], the assigned corner box, zero elsewhere.
+        - mask: Bool tensor [num_anchors, grid_h, grid_w], True where a box is assigned.
+        """
+        num_anchors, grid_h, grid_w = self.grid_shape(scale)
+        stride = self.strides[scale]
+        box_targets = torch.zeros(num_anchors * grid_h * grid_w, 4)
+        mask = torch.zeros(num_anchors * grid_h * grid_w, dtype=torch.bool)
+
+        boxes = boxes[boxes.sum(dim=1) > 0].float()
+        if len(boxes):
+            sizes = boxes[:, 2:] - boxes[:, :2]
+            # Smallest first, so on a shared cell and anchor the largest box is written last and kept
+            boxes = boxes[(sizes[:, 0] * sizes[:, 1]).argsort()]
+            sizes = boxes[:, 2:] - boxes[:, :2]
+
+            anchors = torch.norm(self.anchor_sizes[scale].unsqueeze(0) - sizes.unsqueeze(1), dim=2).argmin(dim=1)
+            centers = (boxes[:, :2] + boxes[:, 2:]) / 2
+            cell_x = (centers[:, 0] / stride).long().clamp(0, grid_w - 1)
+            cell_y = (centers[:, 1] / stride).long().clamp(0, grid_h - 1)
+            # Same (anchor, row, column) order as the flattened detector output
+            index = anchors * grid_h * grid_w + cell_y * grid_w + cell_x
+            # Keep the last (largest) box of every index, so the writes below never collide
+            sorted_index, order = index.sort(stable=True)
+            last = torch.ones_like(sorted_index, dtype=torch.bool)
+            last[:-1] = sorted_index[1:] != sorted_index[:-1]
+            box_targets[sorted_index[last]] = boxes[order[last]]
+            mask[sorted_index[last]] = True
+
+        return (mask.float().view(num_anchors, grid_h, grid_w),
+                box_targets.view(num_anchors, grid_h, grid_w, 4),
+                mask.view(num_anchors, grid_h, grid_w))
+
+    def __call__(self, scale_boxes):
+        """
+        Encode the [small, medium, large] box lists of one image into a list of per scale
+        (objectness, box_targets, mask).
+        """
+        return [self.encode_scale(boxes, scale) for scale, boxes in enumerate(scale_boxes)]
+
+
+def collate_encoded_targets(encoded):
+    """
+    Stack the per image encoder outputs of a batch into per scale (objectness [B, ...], box_targets [B, ...], mask [B, ...]).
+    """
+    return [tuple(torch.stack(part) for part in zip(*scale)) for scale in zip(*encoded)]
@@ -1,8 +1,9 @@
 import random
+import sys
 import torch
 import torch.nn as nn
 import torchvision.models as models
-from torch.nn.utils.rnn import pad_sequence
+from torch.nn.utils.rnn import pad_sequence, pack_padded_sequence, pad_packed_sequence
 import torchvision.transforms as transforms
 import json
 import os
@@ -17,6 +18,7 @@ import Constants
 from transforms import ResizeToMaxDimension
 from customDataSet2 import CustomImageDataset2
 from customDataSet3 import CustomImageDataset3
+from CRNNBatching import WidthBucketBatchSampler
 from PIL import Image
 import torch.nn.functional as F
 from torch.utils.tensorboard import SummaryWriter
@@ -30,6 +32,10 @@ class LabelEncoder:
         self.idx2char = {idx + 1: char for idx, char in enumerate(char_set)}
         self.blank_label = 0  # CTC requires a blank label at index 0
 
+        # Codepoint of every class index for decode (0 for the blank, which is always dropped)
+        self.codepoints = torch.tensor([0] + [ord(char) for char in char_set], dtype=torch.int32)
+        self.utf32 = 'utf-32-le' if sys.byteorder == 'little' else 'utf-32-be'
+
     def encode(self, texts):
         # Encode a list of texts to a list of tensors
         lengths = []
@@ -40,20 +46,56 @@ class LabelEncoder:
             encoded_texts.append(torch.tensor(encoded, dtype=torch.long))
         return encoded_texts, lengths
 
-    def decode(self, preds):
-        # preds: Tensor of shape [batch_size, seq_len]
+    def decode(self, preds, confidences=None, lengths=None):
+        """
+        Greedy CTC decode of a batch: collapse repeated indices, then drop blanks.
+
+        Works on the whole [batch_size, seq_len] tensor at once: a shifted comparison marks the timesteps that start
+        a new character, the kept indices go through a codepoint lookup table on the tensor's device, and one
+        transfer brings them to the CPU, where they are turned into strings in one UTF-32 decode.
+
+        Parameters:
+        - preds: Tensor of predicted class indices [batch_size, seq_len].
+        - confidences: Optional tensor [batch_size, seq_len] of the probability of each predicted index.
+        - lengths: Optional [batch_size] sequence lengths; the padded steps after them are ignored.
+
+        Returns:
+        - pred_texts: List of decoded strings.
+        - char_confidences: Only when confidences is given, a list with one list of per-character confidences per string
+          (the confidence of the first timestep of each character).
+        """
+        if self.codepoints.device != preds.device:
+            self.codepoints = self.codepoints.to(preds.device)
+
+        preds = preds.detach()
+        keep = (preds != self.blank_label) & (preds < self.codepoints.numel())  # unknown indices decode to nothing
+        keep[:, 1:] &= preds[:, 1:] != preds[:, :-1]
+        if lengths is not None:
+            steps = torch.arange(preds.size(1), device=preds.device)
+            keep &= steps[None, :] < torch.as_tensor(lengths, device=preds.device)[:, None]
+
+        lengths = keep.sum(dim=1).tolist()
+        codes = self.codepoints[preds[keep]].cpu().numpy()
+        text = codes.tobytes().decode(self.utf32)
+
         pred_texts = []
-        for pred in preds:
-            pred_text = ''
-            prev_idx = None
-            for idx in pred:
-                idx = idx.item()
-                if idx != self.blank_label and idx != prev_idx:
-                    pred_text += self.idx2char.get(idx, '')
-                prev_idx = idx
-            pred_texts.append(pred_text)
-        return pred_texts
-    
+        start = 0
+        for length in lengths:
+            pred_texts.append(text[start:start + length])
+            start += length
+
+        if confidences is None:
+            return pred_texts
+
+        kept_confidences = confidences.detach()[keep].float().cpu().tolist()
+        char_confidences = []
+        start = 0
+        for length in lengths:
+            char_confidences.append(kept_confidences[start:start + length])
+            start += length
+        return pred_texts, char_confidences
+
+
 class CRNN(nn.Module):
     def __init__(self, num_classes, img_h=32, nc=1, leaky_relu=False):
         super(CRNN, self).__init__()
@@ -94,14 +136,24 @@ class CRNN(nn.Module):
             BidirectionalLSTM(256, 256, num_classes)
         )
 
-    def forward(self, x):
+    @staticmethod
+    def output_lengths(widths):
+        """
+        Sequence length the CNN produces for each input width: two width-halving max pools, then the 2x2 conv
+        without padding removes one more column.
+        """
+        return (torch.as_tensor(widths, dtype=torch.long) // 4 - 1).clamp(min=1)
+
+    def forward(self, x, widths=None):
         # x: [batch_size, channels, height, width]
+        # widths: optional [batch_size] real (unpadded) widths. When given, the LSTMs skip the padded columns.
         conv = self.cnn(x)
         b, c, h, w = conv.size()
         assert h == 1, "Height after conv layers must be 1"
         conv = conv.squeeze(2)  # Remove the height dimension
         conv = conv.permute(2, 0, 1)  # [width, batch_size, channels]
-        output = self.rnn(conv)
+        lengths = None if widths is None else self.output_lengths(widths).clamp(max=w)
+        output = self.rnn[1](self.rnn[0](conv, lengths), lengths)
         # Output shape: [seq_len, batch_size, num_classes]
         return output
 
@@ -112,9 +164,16 @@ class BidirectionalLSTM(nn.Module):
         self.rnn = nn.LSTM(nIn, nHidden, bidirectional=True)
         self.embedding = nn.Linear(nHidden * 2, nOut)  # *2 because bidirectional
 
-    def forward(self, input):
+    def forward(self, input, lengths=None):
         # input: [seq_len, batch_size, input_size]
-        recurrent, _ = self.rnn(input)
+        # lengths: optional [batch_size] sequence lengths; the LSTM then runs on a packed sequence,
+        # so padded steps cost nothing and never leak into the backward direction
+        if lengths is None:
+            recurrent, _ = self.rnn(input)
+        else:
+            packed = pack_padded_sequence(input, lengths.cpu(), enforce_sorted=False)
+            recurrent, _ = self.rnn(packed)
+            recurrent, _ = pad_packed_sequence(recurrent, total_length=input.size(0))
         T, b, h = recurrent.size()
         t_rec = recurrent.view(T * b, h)
         output = self.embedding(t_rec)  # [T * b, nOut]
@@ -126,7 +185,7 @@ def custom_collate_fn(batch):
     # Filter out any None samples
     batch = [sample for sample in batch if sample is not None]
     if not batch:
-        return None, None
+        return None, None, None
 
     images, texts = zip(*batch)
 
@@ -137,7 +196,8 @@ def custom_collate_fn(batch):
     ])
 
 
-    max_width = max([img.shape[2] for img in images])
+    widths = torch.tensor([img.shape[2] for img in images], dtype=torch.long)
+    max_width = int(widths.max())
     processed_images = []
     for img in images:
         #img = transforms.ToPILImage()(img.cpu())
@@ -150,14 +210,14 @@ def custom_collate_fn(batch):
     images = torch.stack(processed_images, dim=0)
 
 
-    return images, texts
+    return images, texts, widths
 
 printing = True
 def train(model, loader, criterion, optimizer, epoch):
     model.train()
     running_loss = 0.0
     total_batches = 0
-    for batch_idx, (images, texts) in enumerate(loader):
+    for batch_idx, (images, texts, widths) in enumerate(loader):
         if images is None or texts is None:
             continue  # Skip invalid samples
 
@@ -169,13 +229,11 @@ def train(model, loader, criterion, optimizer, epoch):
         target_lengths = torch.tensor(lengths, dtype=torch.long).to(device)
 
         # Forward pass
-        outputs = model(images)  # [T, N, C]
+        outputs = model(images, widths)  # [T, N, C]
         outputs = F.log_softmax(outputs, dim=2)
 
-        # Prepare input lengths
-        batch_size = images.size(0)
-        seq_len = outputs.size(0)
-        input_lengths = torch.full(size=(batch_size,), fill_value=seq_len, dtype=torch.long, device=device)
+        # Prepare input lengths: each crop's own sequence length, not the padded one
+        input_lengths = CRNN.output_lengths(widths).clamp(max=outputs.size(0)).to(device)
 
         # Compute loss
         loss = criterion(outputs, targets, input_lengths, target_lengths)
@@ -191,7 +249,7 @@ def train(model, loader, criterion, optimizer, epoch):
         if printing:
             _, preds = outputs.max(2)
             preds = preds.transpose(1, 0).contiguous()  # [N, T]
-            pred_texts = label_encoder.decode(preds)
+            pred_texts = label_encoder.decode(preds, lengths=input_lengths)
 
             target_text = texts[0] if len(texts) > 0 else ''
             predicted_text = pred_texts[0] if len(pred_texts) > 0 else ''
@@ -216,7 +274,7 @@ def evaluate(model, loader, criterion):
     total_chars = 0
 
     with torch.no_grad():
-        for images, texts in loader:
+        for images, texts, widths in loader:
             if images is None or texts is None:
                 continue  # Skip invalid samples
 
@@ -228,15 +286,11 @@ def evaluate(model, loader, criterion):
             target_lengths = torch.tensor(lengths, dtype=torch.long).to(device)
 
             # Forward pass
-            outputs = model(images)  # [T, N, C]
+            outputs = model(images, widths)  # [T, N, C]
             outputs = F.log_softmax(outputs, dim=2)
 
-            # Prepare input lengths
-            batch_size = images.size(0)
-            seq_len = outputs.size(0)
-            input_lengths = torch.full(
-                size=(batch_size,), fill_value=seq_len, dtype=torch.long
-            ).to(device)
+            # Prepare input lengths: each crop's own sequence length, not the padded one
+            input_lengths = CRNN.output_lengths(widths).clamp(max=outputs.size(0)).to(device)
 
             # Compute CTC loss
             loss = criterion(outputs, targets, input_lengths, target_lengths)
@@ -247,7 +301,7 @@ def evaluate(model, loader, criterion):
             # Decode predictions
             _, preds = outputs.max(2)
             preds = preds.transpose(1, 0).contiguous()  # [N, T]
-            pred_texts = label_encoder.decode(preds)
+            pred_texts = label_encoder.decode(preds, lengths=input_lengths)
 
             # Calculate character-level accuracy
             for pred_text, target_text in zip(pred_texts, texts):
@@ -355,7 +409,9 @@ if __name__ == '__main__':
 
     #verify_char_set(train_dataset,label_encoder)
 
-    train_loader = DataLoader(train_dataset, batch_size=batch_size, shuffle=True, num_workers=8,prefetch_factor=2,persistent_workers=True, pin_memory=True, collate_fn=custom_collate_fn)
+    # Batches are drawn from one width bucket at a time, so short words are not padded out to the longest line
+    train_sampler = WidthBucketBatchSampler(train_dataset.get_widths(), batch_size)
+    train_loader = DataLoader(train_dataset, batch_sampler=train_sampler, num_workers=8,prefetch_factor=2,persistent_workers=True, pin_memory=True, collate_fn=custom_collate_fn)
     #test_loader = DataLoader(test_dataset, batch_size=batch_size, shuffle=False, num_workers=1,prefetch_factor=2,persistent_workers=True, pin_memory=True,  collate_fn=custom_collate_fn)
 
     # Model, criterion, optimizer
@@ -411,10 +467,11 @@ if __name__ == '__main__':
         try:
             train_loss = train(model, train_loader, criterion, optimizer, epoch)
             #val_loss, val_acc = evaluate(model, test_loader, criterion)
-            print(f'Epoch [{epoch+1}/{num_epochs}], Train Loss: {train_loss:.4f}')#, Val Loss: {val_loss:.4f}, Val Acc: {val_acc:.2f}%')
+            print(f'Epoch [{epoch+1}/{num_epochs}], Train Loss: {train_loss:.4f}, Padding: {train_sampler.padding_ratio():.1%}')#, Val Loss: {val_loss:.4f}, Val Acc: {val_acc:.2f}%')
             plateau_scheduler.step(train_loss)
             # Log to TensorBoard
             writer.add_scalar('Loss/Train', train_loss, epoch)
+            writer.add_scalar('Padding/Train', train_sampler.padding_ratio(), epoch)
             #writer.add_scalar('Loss/Validation', val_loss, epoch)
             #writer.add_scalar('Accuracy/Validation', val_acc, epoch)
 
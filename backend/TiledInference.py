@@ -0,0 +1,80 @@
+import torch
+from torchvision.transforms.functional import pil_to_tensor
+import Constants
+
+
+# Pixels in one tile batch (batch size * tile_size^2). Bounds the detector activations, whatever the image size.
+default_max_tile_pixels = 8 * Constants.desired_size * Constants.desired_size
+
+
+def tile_origins(length, tile_size=Constants.desired_size, overlap=128):
+    """
+    Start positions of tiles of tile_size covering [0, length), neighbours sharing at least overlap pixels.
+    The last tile is aligned with the end, so tiles never run past the image unless it is shorter than one tile.
+    """
+    if length <= tile_size:
+        return [0]
+    step = tile_size - overlap
+    if step <= 0:
+        raise ValueError("Tile overlap must be smaller than the tile size")
+    origins = list(range(0, length - tile_size, step))
+    origins.append(length - tile_size)
+    return origins
+
+
+def tile_grid(width, height, tile_size=Constants.desired_size, overlap=128):
+    """
+    (x, y) origins of every tile of an image, row by row.
+    """
+    return [(x, y) for y in tile_origins(height, tile_size, overlap) for x in tile_origins(width, tile_size, overlap)]
+
+
+def tile_batches(image, means, stds, tile_size=Constants.desired_size, overlap=128, max_pixels=default_max_tile_pixels):
+    """
+    Cut an image into overlapping tiles at full resolution and yield them in batches of at most max_pixels pixels.
+
+    Only the tiles of the current batch are converted to normalized floats; the image itself stays uint8, so the
+    memory beyond the decoded image does not grow with the resolution. Tiles of an image smaller than tile_size
+    are zero padded (after normalization) on the right and bottom, like the letterbox padding.
+
+    Parameters:
+    - image: PIL image or uint8 tensor [3, H, W].
+    - means, stds: Per channel normalization, as in BBtransform.
+    - tile_size: Int, the side of the square detector input.
+    - overlap: Int, the least overlap in pixels between neighbouring tiles, at least the height of the text to keep whole.
+    - max_pixels: Int, the most tile pixels in one batch.
+
+    Yields:
+    - batch: Tensor [T, 3, tile_size, tile_size].
+    - origins: List of the (x, y) origins of the tiles in the batch.
+    """
+    if not isinstance(image, torch.Tensor):
+        image = pil_to_tensor(image)
+    height, width = image.shape[1], image.shape[2]
+    means = torch.tensor(means, dtype=torch.float32).view(3, 1, 1)
+    stds = torch.tensor(stds, dtype=torch.float32).view(3, 1, 1)
+
+    origins = tile_grid(width, height, tile_size, overlap)
+    batch_size = max(1, max_pixels // (tile_size * tile_size))
+    for start in range(0, len(origins), batch_size):
+        batch_origins = origins[start:start + batch_size]
+        batch = torch.zeros(len(batch_origins), 3, tile_size, tile_size)
+        for i, (x, y) in enumerate(batch_origins):
+            tile = image[:, y:y + tile_size, x:x + tile_size].float() / 255
+            batch[i, :, :tile.shape[1], :tile.shape[2]] = (tile - means) / stds
+        yield batch, batch_origins
+
+
+def tiles_to_global(detections, origins):
+    """
+    Shift per-tile (boxes [N, 4], confidences [N, 1]) detections by their tile origins and concatenate them.
+    """
+    boxes = []
+    confidences = []
+    for (tile_boxes, tile_confidences), (x, y) in zip(detections, origins):
+        offset = torch.tensor([x, y, x, y], dtype=tile_boxes.dtype, device=tile_boxes.device)
+        boxes.append(tile_boxes + offset)
+        confidences.append(tile_confidences)
+    if not boxes:
+        return torch.zeros(0, 4), torch.zeros(0, 1)
+    return torch.cat(boxes), torch.cat(confidences)
@@ -9,13 +9,14 @@ import torchvision.transforms as transforms
 import torchvision.transforms.functional as F
 import pandas as pd
 import Constants
+from ImageDecoding import decode_image
 import pandas as pd
 
 device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
 
 class CustomImageDataset(Dataset):
 
-    def __init__(self, img_dir, transform=None, train=False, anchor_boxes=None):
+    def __init__(self, img_dir, transform=None, train=False, anchor_boxes=None, target_encoder=None):
         self.maxHeight = Constants.desired_size
         self.maxWidth = Constants.desired_size
         self.maxBBoxes = Constants.max_boxes
@@ -25,6 +26,8 @@ class CustomImageDataset(Dataset):
         self.train = train
         self.image_filenames = [f for f in os.listdir(img_dir) if os.path.isfile(os.path.join(img_dir, f))]
         self.anchor_boxes = anchor_boxes
+        # Optional TargetEncoder: with one, items also carry the dense per scale targets, computed here in the workers
+        self.target_encoder = target_encoder
         self.rotation_transform = RandomRotationWithBBox(angle_range=(-10, 10), p=0.5)
 
         # Set the appropriate JSON file based on training or test data
@@ -148,11 +151,10 @@ class CustomImageDataset(Dataset):
             image_id = self.image_ids[idx]
             img_data = self.imgs[image_id]
             img_path = os.path.join(self.img_dir, img_data['file_name'])
-            # Load image
-            image = Image.open(img_path)
-
-            if image.mode != 'RGB':
-                image = image.convert('RGB')
+            # Load image. With a transform (which resizes to desired_size), JPEGs are decoded straight to that size.
+            # No EXIF rotation: the TextOCR annotations are in the stored pixel orientation.
+            image, (original_width, original_height) = decode_image(img_path, Constants.desired_size if self.transform else None,
+                                                                    exif_transpose=False)
 
             adjustX = 0
             adjustY=0
@@ -172,7 +174,7 @@ class CustomImageDataset(Dataset):
                     rotation_value = 0.0
                     
 
-                oldSize = (image.height, image.width)
+                oldSize = (original_height, original_width)
                 image = self.transform(image)
                 newSize = (image.shape[1], image.shape[2])
                 scale_y, scale_x  = self.getScales(oldSize, newSize)
@@ -274,6 +276,8 @@ class CustomImageDataset(Dataset):
                 large_scale_boxes = torch.stack(large_scale_boxes) if large_scale_boxes else torch.empty((0, 4), dtype=torch.float32)
 
                 all_bboxes = [small_scale_boxes, medium_scale_boxes, large_scale_boxes]
+                if self.target_encoder is not None:
+                    return image, all_bboxes, img_path, self.target_encoder(all_bboxes)
                 # Return image and bounding boxes as tensors
                 return image, all_bboxes, img_path
             else:
@@ -67,6 +67,19 @@ class CustomImageDataset3(Dataset):
     def __len__(self):
         return len(self.samples)
 
+    def get_widths(self):
+        """
+        Width of every cropped sample image, read from the PNG headers only. Used to bucket the CRNN batches by width.
+        """
+        widths = []
+        for ann_id, ann in self.samples:
+            try:
+                with Image.open(os.path.join(self.img_dir, "cropped_images/" + ann_id + ".png")) as image:
+                    widths.append(image.width)
+            except OSError:
+                widths.append(1)  # __getitem__ drops unreadable samples anyway
+        return widths
+
 
     def pad_to_target_size(self, image_tensor, target_width, target_height):
         _, height, width = image_tensor.shape
@@ -1,5 +1,7 @@
+import argparse
 import json
 import os
+import sys
 import random
 from charset_normalizer import detect
 import torch
@@ -10,15 +12,20 @@ import torchvision
 import torchvision.transforms as transforms
 from torch.utils.data import DataLoader
 import torchvision.transforms.functional as F
-from torchvision.transforms.functional import crop
 from GIoULoss import GIoULoss
 import DisplayImage
-from TextCRNN import CRNN, LabelEncoder
+from OCRPipeline import OCRPipeline, BBtransform, load_image, boxes_to_original, custom_collate_fn, run_batch
+from CRNNQuantization import crnn_variants
+from DetectorQuantization import detector_variants
+from OnnxBackend import backends
+from TiledInference import default_max_tile_pixels
+from StagedPipeline import run_staged
+from ResultCache import ResultCache, pipeline_fingerprint, default_cache_dir, default_memory_entries
 from customDataSet import CustomImageDataset
 import torchvision.ops as ops
 from transforms import ResizeToMaxDimension
 from datetime import datetime
-from PIL import Image, ExifTags
+from PIL import Image
 from torch.nn.utils.rnn import pad_sequence
 import torch.profiler
 from CombinedLoss import *
@@ -748,182 +755,6 @@ def compute_max_boxes(dataloader):
     return max_boxes
 
 
-def weighted_box_fusion(pred_boxes, confidences, iou_threshold=0.5):
-    """
-    Apply Weighted Box Fusion (WBF) to combine overlapping boxes into a single box with higher precision.
-
-    Parameters:
-    - pred_boxes: Tensor of predicted boxes [N, 4], where each box is (x1, y1, x2, y2).
-    - confidences: Tensor of confidence scores [N, 1].
-    - iou_threshold: Float, the IoU threshold for grouping boxes.
-
-    Returns:
-    - fused_boxes: Tensor of boxes after applying WBF.
-    - fused_confidences: Tensor of confidence scores for fused boxes, shape [K, 1] where K is the number of fused boxes.
-    """
-    if pred_boxes.size(0) == 0:
-        return pred_boxes, confidences
-
-    # Sort boxes by confidence scores in descending order
-    sorted_indices = torch.argsort(confidences.squeeze(1), descending=True)
-    pred_boxes = pred_boxes[sorted_indices]
-    confidences = confidences[sorted_indices]
-
-    fused_boxes = []
-    fused_confidences = []
-    used_indices = set()
-
-    # Helper function to calculate IoU
-    def calculate_iou(box1, box2):
-        inter_x1 = max(box1[0], box2[0])
-        inter_y1 = max(box1[1], box2[1])
-        inter_x2 = min(box1[2], box2[2])
-        inter_y2 = min(box1[3], box2[3])
-
-        inter_area = max(0, inter_x2 - inter_x1) * max(0, inter_y2 - inter_y1)
-        box1_area = (box1[2] - box1[0]) * (box1[3] - box1[1])
-        box2_area = (box2[2] - box2[0]) * (box2[3] - box2[1])
-
-        union_area = box1_area + box2_area - inter_area
-        return inter_area / union_area if union_area > 0 else 0
-
-    for i, box in enumerate(pred_boxes):
-        if i in used_indices:
-            continue
-
-        # Group overlapping boxes
-        group_boxes = [box]
-        group_confidences = [confidences[i]]
-        used_indices.add(i)
-
-        for j in range(i + 1, pred_boxes.size(0)):
-            if j in used_indices:
-                continue
-            if calculate_iou(box, pred_boxes[j]) > iou_threshold:
-                group_boxes.append(pred_boxes[j])
-                group_confidences.append(confidences[j])
-                used_indices.add(j)
-
-        # Compute weighted box
-        group_boxes = torch.stack(group_boxes)
-        group_confidences = torch.stack(group_confidences).squeeze(1)
-
-        weights = group_confidences / group_confidences.sum()
-        weighted_box = torch.sum(group_boxes * weights[:, None], dim=0)
-
-        # Add fused box and its confidence
-        fused_boxes.append(weighted_box)
-        fused_confidences.append(group_confidences.mean())
-
-    # Convert lists to tensors
-    fused_boxes = torch.stack(fused_boxes)
-    fused_confidences = torch.tensor(fused_confidences).unsqueeze(1)
-
-    return fused_boxes, fused_confidences
-
-
-def pad_to_target_size(image_tensor, target_width, target_height):
-    # Get the current tensor dimensions (assuming shape is [C, W, H])
-    _, height, width = image_tensor.shape
-    
-    # Calculate padding needed for both width and height
-    pad_width = max(0, target_width - width)
-    pad_height = max(0, target_height - height)
-    
-    # Padding is applied as (top, right, bottom, left)
-    PadLeft = random.randint(0, pad_width)
-    PadRight = pad_width - PadLeft
-    PadTop = random.randint(0, pad_height)
-    PadBottom = pad_height - PadTop
-
-
-
-    #padding = (pad_width // 2, pad_height // 2, pad_width - pad_width // 2, pad_height - pad_height // 2)
-    #padding = (pad_height // 2, pad_width // 2, pad_height - pad_height // 2, pad_width - pad_width // 2)
-    padding = (PadLeft, PadRight, PadTop, PadBottom)
-    
-    # Apply padding using F.pad (for tensors), padding must be in (left, right, top, bottom) order
-    padded_image_tensor = F.pad(image_tensor, padding, value=0)
-
-
-    return padded_image_tensor, padding
-
-def getScales(original_size, new_size):
-    old_width, old_height = original_size
-    new_width, new_height = new_size
-    
-    # Scale factors for resizing
-    scale_x = new_width / old_width
-    scale_y = new_height / old_height
-    
-    return scale_x, scale_y
-
-
-
-def custom_collate_fn(batch):
-    # Define consistent transformations
-    transform = transforms.Compose([
-        transforms.ToTensor(),
-        #transforms.Normalize(mean=[0.3490, 0.3219, 0.2957], std=[0.2993, 0.2850, 0.2735])
-    ])
-
-
-    max_width = max([img.shape[2] for img in batch])
-    processed_images = []
-    for img in batch:
-        padding = (0, max_width - img.shape[2], 0, 0)
-        padded_img = F.pad(img, padding, value=0.5)
-        processed_images.append(padded_img)
-
-    # Stack images into a tensor of shape [batch_size, channels, height, width]
-    images = torch.stack(processed_images, dim=0)
-    return images
-
-def remove_contained_boxes(pred_boxes, confidences):
-    """
-    Removes boxes that are fully contained within a more confident box.
-
-    Parameters:
-    - pred_boxes: Tensor of predicted boxes [N, 4], where each box is (x1, y1, x2, y2).
-    - confidences: Tensor of confidence scores [N, 1].
-
-    Returns:
-    - filtered_boxes: Tensor of boxes after removing fully contained ones.
-    - filtered_confidences: Tensor of confidence scores for the remaining boxes, shape [M, 1].
-    """
-    if pred_boxes.size(0) == 0:
-        return pred_boxes, confidences
-
-    # Sort boxes by confidence scores in descending order
-    sorted_indices = torch.argsort(confidences.squeeze(1), descending=True)
-    pred_boxes = pred_boxes[sorted_indices]
-    confidences = confidences[sorted_indices]
-
-    keep_indices = []
-
-    # Helper function to check if box1 contains box2
-    def is_contained(box1, box2):
-        return (
-            box1[0] <= box2[0] and box1[1] <= box2[1] and
-            box1[2] >= box2[2] and box1[3] >= box2[3]
-        )
-
-    for i in range(pred_boxes.size(0)):
-        contained = False
-        for j in range(i):
-            if is_contained(pred_boxes[j], pred_boxes[i]):
-                contained = True
-                break
-        if not contained:
-            keep_indices.append(i)
-
-    # Index the results with keep_indices
-    filtered_boxes = pred_boxes[keep_indices]
-    filtered_confidences = confidences[keep_indices]
-
-    return filtered_boxes, filtered_confidences
-
-
 def sanitize_filename(filename):
     """
     Remove or replace invalid characters in a filename.
@@ -934,325 +765,85 @@ def sanitize_filename(filename):
         filename = filename.replace(char, "_")  # Replace invalid characters with underscores
     return filename
 
-def combine_boxes(pred_boxes, confidences, overlap_threshold=0.5):
-    """
-    Combine bounding boxes if a specified percentage of one box is within another box.
-    Combines them into the smallest box that contains both.
-
-    Parameters:
-    - pred_boxes: Tensor of predicted boxes [N, 4], where each box is (x1, y1, x2, y2).
-    - confidences: Tensor of confidence scores [N, 1].
-    - overlap_threshold: Float, the percentage threshold for considering boxes for merging.
-
-    Returns:
-    - combined_boxes: Tensor of boxes after merging.
-    - combined_confidences: Tensor of confidence scores for the combined boxes, shape [M, 1].
-    """
-    if pred_boxes.size(0) == 0:
-        return pred_boxes, confidences
-
-    # Sort boxes by confidence scores in descending order
-    sorted_indices = torch.argsort(confidences.squeeze(1), descending=True)
-    pred_boxes = pred_boxes[sorted_indices]
-    confidences = confidences[sorted_indices]
-
-    combined_boxes = []
-    combined_confidences = []
-    used_indices = set()
-
-    # Helper function to calculate overlap percentages
-    def calculate_overlap(box1, box2):
-        inter_x1 = max(box1[0], box2[0])
-        inter_y1 = max(box1[1], box2[1])
-        inter_x2 = min(box1[2], box2[2])
-        inter_y2 = min(box1[3], box2[3])
-
-        inter_area = max(0, inter_x2 - inter_x1) * max(0, inter_y2 - inter_y1)
-        box1_area = (box1[2] - box1[0]) * (box1[3] - box1[1])
-        box2_area = (box2[2] - box2[0]) * (box2[3] - box2[1])
-
-        # Calculate the fraction of each box that is overlapped
-        overlap1 = inter_area / box1_area if box1_area > 0 else 0
-        overlap2 = inter_area / box2_area if box2_area > 0 else 0
-
-        return overlap1, overlap2
-
-    for i, box1 in enumerate(pred_boxes):
-        if i in used_indices:
-            continue
-
-        group_boxes = [box1]
-        group_confidences = [confidences[i]]
-        used_indices.add(i)
-
-        for j in range(i + 1, pred_boxes.size(0)):
-            if j in used_indices:
-                continue
-            box2 = pred_boxes[j]
-            overlap1, overlap2 = calculate_overlap(box1, box2)
-            if overlap1 >= overlap_threshold or overlap2 >= overlap_threshold:
-                group_boxes.append(box2)
-                group_confidences.append(confidences[j])
-                used_indices.add(j)
-
-        # Combine boxes into the smallest box containing all group boxes
-        group_boxes = torch.stack(group_boxes)
-        x1_min, y1_min = torch.min(group_boxes[:, 0]), torch.min(group_boxes[:, 1])
-        x2_max, y2_max = torch.max(group_boxes[:, 2]), torch.max(group_boxes[:, 3])
-        combined_box = torch.tensor([x1_min, y1_min, x2_max, y2_max])
-
-        # Use the highest confidence score for the combined box
-        combined_confidence = max(group_confidences)
-
-        combined_boxes.append(combined_box)
-        combined_confidences.append(combined_confidence)
-
-    # Convert lists to tensors
-    combined_boxes = torch.stack(combined_boxes)
-    combined_confidences = torch.tensor(combined_confidences).unsqueeze(1)
-
-    return combined_boxes, combined_confidences
-
-
 
 epoch = 0
 if __name__ == "__main__":
-            
-            means = [0.3490, 0.3219, 0.2957]
-            stds=[0.2993, 0.2850, 0.2735]
-            BBtransform = transforms.Compose([
-                ResizeToMaxDimension(max_dim=Constants.desired_size),  # Resize based on max dimension while maintaining aspect ratio
-                transforms.ToTensor(),
-                transforms.Normalize(mean=means, std=stds)
-            ])
+            parser = argparse.ArgumentParser(description="Detect and read the text in images.")
+            parser.add_argument("--batch", metavar="SOURCE", help="Directory, glob, newline-delimited manifest file, or '-' to read the manifest from stdin. Results are streamed as JSON lines.")
+            parser.add_argument("--batch-size", type=int, default=8, help="Images per detector forward pass in batch mode.")
+            parser.add_argument("--output", default="-", help="JSON lines destination in batch mode ('-' for stdout).")
+            parser.add_argument("--top-k", type=int, default=None, help="Keep at most this many of the most confident boxes per image.")
+            parser.add_argument("--crnn", choices=crnn_variants, default="fp32", help="CRNN variant: fp32, or INT8 for CPU (int8-static needs CRNNQuantization.py run first).")
+            parser.add_argument("--detector", choices=detector_variants, default="fp32", help="Detector variant: fp32, or int8 for CPU (needs DetectorQuantization.py run first).")
+            parser.add_argument("--backend", choices=backends, default="torch", help="Run the models in PyTorch, or in ONNX Runtime on the CPU (needs OnnxBackend.py run first).")
+            parser.add_argument("--intra-op-threads", type=int, default=None, help="ONNX Runtime threads inside one operator.")
+            parser.add_argument("--inter-op-threads", type=int, default=None, help="ONNX Runtime threads across independent operators.")
+            parser.add_argument("--rect", action="store_true", help="Pad images only to the next multiple of 32 instead of a 640x640 square; batch mode groups images of the same shape.")
+            parser.add_argument("--tile-size", type=int, default=None, help="Detect images larger than this in overlapping full resolution tiles of this size (e.g. 640).")
+            parser.add_argument("--tile-overlap", type=int, default=128, help="Least overlap in pixels between neighbouring tiles.")
+            parser.add_argument("--max-tile-pixels", type=int, default=default_max_tile_pixels, help="Most tile pixels per detector batch (memory budget).")
+            parser.add_argument("--staged", action="store_true", help="Batch mode with decode, detect, crop and recognize running as concurrent stages.")
+            parser.add_argument("--decode-workers", type=int, default=4, help="Image decoding threads in staged batch mode.")
+            parser.add_argument("--crop-workers", type=int, default=2, help="Crop extraction threads in staged batch mode.")
+            parser.add_argument("--queue-size", type=int, default=16, help="Items held between two stages in staged batch mode.")
+            parser.add_argument("--decode-max-dim", type=int, default=None, help="In batch mode, decode JPEGs straight to about this longest side instead of full resolution.")
+            parser.add_argument("--cache-dir", default=None, help=f"In batch mode, keep results by image content in this directory (e.g. {default_cache_dir}).")
+            parser.add_argument("--cache-memory-entries", type=int, default=default_memory_entries)
+            parser.add_argument("--cache-max-mb", type=int, default=512, help="Disk budget of the result cache.")
+            args = parser.parse_args()
+
+            pipeline = OCRPipeline(device=device, top_k=args.top_k, crnn_variant=args.crnn, detector_variant=args.detector,
+                                   backend=args.backend, intra_op_threads=args.intra_op_threads, inter_op_threads=args.inter_op_threads,
+                                   rectangular=args.rect, tile_size=args.tile_size, tile_overlap=args.tile_overlap,
+                                   max_tile_pixels=args.max_tile_pixels, decode_max_dim=args.decode_max_dim)
+
+            cache = None
+            if args.batch and args.cache_dir:
+                cache = ResultCache(pipeline_fingerprint(pipeline), args.cache_dir, args.cache_memory_entries, args.cache_max_mb * 1024 * 1024)
+            if args.batch and args.staged:
+                run_staged(pipeline, args.batch, args.batch_size, args.output, args.decode_workers, args.crop_workers, args.queue_size, cache)
+                sys.exit(0)
+            if args.batch:
+                run_batch(pipeline, args.batch, args.batch_size, args.output, cache=cache)
+                sys.exit(0)
 
             image_path = input("Please enter the image path: ")
 
             # Load the image
-            ogImage = Image.open(image_path.strip('"'))#remove quotes from sides of path if included
-
-
-
-            try:
-                # Get EXIF data
-                exif = ogImage._getexif()
-
-                if exif is not None:
-                    # Find the orientation tag
-                    for tag, value in ExifTags.TAGS.items():
-                        if value == "Orientation":
-                            orientation_tag = tag
-                            break
-
-                    # Get orientation and apply corrections if needed
-                    orientation = exif.get(orientation_tag)
-
-                    if orientation == 3:
-                        ogImage = ogImage.rotate(180, expand=True)
-                    elif orientation == 6:
-                        ogImage = ogImage.rotate(270, expand=True)
-                    elif orientation == 8:
-                        ogImage = ogImage.rotate(90, expand=True)
-            except Exception as e:
-                print(f"EXIF handling error: {e}")
-
-
-
-
-
-
-
-
+            ogImage = load_image(image_path)
 
+            if args.tile_size and max(ogImage.width, ogImage.height) > args.tile_size:
+                # Tiled detection works on the original image directly, there is no letterboxed image to draw on
+                all_pred_coords, all_pred_confidences = pipeline.detect_tiled(ogImage)
+            else:
+                image, metas = pipeline.prepare([ogImage])
+                all_pred_coords, all_pred_confidences = pipeline.detect(image)[0]
 
+                # Convert to PIL for display
+                rotated_img = transforms.ToPILImage()(image.squeeze(0).clamp(0, 1))
+                #bbox.squeeze()
+                path = DisplayImage.draw_bounding_boxes(rotated_img, None, all_pred_coords, all_pred_confidences, 0,0, 0, BBtransform)
+                print("Image of bounding boxes taken, stored in path:")
+                print(path)
 
+                #"C:\Users\evans\Desktop\Semester Projects\NetGrowth\backend\training_data\test\1c908cd87852e244.jpg"
 
-
-            oldSize = (ogImage.height, ogImage.width)
-            ogImage = ogImage.convert("RGB")
-            image = BBtransform(ogImage)
-            newSize = (image.shape[1], image.shape[2])
-            scale_y, scale_x  = getScales(oldSize, newSize)
-            image, (adjustX1, adjustX2, adjustY1, adjustY2)  = pad_to_target_size(image, Constants.desired_size, Constants.desired_size)
-            with open('../anchor_boxes.json', 'r') as file:
-                loaded_anchor_boxes = json.load(file)
-                loaded_anchor_boxes = torch.tensor(loaded_anchor_boxes, dtype=torch.float32)
-
-
-
-
-            loaded_anchor_boxes = loaded_anchor_boxes.to(device)
-
-            cnn_model = torch.hub.load('ultralytics/yolov5', 'yolov5s', pretrained=False).to(device)
-
-
-            # Access the Detect layer
-            detect_layer = cnn_model.model[-1]
-
-            # Ensure it's configured with the correct number of anchors and outputs
-            detect_layer.nc = 1  # 1 class (text)
-            detect_layer.na = Constants.num_anchor_boxes  # 5 anchors
-            detect_layer.no = 6  # 4 bbox + 1 confidence + 1 class = 6 outputs per anchor
-
-            # Apply the custom anchors to the Detect layer
-            detect_layer.anchors = loaded_anchor_boxes
-
-            # Update the Conv2d layers in the Detect module to output 30 channels
-            for i, layer in enumerate(detect_layer.m):
-                in_channels = layer.in_channels
-                detect_layer.m[i] = torch.nn.Conv2d(in_channels, Constants.num_anchor_boxes * 6, kernel_size=1)
-
-
-            max_norm = 5
-
-            checkpoint = torch.load("../model_checkpoint213.pth", map_location=device)
-            cnn_model.load_state_dict(checkpoint['model_state_dict'])
-
-
-
-
-
-
-            image = image.to(device)
-            image = image.unsqueeze(0)
-
-            all_pred_coords = None
-            if True:
-                output = cnn_model(image)
-                all_pred_coords = []
-                all_pred_confidences = []
-                for i in range(len(output)):
-                    output[i] = output[i][..., :5]
-                    output[i] = postprocess_yolo_output(output[i],loaded_anchor_boxes[(i * 3):((i + 1) * 3)])
-                    output[i] = output[i].view(1, -1, 5)  # N = num_anchors * grid_h * grid_w
-
-                    output[i][..., :4] = yolo_to_corners_batches(output[i][..., :4])
-                
-                    #bbox, output, c = filter_and_trim_boxes(output, bbox)
-                    pred_boxes = output[i].reshape(1, -1, 5)  # N = num_anchors * grid_h * grid_w
-                    pred_coords = pred_boxes[..., :4]  # [batch_size, N, 4]
-                    pred_confidences = pred_boxes[..., 4]  # [batch_size, N]
-                    pred_confidences = pred_confidences.view(-1, 1)
-
-                    #pred_coords =  #yolo_to_corners(pred_coords.squeeze(0))
-                    pred_coords, pred_confidences = filter_confidences(pred_coords.squeeze(0), pred_confidences, 0.90)
-                    #pred_coords, pred_confidences = apply_nms(pred_coords, pred_confidences)
-
-                    all_pred_coords.append(pred_coords)
-                    all_pred_confidences.append(pred_confidences)
-
-                # Concatenate all the coordinates and confidences along the first dimension
-                all_pred_coords = torch.cat(all_pred_coords, dim=0)  # Shape: (total_boxes, 4)
-                all_pred_confidences = torch.cat(all_pred_confidences, dim=0)  # Shape: (total_boxes, 1)
-
-
-
-            all_pred_coords, all_pred_confidences = remove_contained_boxes(all_pred_coords, all_pred_confidences)
-            all_pred_coords, all_pred_confidences = apply_nms(all_pred_coords, all_pred_confidences, 0.5) #.1
-            #apc, apc2 = weighted_box_fusion(apc, apc2, 0.6)
-            all_pred_coords, all_pred_confidences = weighted_box_fusion(all_pred_coords, all_pred_confidences, 0.9)
-            all_pred_coords, all_pred_confidences = combine_boxes(all_pred_coords, all_pred_confidences, 0.7)
-            all_pred_coords, all_pred_confidences = combine_boxes(all_pred_coords, all_pred_confidences, 0.35)
-
-
-            mean=torch.tensor(means).to(device)
-            std=torch.tensor(stds).to(device)
-            un_normalized_img = image * std[:, None, None] + mean[:, None, None]
-
-            # Convert to PIL for display
-            rotated_img = transforms.ToPILImage()(image.squeeze(0).clamp(0, 1))
-            #bbox.squeeze()
-            path = DisplayImage.draw_bounding_boxes(rotated_img, None, all_pred_coords, all_pred_confidences, 0,0, 0, BBtransform)
-            print("Image of bounding boxes taken, stored in path:")
-            print(path)
-
-            #"C:\Users\evans\Desktop\Semester Projects\NetGrowth\backend\training_data\test\1c908cd87852e244.jpg"
-
-            CRNNtransform = transforms.Compose([
-            transforms.ToTensor(),
-            transforms.Normalize(mean=means, std=stds)
-        ])
-
-
-
-            bboxes = []
-            for bbox in all_pred_coords:
-                thisBox = torch.tensor([0, 0, 0, 0], dtype=torch.float32)  # Create a tensor
-                thisBox[0] = (bbox[0]  - adjustX1)/ scale_x
-                thisBox[1] = (bbox[1]  - adjustY1)/ scale_y
-                thisBox[2] = (bbox[2]  - adjustX1)/ scale_x
-                thisBox[3] = (bbox[3]  - adjustY1)/ scale_y
-                bboxes.append(thisBox)
-                
-
-            # Convert list of tensors into a single tensor
-            all_pred_coords = torch.stack(bboxes)
+                all_pred_coords = boxes_to_original(all_pred_coords, metas[0])
 
             path = DisplayImage.draw_bounding_boxes(ogImage, None, all_pred_coords, all_pred_confidences, 0,1, 0, BBtransform)
             print("Non Normalized copy stored in path:")
             print(path)
 
+            crops, kept = pipeline.extract_crops(ogImage, all_pred_coords)
+            all_pred_coords = all_pred_coords[kept]
 
-            num_classes = len(Constants.char_set) + 1  # +1 for CTC blank label
-            CRNNModel = CRNN(num_classes=num_classes, nc=3).to(device)
-            checkpoint = torch.load("../CRNNmodel_checkpoint_62.pth", map_location=device)
-            CRNNModel.load_state_dict(checkpoint['model_state_dict'])
-
-            image_tensor = CRNNtransform(ogImage.copy())
-            images = []
-            for bbox in all_pred_coords:
-                x_min_crop = max(0, int(bbox[0].round()))
-                y_min_crop = max(0, int(bbox[1].round()))
-                x_max_crop = int(bbox[2].round())
-                y_max_crop = int(bbox[3].round())
-
-                width_crop = x_max_crop - x_min_crop
-                height_crop = y_max_crop - y_min_crop
-
-                # Skip invalid crops
-                if width_crop <= 0 or height_crop <= 0:
-                    raise ValueError("Invalid crop dimensions")
-
-                # Crop the image tensor using the rotated bounding box
-                cropped_image = crop(
-                    image_tensor, y_min_crop, x_min_crop, height_crop, width_crop
-                )
-
-                fixed_height = 32
-                height = cropped_image.shape[1]
-                width = cropped_image.shape[2]
-                aspect_ratio = width / height
-                new_width = int(fixed_height * aspect_ratio)
-
-                # Resize to fixed height while maintaining aspect ratio
-                resized_image = transforms.functional.resize(
-                    cropped_image, size=(fixed_height, int(width * (fixed_height / height)))
-                )
-
-                images.append(resized_image)
-
-
-            images = custom_collate_fn(images)
-
-
-            images = images.to(device)
-
-
-            # Encode texts
-            label_encoder = LabelEncoder(Constants.char_set)
-
-            # Forward pass
-            outputs = CRNNModel(images)  # [T, N, C]
-            outputs = F.log_softmax(outputs, dim=2)
-
-            # Prepare input lengths
-            batch_size = images.size(0)
-            seq_len = outputs.size(0)
-            input_lengths = torch.full(size=(batch_size,), fill_value=seq_len, dtype=torch.long, device=device)
+            # Nothing to read, so the CRNN never has to be loaded
+            if len(crops) == 0:
+                print("No text found in the image.")
+                sys.exit(0)
 
-            _, preds = outputs.max(2)
-            preds = preds.transpose(1, 0).contiguous()  # [N, T]
-            pred_texts = label_encoder.decode(preds)
+            images = custom_collate_fn(crops)
+            pred_texts = pipeline.recognize_batch(images, widths=[c.shape[2] for c in crops])
 
             folder = "../backend/training_data/verify/epoch 0/text"
             if not os.path.exists(folder):
@@ -1325,7 +916,7 @@ if __name__ == "__main__":
 
 
 
-            del cnn_model
+            del pipeline
             gc.collect()
             #test_loss, test_acc = evaluate(cnn_model, test_loader, criterion)
             #print("\nFinal Evaluation on Test Set:")